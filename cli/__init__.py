@@ -0,0 +1,5 @@
+from .batch import run_batch, run_item
+from .pipeline import run_pipeline
+from .worker import run_worker
+
+__all__ = ['run_batch', 'run_item', 'run_pipeline', 'run_worker']
@@ -0,0 +1,173 @@
+"""
+Headless batch runner
+
+Usage:
+    python -m cli batch content|code|hallucination <folder> [options]
+    python -m cli batch content|code <folder> --dry-run [options]
+    python -m cli pipeline <folder> [options]
+    python -m cli worker content|code|hallucination <folder> [options]
+
+Progress is printed to stdout as JSON lines, logs go to stderr.
+"""
+import argparse
+import sys
+from pathlib import Path
+from typing import List, Optional
+
+from loguru import logger
+
+from entity import ModelProvider, ModelSettings
+from util import MAX_ATTEMPTS, AIMDController, ProviderPools, TokenBudget, read_model_settings, read_pools, \
+    read_settings
+from .batch import run_batch, run_estimate
+from .pipeline import STAGES, run_pipeline
+from .worker import run_worker
+
+
+def _model_settings(args: argparse.Namespace) -> ModelSettings:
+    """
+    Read the saved model settings and apply the provider options
+    """
+    model_settings = read_model_settings()
+    if args.provider:
+        model_settings.provider = ModelProvider(args.provider)
+
+    prefix = model_settings.provider.value.lower()
+    if args.model:
+        setattr(model_settings, f"{prefix}_model", args.model)
+    if args.api_key:
+        setattr(model_settings, f"{prefix}_api_key", args.api_key)
+    if args.api_host:
+        setattr(model_settings, f"{prefix}_api_host", args.api_host)
+    if args.temperature is not None:
+        model_settings.temperature = args.temperature
+    return model_settings
+
+
+def _add_common_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("folder", type=Path)
+    parser.add_argument("--images", nargs="+", help="Image names relative to the folder, all images by default")
+    parser.add_argument("--concurrency", type=int, default=2, help="Initial number of concurrent requests")
+    parser.add_argument("--timeout", type=int, default=120, help="Request timeout in seconds")
+    parser.add_argument("--restart", action="store_true", help="Discard the interrupted job instead of resuming it")
+    parser.add_argument("--only-stale", action="store_true",
+                        help="Skip images whose image, source, prompt and model are unchanged since the last run")
+    parser.add_argument("--provider", choices=[p.value for p in ModelProvider])
+    parser.add_argument("--model")
+    parser.add_argument("--api-key")
+    parser.add_argument("--api-host")
+    parser.add_argument("--temperature", type=float)
+    parser.add_argument("--log-level", default="INFO")
+    parser.add_argument("--report-dir", type=Path,
+                        help="Directory of the JSON and CSV run report, the configured one or .tcg/reports by default")
+
+
+def _parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m cli", description="Headless test code generator")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    batch = commands.add_parser("batch", help="Run a batch over an image folder")
+    batch.add_argument("kind", choices=["content", "code", "hallucination"])
+    _add_common_arguments(batch)
+    batch.add_argument("--max-concurrency", type=int, default=16, help="Maximum number of concurrent requests")
+    batch.add_argument("--dry-run", action="store_true",
+                       help="Estimate the tokens, cost and duration of the batch without sending anything")
+    batch.add_argument("--max-tokens", type=int, help="Stop dispatching once this many tokens are used")
+    batch.add_argument("--max-cost", type=float, help="Stop dispatching once this many USD are spent")
+    batch.add_argument("--pools", type=Path,
+                       help="JSON file of provider pools to shard the batch over, each with its own provider, model, "
+                            "API key, concurrency and requests per minute")
+
+    pipeline = commands.add_parser("pipeline", help="Run content, code and hallucination check per image")
+    _add_common_arguments(pipeline)
+    pipeline.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES, help="Stages to run, all by default")
+    pipeline.add_argument("--content-concurrency", type=int, default=8,
+                          help="Maximum number of concurrent content requests")
+    pipeline.add_argument("--code-concurrency", type=int, default=8,
+                          help="Maximum number of concurrent code requests")
+    pipeline.add_argument("--hallucination-concurrency", type=int, default=4,
+                          help="Maximum number of concurrent hallucination checks")
+
+    worker = commands.add_parser("worker", help="Work on the shared job of a kind together with other workers")
+    worker.add_argument("kind", choices=["content", "code", "hallucination"])
+    _add_common_arguments(worker)
+    worker.add_argument("--max-concurrency", type=int, default=16, help="Maximum number of concurrent requests")
+    worker.add_argument("--lease", type=float, default=60.0, help="Seconds a claimed image stays leased without "
+                                                                   "a heartbeat")
+    worker.add_argument("--max-attempts", type=int, default=MAX_ATTEMPTS,
+                        help="Attempts of a failed image before the workers give up on it")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = _parser().parse_args(argv)
+
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level)
+
+    if not args.folder.is_dir():
+        logger.error(f"Invalid folder: {args.folder}")
+        return 2
+
+    upload_code = read_settings("upload_code", "upload_code", default=True, type_=bool)
+    if args.command == "pipeline":
+        return run_pipeline(args.folder,
+                            images=args.images,
+                            stages=args.stages,
+                            model_settings=_model_settings(args),
+                            controllers={
+                                stage: AIMDController(initial=min(args.concurrency, maximum), maximum=maximum)
+                                for stage, maximum in (("content", args.content_concurrency),
+                                                       ("code", args.code_concurrency),
+                                                       ("hallucination", args.hallucination_concurrency))
+                            },
+                            timeout=args.timeout,
+                            upload_code=upload_code,
+                            resume=not args.restart,
+                            only_stale=args.only_stale,
+                            report_dir=args.report_dir)
+
+    if args.command == "worker":
+        return run_worker(args.kind,
+                          args.folder,
+                          images=args.images,
+                          model_settings=_model_settings(args),
+                          controller=AIMDController(initial=args.concurrency, maximum=args.max_concurrency),
+                          timeout=args.timeout,
+                          upload_code=upload_code,
+                          only_stale=args.only_stale,
+                          lease=args.lease,
+                          max_attempts=args.max_attempts,
+                          report_dir=args.report_dir)
+
+    model_settings = _model_settings(args)
+    if args.dry_run:
+        return run_estimate(args.kind, args.folder, images=args.images, model_settings=model_settings,
+                            upload_code=upload_code)
+
+    try:
+        pools = read_pools(model_settings, args.pools, max_concurrency=args.max_concurrency) if args.pools else None
+        budget = TokenBudget(max_tokens=args.max_tokens, max_cost=args.max_cost,
+                             model_settings=pools[0].model_settings if pools else model_settings)
+        if pools and budget.max_cost is not None and not ProviderPools(pools).priced:
+            raise ValueError("The price of a pool model is unknown, use a token budget instead")
+    except ValueError as e:
+        logger.error(str(e))
+        return 2
+
+    return run_batch(args.kind,
+                     args.folder,
+                     images=args.images,
+                     model_settings=model_settings,
+                     controller=AIMDController(initial=args.concurrency, maximum=args.max_concurrency),
+                     timeout=args.timeout,
+                     upload_code=upload_code,
+                     resume=not args.restart,
+                     only_stale=args.only_stale,
+                     budget=budget,
+                     report_dir=args.report_dir,
+                     pools=pools)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,344 @@
+import json
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Literal, Optional, Tuple
+
+from loguru import logger
+
+from entity import ModelSettings, SupportedImage
+from util import AIMDController, BatchJournal, Manifest, PriorityScheduler, ProviderPool, \
+    ProviderPools, TokenBudget, chat, classify_error, code_prompt, estimate_batch, hallucination, input_hashes, \
+    last_usage, load_detail, model_tag, save_report, save_result, save_verdicts, source_file, system_prompt
+
+HeadlessKind = Literal["content", "code", "hallucination"]
+
+
+def emit(event: str, **fields: Any) -> None:
+    """
+    Print a progress event as a single JSON line on stdout
+
+    Args:
+        event: The event name, one of "start", "item", "interrupted", "budget", "estimate", "done" and "report"
+        **fields: The event fields
+    """
+    print(json.dumps({"event": event, "time": round(time.time(), 3), **fields}, ensure_ascii=False), flush=True)
+
+
+def report(journal: BatchJournal,
+           job_id: int,
+           model_settings: ModelSettings,
+           directory: Optional[Path],
+           **run: Any) -> None:
+    """
+    Write the run report of a job and print its paths as a "report" event
+
+    Args:
+        journal: The journal of the folder
+        job_id: The job
+        model_settings: The model settings the job ran with
+        directory: The report directory, the configured one if None
+        **run: Extra fields describing the run
+    """
+    try:
+        json_path, csv_path = save_report(journal, job_id, model_settings=model_settings, directory=directory,
+                                          run={"headless": True, **run})
+    except OSError as e:
+        logger.error(f"Failed to write the report of job {job_id}: {e}")
+        return
+    emit("report", job=job_id, json=str(json_path), csv=str(csv_path))
+
+
+def item_inputs(kind: HeadlessKind,
+                image: Path,
+                model_settings: ModelSettings,
+                upload_code: bool) -> Dict[str, str]:
+    """
+    Hash the inputs of an item for the manifest
+    """
+    return input_hashes(kind, image, system=system_prompt(kind), model_settings=model_settings,
+                        detail=load_detail(image) if kind != "content" else None, upload_code=upload_code)
+
+
+def by_source(folder: Path, names: List[str], upload_code: bool) -> List[str]:
+    """
+    Order the images of a code batch by the source file their prompt includes, so that the requests of the same file
+    are sent back to back and share the cached prompt prefix
+
+    Args:
+        folder: The image folder
+        names: The image names
+        upload_code: Whether the source code is part of the code prompt
+
+    Returns:
+        The image names, the ones of a source file together in the order the files first appear
+    """
+    scheduler: PriorityScheduler[str] = PriorityScheduler(("grouped",))
+    for name in names:
+        try:
+            path = source_file(load_detail(folder / name), upload_code)
+        except (OSError, ValueError):
+            path = None
+        scheduler.put(name, name, group=str(path) if path else None)
+    return [scheduler.get() for _ in range(len(scheduler))]
+
+
+def run_item(kind: HeadlessKind,
+             image: Path,
+             model_settings: ModelSettings,
+             timeout: int,
+             upload_code: bool,
+             manifest: Optional[Manifest] = None) -> Dict[str, Any]:
+    """
+    Process a single image and persist its result into the sidecar
+
+    Args:
+        kind: The kind of the batch
+        image: The path to the image file
+        model_settings: The model settings to chat with
+        timeout: Chat timeout in seconds
+        upload_code: Whether to upload the source code for code generation
+        manifest: The manifest to record the inputs of the result in
+
+    Returns:
+        Extra fields for the progress event
+    """
+    match kind:
+        case "content":
+            inputs = item_inputs(kind, image, model_settings, upload_code)
+            result = chat(system=system_prompt("content"), image_url=str(image),
+                          timeout=timeout, model_settings=model_settings)
+            save_result("content", image, result, model_tag(model_settings))
+            if manifest:
+                manifest.record(image.name, kind, inputs)
+            input_tokens, output_tokens = last_usage()
+            return {"tokens": input_tokens + output_tokens, "input_tokens": input_tokens,
+                    "output_tokens": output_tokens}
+        case "code":
+            detail = load_detail(image)
+            inputs = input_hashes(kind, image, system=system_prompt("code"), model_settings=model_settings,
+                                  detail=detail, upload_code=upload_code)
+            result = chat(system=system_prompt("code"), text=code_prompt(detail, upload_code),
+                          image_url=str(image), timeout=timeout, model_settings=model_settings)
+            blocks = len(save_result("code", image, result, model_tag(model_settings)).code)
+            if manifest:
+                manifest.record(image.name, kind, inputs)
+            input_tokens, output_tokens = last_usage()
+            return {"blocks": blocks, "tokens": input_tokens + output_tokens, "input_tokens": input_tokens,
+                    "output_tokens": output_tokens}
+        case "hallucination":
+            detail = load_detail(image)
+            inputs = input_hashes(kind, image, system=system_prompt("hallucination"),
+                                  model_settings=model_settings, detail=detail)
+            verdicts = hallucination(image, model_settings, detail)
+            save_verdicts(image, detail.code, verdicts)
+            if manifest:
+                manifest.record(image.name, kind, inputs)
+            return {"verdicts": verdicts, "hallucinations": verdicts.count(True)}
+        case _:
+            raise ValueError(f"Invalid batch kind: {kind}")
+
+
+def run_estimate(kind: HeadlessKind,
+                 folder: Path,
+                 *,
+                 images: Optional[List[str]] = None,
+                 model_settings: ModelSettings,
+                 upload_code: bool = True) -> int:
+    """
+    Estimate the tokens, cost and duration of a batch without sending anything, printed as an "estimate" event
+
+    Returns:
+        The exit code, 0 if the batch could be estimated
+    """
+    if kind == "hallucination":
+        logger.error("Only content and code batches can be estimated")
+        return 2
+
+    journal = BatchJournal(folder)
+    history = journal.history(kind)
+    journal.close()
+    if not images:
+        images = sorted(f.name for f in folder.glob("*.*") if SupportedImage(f).is_supported())
+    estimate = estimate_batch(kind, folder, images, system=system_prompt(kind), model_settings=model_settings,
+                              upload_code=upload_code, history=history)
+    emit("estimate", kind=kind, folder=str(folder), history=bool(history), **estimate)
+    return 0
+
+
+def select_job(journal: BatchJournal,
+               kind: str,
+               images: Optional[List[str]],
+               model_settings: ModelSettings,
+               resume: bool,
+               pools: Optional[List[str]] = None) -> Tuple[int, List[str], bool]:
+    """
+    Resume the interrupted job of the kind, or create a new one
+
+    Args:
+        journal: The journal of the folder
+        kind: The kind of the batch
+        images: Image names relative to the folder, all supported images if empty
+        model_settings: The model settings of the batch
+        resume: Whether to resume the interrupted job of the kind
+        pools: The names of the provider pools the batch is sharded over
+
+    Returns:
+        The job id, the image names to process and whether the job is resumed
+    """
+    job_id = journal.unfinished_job(kind)
+    remaining = journal.remaining(job_id) if job_id is not None else []
+    if remaining and resume:
+        return job_id, remaining, True
+
+    if remaining:
+        journal.set_job_status(job_id, "discarded")
+    elif job_id is not None:
+        journal.close_job(job_id)
+
+    if not images:
+        images = sorted(f.name for f in journal.folder.glob("*.*") if SupportedImage(f).is_supported())
+    config = {
+        "headless": True,
+        "provider": model_settings.provider.value,
+        "system": system_prompt(kind) if kind != "pipeline" else None,
+    }
+    if pools:
+        config["pools"] = pools
+    return journal.create_job(kind, images, config), images, False
+
+
+def run_batch(kind: HeadlessKind,
+              folder: Path,
+              *,
+              images: Optional[List[str]] = None,
+              model_settings: ModelSettings,
+              controller: AIMDController,
+              timeout: int = 120,
+              upload_code: bool = True,
+              resume: bool = True,
+              only_stale: bool = False,
+              budget: Optional[TokenBudget] = None,
+              report_dir: Optional[Path] = None,
+              pools: Optional[List[ProviderPool]] = None) -> int:
+    """
+    Run a batch over a folder on a thread pool, without a Qt event loop
+
+    With provider pools, the queue is sharded over them, and every pool runs its own concurrency controller and rate
+    limiter.
+
+    Args:
+        kind: The kind of the batch
+        folder: The image folder
+        images: Image names relative to the folder, all supported images if empty
+        model_settings: The model settings to chat with
+        controller: The concurrency controller, its maximum is the size of the thread pool
+        timeout: Chat timeout in seconds
+        upload_code: Whether to upload the source code for code generation
+        resume: Whether to resume the interrupted job of the kind
+        only_stale: Whether to skip items whose inputs are unchanged since the last run, resumed items are always
+            skipped then
+        budget: The token or cost cap, no new images are dispatched once it is exhausted
+        report_dir: The directory of the run report, the configured one if None
+        pools: The provider pools to shard the batch over, a single pool of the model settings and the controller if
+            None
+
+    Returns:
+        The exit code, 0 if every image finished
+    """
+    shards: ProviderPools[str] = ProviderPools(
+        pools or [ProviderPool(model_tag(model_settings), model_settings, controller=controller)])
+    model_settings = shards.primary.model_settings
+    journal = BatchJournal(folder)
+    manifest = Manifest(folder)
+    job_id, names, resumed = select_job(journal, kind, images, model_settings, resume,
+                                        [pool.name for pool in pools] if pools else None)
+
+    skipped = 0
+    # A resumed image whose inputs are unchanged since it was generated, e.g. by another run, is not generated again
+    if only_stale or resumed:
+        stale = []
+        for name in names:
+            if manifest.is_stale(name, kind, item_inputs(kind, folder / name, model_settings, upload_code)):
+                stale.append(name)
+            else:
+                journal.mark(job_id, name, "skipped")
+                skipped += 1
+        names = stale
+    emit("start", job=job_id, kind=kind, folder=str(folder), total=len(names), resumed=resumed, skipped=skipped)
+
+    pending: Deque[str] = deque(by_source(folder, names, upload_code) if kind == "code" else names)
+    running: Dict[Future, Tuple[str, float, ProviderPool]] = {}
+    counts = {"finished": 0, "failed": 0}
+
+    with ThreadPoolExecutor(max_workers=shards.maximum) as executor:
+        while pending or shards or running:
+            try:
+                if (pending or shards) and budget and budget.exhausted:
+                    # The rest stays pending in the journal and is resumed by the next run
+                    pending.extend(shards.drain())
+                    logger.warning(f"Budget exhausted ({budget.summary()}), waiting for {len(running)} running "
+                                   f"requests...")
+                    emit("budget", job=job_id, spent=budget.summary(), in_flight=len(running), pending=len(pending))
+                    pending.clear()
+                while True:
+                    while pending and shards.wants():
+                        shards.put(pending.popleft())
+                    if (picked := shards.next()) is None:
+                        break
+                    pool, name = picked
+                    pool.on_dispatch()
+                    future = executor.submit(run_item, kind, folder / name, pool.model_settings, timeout,
+                                             upload_code, manifest)
+                    running[future] = (name, time.monotonic(), pool)
+
+                done, _ = wait(running, timeout=1.0, return_when=FIRST_COMPLETED)
+            except KeyboardInterrupt:
+                # Stop dispatching and drain the in-flight requests, the rest stays pending in the journal
+                pending.extend(shards.drain())
+                logger.warning(f"Interrupted, waiting for {len(running)} running requests...")
+                emit("interrupted", job=job_id, in_flight=len(running), pending=len(pending))
+                pending.clear()
+                continue
+
+            if not done and not running:
+                # Every pool waits for its rate limiter
+                time.sleep(0.1)
+            for future in done:
+                name, started, pool = running.pop(future)
+                latency = time.monotonic() - started
+                fields: Dict[str, Any] = {"image": name, "latency": round(latency, 3)}
+                if pools:
+                    fields["pool"] = pool.name
+                try:
+                    fields.update(future.result())
+                    pool.controller.on_success(latency)
+                    journal.mark(job_id, name, "finished")
+                    fields["status"] = "finished"
+                    journal.record_usage(job_id, name, latency, fields.get("input_tokens"), fields.get("output_tokens"),
+                                         pool.tag)
+                    if budget and "input_tokens" in fields:
+                        budget.spend(fields["input_tokens"], fields["output_tokens"], pool.model_settings)
+                except Exception as e:
+                    error_kind = classify_error(e)
+                    pool.controller.on_failure(error_kind)
+                    journal.mark(job_id, name, "failed", str(e))
+                    journal.record_usage(job_id, name, latency, model=pool.tag)
+                    logger.error(f"{name} failed! Error: {e}")
+                    fields.update(status="failed", error=str(e), error_kind=error_kind)
+                counts[fields["status"]] += 1
+                emit("item", **fields,
+                     done=sum(counts.values()), total=len(names),
+                     limit=shards.limit, throughput=round(sum(pool.controller.throughput() for pool in shards), 2))
+
+    status = journal.close_job(job_id)
+    emit("done", job=job_id, status=status, **counts)
+    run: Dict[str, Any] = {"max_concurrency": shards.maximum}
+    if pools:
+        logger.info(f"Provider pools: {shards.summary()}")
+        run["pools"] = shards.stats()
+    report(journal, job_id, model_settings, report_dir, **run)
+    journal.close()
+    manifest.close()
+    return 0 if status == "finished" else 1
@@ -0,0 +1,107 @@
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Literal, Optional
+
+from loguru import logger
+
+from entity import ModelSettings
+from util import AIMDController, BatchJournal, Manifest, Pipeline, PipelineStage
+from .batch import emit, item_inputs, report, run_item, select_job
+
+PipelineStageName = Literal["content", "code", "hallucination"]
+STAGES: List[PipelineStageName] = ["content", "code", "hallucination"]
+
+
+def _stage_func(stage: PipelineStageName,
+                folder: Path,
+                model_settings: ModelSettings,
+                timeout: int,
+                upload_code: bool,
+                manifest: Manifest,
+                skip_fresh: bool) -> Callable[[str], Dict[str, Any]]:
+    """
+    Build the function of a pipeline stage, it processes an image name and persists the result into the sidecar
+    """
+
+    def func(name: str) -> Dict[str, Any]:
+        image = folder / name
+        if skip_fresh and not manifest.is_stale(name, stage, item_inputs(stage, image, model_settings, upload_code)):
+            return {"skipped": True}
+        return run_item(stage, image, model_settings, timeout, upload_code, manifest)
+
+    return func
+
+
+def run_pipeline(folder: Path,
+                 *,
+                 images: Optional[List[str]] = None,
+                 stages: Optional[List[PipelineStageName]] = None,
+                 model_settings: ModelSettings,
+                 controllers: Dict[PipelineStageName, AIMDController],
+                 timeout: int = 120,
+                 upload_code: bool = True,
+                 resume: bool = True,
+                 only_stale: bool = False,
+                 report_dir: Optional[Path] = None) -> int:
+    """
+    Run every image through content generation, code generation and the hallucination check, each image enters a stage
+    as soon as it has left the previous one
+
+    Args:
+        folder: The image folder
+        images: Image names relative to the folder, all supported images if empty
+        stages: The stages to run in order, all stages by default
+        model_settings: The model settings to chat with
+        controllers: The concurrency controller of each stage
+        timeout: Chat timeout in seconds
+        upload_code: Whether to upload the source code for code generation
+        resume: Whether to resume the interrupted pipeline job
+        only_stale: Whether to skip stages whose inputs are unchanged since the last run
+        report_dir: The directory of the run report, the configured one if None
+
+    Returns:
+        The exit code, 0 if every image passed every stage
+    """
+    stages = [stage for stage in STAGES if stage in (stages or STAGES)]
+    journal = BatchJournal(folder)
+    manifest = Manifest(folder)
+    job_id, names, resumed = select_job(journal, "pipeline", images, model_settings, resume)
+    emit("start", job=job_id, kind="pipeline", stages=stages, folder=str(folder), total=len(names), resumed=resumed)
+
+    # A resumed image skips the stages it already passed before the interruption
+    skip_fresh = only_stale or resumed
+    pipeline = Pipeline([PipelineStage(stage,
+                                       _stage_func(stage, folder, model_settings, timeout, upload_code, manifest,
+                                                   skip_fresh),
+                                       controllers[stage])
+                         for stage in stages])
+    done = {"finished": 0, "failed": 0}
+    # Latency and tokens of every image summed over its stages so far
+    usage: Dict[str, List[float]] = {}
+
+    def on_event(name: str, stage: str, status: str, fields: Dict[str, Any]) -> None:
+        total = usage.setdefault(name, [0.0, 0, 0])
+        total[0] += fields.get("latency", 0.0)
+        total[1] += fields.get("input_tokens", 0)
+        total[2] += fields.get("output_tokens", 0)
+        if status == "failed":
+            logger.error(f"{name} failed at {stage}! Error: {fields.get('error')}")
+            journal.mark(job_id, name, "failed", f"{stage}: {fields.get('error')}")
+            journal.record_usage(job_id, name, *usage.pop(name))
+            done["failed"] += 1
+        elif stage == stages[-1]:
+            journal.mark(job_id, name, "finished")
+            journal.record_usage(job_id, name, *usage.pop(name))
+            done["finished"] += 1
+        emit("item", image=name, stage=stage, status=status, **fields,
+             done=sum(done.values()), total=len(names),
+             limit=controllers[stage].limit, throughput=round(controllers[stage].throughput(), 2))
+
+    counts = pipeline.run(names, on_event)
+
+    status = journal.close_job(job_id)
+    emit("done", job=job_id, status=status, stages=counts, **done)
+    report(journal, job_id, model_settings, report_dir, stages=stages,
+           max_concurrency={stage: controllers[stage].maximum for stage in stages})
+    journal.close()
+    manifest.close()
+    return 0 if status == "finished" else 1
@@ -0,0 +1,138 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from entity import ModelSettings, SupportedImage
+from util import MAX_ATTEMPTS, AIMDController, BatchJournal, Manifest, classify_error, model_tag, system_prompt, \
+    worker_id
+from .batch import HeadlessKind, emit, item_inputs, report, run_item
+
+
+def run_worker(kind: HeadlessKind,
+               folder: Path,
+               *,
+               images: Optional[List[str]] = None,
+               model_settings: ModelSettings,
+               controller: AIMDController,
+               timeout: int = 120,
+               upload_code: bool = True,
+               only_stale: bool = False,
+               lease: float = 60.0,
+               poll: float = 5.0,
+               max_attempts: int = MAX_ATTEMPTS,
+               report_dir: Optional[Path] = None) -> int:
+    """
+    Work on the shared job of a kind until it is done, together with any number of other workers on this or other
+    machines that use the same folder
+
+    The first worker creates the job, the others join it. Each worker claims images with a lease and renews it while
+    working, so images of a crashed worker are picked up again once its lease expires. Failed images are claimed
+    again until they used ``max_attempts``, then they are settled and the job finishes, so that the next run of a worker
+    creates a new job instead of joining one it cannot make progress on.
+
+    Args:
+        kind: The kind of the batch
+        folder: The image folder, on a volume shared by all workers
+        images: Image names relative to the folder for a new job, all supported images if empty
+        model_settings: The model settings to chat with
+        controller: The concurrency controller, its maximum is the size of the thread pool
+        timeout: Chat timeout in seconds
+        upload_code: Whether to upload the source code for code generation
+        only_stale: Whether to skip items whose inputs are unchanged since the last run
+        lease: Seconds a claim lasts without a heartbeat
+        poll: Seconds between two claims when all remaining images are leased by other workers
+        max_attempts: Attempts of an image before the workers give up on it
+        report_dir: The directory of the run report, the configured one if None
+
+    Returns:
+        The exit code, 0 if the job finished without failed images or other workers still work on it
+    """
+    journal = BatchJournal(folder)
+    manifest = Manifest(folder)
+    owner = worker_id()
+
+    if not images:
+        images = sorted(f.name for f in folder.glob("*.*") if SupportedImage(f).is_supported())
+    config = {"headless": True, "system": system_prompt(kind)}
+    job_id, created = journal.open_job(kind, images, config)
+    emit("start", job=job_id, kind=kind, folder=str(folder), worker=owner, created=created)
+
+    running: Dict[Future, Tuple[str, float]] = {}
+    counts = {"finished": 0, "failed": 0, "skipped": 0}
+    last_heartbeat = time.monotonic()
+    stopping = False
+
+    with ThreadPoolExecutor(max_workers=controller.maximum) as executor:
+        while True:
+            try:
+                claimed = []
+                if not stopping and (free := controller.limit - controller.in_flight) > 0:
+                    claimed = journal.claim(job_id, owner, free, lease, max_attempts)
+                for name in claimed:
+                    if only_stale and \
+                            not manifest.is_stale(name, kind, item_inputs(kind, folder / name, model_settings,
+                                                                          upload_code)):
+                        journal.mark(job_id, name, "skipped")
+                        counts["skipped"] += 1
+                        continue
+                    controller.on_dispatch()
+                    future = executor.submit(run_item, kind, folder / name, model_settings, timeout, upload_code,
+                                             manifest)
+                    running[future] = (name, time.monotonic())
+
+                if not running:
+                    if claimed and not stopping:
+                        # Every claimed image was skipped, claim the next ones right away
+                        continue
+                    if stopping or not journal.leased(job_id):
+                        break
+                    # Other workers hold the rest, wait for them to finish or for their leases to expire
+                    time.sleep(poll)
+                    continue
+
+                done, _ = wait(running, timeout=1.0, return_when=FIRST_COMPLETED)
+            except KeyboardInterrupt:
+                logger.warning(f"Interrupted, waiting for {len(running)} running requests...")
+                emit("interrupted", job=job_id, worker=owner, in_flight=len(running))
+                stopping = True
+                continue
+
+            if time.monotonic() - last_heartbeat > lease / 3:
+                journal.heartbeat(job_id, owner, lease)
+                last_heartbeat = time.monotonic()
+
+            for future in done:
+                name, started = running.pop(future)
+                latency = time.monotonic() - started
+                fields: Dict[str, Any] = {"image": name, "latency": round(latency, 3)}
+                try:
+                    fields.update(future.result())
+                    controller.on_success(latency)
+                    journal.mark(job_id, name, "finished")
+                    fields["status"] = "finished"
+                    journal.record_usage(job_id, name, latency, fields.get("input_tokens"), fields.get("output_tokens"),
+                                         model_tag(model_settings))
+                except Exception as e:
+                    error_kind = classify_error(e)
+                    controller.on_failure(error_kind)
+                    journal.mark(job_id, name, "failed", str(e))
+                    journal.record_usage(job_id, name, latency, model=model_tag(model_settings))
+                    logger.error(f"{name} failed! Error: {e}")
+                    fields.update(status="failed", error=str(e), error_kind=error_kind)
+                counts[fields["status"]] += 1
+                emit("item", **fields, worker=owner,
+                     limit=controller.limit, throughput=round(controller.throughput(), 2))
+
+    journal.release(job_id, owner)
+    status = journal.close_job(job_id, max_attempts)
+    emit("done", job=job_id, worker=owner, status=status, **counts)
+    if status != "running":
+        # The last worker reports the whole job
+        report(journal, job_id, model_settings, report_dir, worker=owner, max_concurrency=controller.maximum)
+    failed = journal.failed(job_id)
+    journal.close()
+    manifest.close()
+    return 0 if status == "running" or (status == "finished" and not failed) else 1
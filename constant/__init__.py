@@ -51,12 +51,31 @@ Constraints:
 - Output True if hallucination exists, otherwise False.
 """
 
+PROMPT_HALLUCINATION_BATCH = """Role: Expert in frontend test
+Task: Detect for every test code block if it is not correct and the hallucination exists given the screenshot and source code.
+
+Focus Areas:
+1. Test code: Test if unknown or irrelevant code snippet is in each numbered test code block.
+2. Source code: Where test code should align with.
+3. Screenshot: The screenshot of the website.
+
+Constraints:
+- Output a JSON array with one verdict per test code block in their order, e.g. [true, false].
+- A verdict is true if hallucination exists in the block, otherwise false.
+- Output nothing but the JSON array.
+"""
+
 PROMPT_RELATED = """
 - Compare between images because they might be related and can transform to each other.
 """
 
 # ----------------------------------------------------------------------------------------------------------------------
 
+BATCH_FOLDER = ".tcg"
+BATCH_DATABASE = "batch.sqlite3"
+
+# ----------------------------------------------------------------------------------------------------------------------
+
 __all__ = [
     # project info
     "ORGANIZATION",
@@ -68,5 +87,10 @@ __all__ = [
     "PROMPT_CONTENT",
     "PROMPT_CODE",
     "PROMPT_HALLUCINATION",
+    "PROMPT_HALLUCINATION_BATCH",
     "PROMPT_RELATED",
+
+    # batch
+    "BATCH_FOLDER",
+    "BATCH_DATABASE",
 ]
@@ -7,3 +7,5 @@ class CodeBlock(BaseModel):
     """Represents a code block extracted from Markdown"""
     language: str = Field(default="text", description="The language of the code block")
     code: Optional[str] = Field(default=None, description="The code inside the code block")
+    hallucination: Optional[bool] = Field(default=None, description="Whether the hallucination check flagged the code "
+                                                                    "block, None if it has not been checked")
@@ -1,10 +1,16 @@
+import os
+import tempfile
 from pathlib import Path
-from typing import Optional, List
+from typing import Dict, Optional, List
 
 from pydantic import BaseModel, ConfigDict
 
 from .CodeBlock import CodeBlock
 
+# The umask can only be read by setting it, done once on import before any thread writes files
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
 
 class Detail(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -19,9 +25,27 @@ class Detail(BaseModel):
     code: List[CodeBlock] = []
     code_no_desc: List[CodeBlock] = []
 
+    # The provider and model that generated each field, e.g. {"code": "Claude/claude-3-7-sonnet-20250219"}
+    models: Dict[str, str] = {}
+
     @classmethod
     def load(cls, path: str) -> "Detail":
         return cls.model_validate_json(Path(path).read_text(), strict=False)
 
     def save(self, path: str) -> None:
-        Path(path).write_text(self.model_dump_json(indent=4))
+        """Write the detail atomically, so an interrupted write never leaves a truncated file behind"""
+        path = Path(path)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(self.model_dump_json(indent=4))
+            # mkstemp creates the file owner-only, keep the mode of the replaced file or the default of a new one
+            try:
+                mode = path.stat().st_mode & 0o7777
+            except FileNotFoundError:
+                mode = 0o666 & ~_UMASK
+            os.chmod(tmp, mode)
+            os.replace(tmp, path)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
@@ -1,5 +1,5 @@
 from enum import Enum, unique
-from typing import Dict, Union
+from typing import Dict, Tuple, Union
 
 from pydantic import BaseModel, Field
 
@@ -127,6 +127,22 @@ MAX_TOKEN_MAP: Dict[str, int] = {
     SiliconFlowModel.PRO_QWEN_QWEN2_5_VL_7B_INSTRUCT: 4 * 1024,
 }
 
+# USD per million input and output tokens, models without a price are estimated in tokens only
+PRICE_MAP: Dict[str, Tuple[float, float]] = {
+    OpenAIModel.O1: (15.0, 60.0),
+    OpenAIModel.GPT_4_5_PREVIEW: (75.0, 150.0),
+    OpenAIModel.GPT_4O: (2.5, 10.0),
+    OpenAIModel.GPT_4O_MINI: (0.15, 0.6),
+    OpenAIModel.GPT_4_TURBO: (10.0, 30.0),
+
+    ClaudeModel.CLAUDE_3_7_SONNET: (3.0, 15.0),
+    ClaudeModel.CLAUDE_3_5_SONNET_UPGRADED: (3.0, 15.0),
+    ClaudeModel.CLAUDE_3_5_SONNET_ORIGINAL: (3.0, 15.0),
+    ClaudeModel.CLAUDE_3_5_HAIKU: (0.8, 4.0),
+    ClaudeModel.CLAUDE_3_OPUS: (15.0, 75.0),
+    ClaudeModel.CLAUDE_3_HAIKU: (0.25, 1.25),
+}
+
 
 class ModelSettings(BaseModel):
     # Provider Configuration
@@ -1,7 +1,7 @@
 from .CodeBlock import CodeBlock
 from .Detail import Detail
 from .ImageFileInfo import ImageFileInfo
-from .ModelTypes import ModelProvider, ModelSettings, __GROUP_PROPERTY__, MAX_TOKEN_MAP
+from .ModelTypes import ModelProvider, ModelSettings, __GROUP_PROPERTY__, MAX_TOKEN_MAP, PRICE_MAP
 from .ModelTypes import OpenAIModel, ClaudeModel, SiliconFlowModel
 from .SupportedImage import SupportedImage
 
@@ -19,6 +19,7 @@ __all__ = [
     "ModelSettings",
     "__GROUP_PROPERTY__",
     "MAX_TOKEN_MAP",
+    "PRICE_MAP",
 
     "SupportedImage",
 ]
@@ -0,0 +1,1067 @@
+import itertools
+import os
+import time
+from pathlib import Path
+from threading import Lock
+from typing import Dict, Iterator, List, Literal, Optional, Set, Tuple
+
+from PySide6.QtCore import QObject, QRunnable, Slot, QThreadPool, QTimer, Qt
+from PySide6.QtGui import QCloseEvent
+from PySide6.QtWidgets import QDialog, QWidget, QPushButton, QDialogButtonBox, QMessageBox
+from loguru import logger
+
+from entity import SupportedImage
+from qmessagebox import invalid_folder, task_completed, leave_while_running, overwrite_files, too_few_files, \
+    resume_job, nothing_to_rerun, batch_estimate, invalid_configuration, unexpected_error
+from qobject import QBatchState, QCancellableChatWorker, QEstimateWorker
+from util import BatchJournal, BatchMetrics, classify_error, read_settings, write_settings, save_result, \
+    copy_result, Manifest, input_hashes, read_model_settings, worker_id, system_prompt, PriorityScheduler, \
+    estimated_size, DuplicateIndex, DuplicateMode, TokenBudget, format_estimate, image_preprocessor, max_edge, \
+    save_report, ProviderPool, ProviderPools, read_pools
+from .SettingsModel import SettingsModel
+
+
+class BatchDialog(QDialog):
+    """
+    Base of the batch dialogs that run a journaled job over the images of a folder.
+
+    The images of the job are fed from the journal into a priority queue chunk by chunk, sharded over the provider
+    pools and dispatched while the concurrency controller of a pool allows it. Failed images are retried in rounds,
+    a token or cost budget stops dispatching, and a paused job can be closed and resumed later. Subclasses set
+    ``KIND`` and mix in their UI, and may override the worker, the prompt and how a result is saved.
+
+    The UI of a subclass has ``check_box``, ``check_box_stale``, ``progress_bar``, ``label_status``, ``label_metrics``,
+    ``log_view`` and ``button_box``, and with ``GENERATION`` also ``combo_box_duplicates``, ``spin_box_max_cost`` and
+    ``spin_box_max_tokens``.
+    """
+    KIND = "content"
+    # What a new job overwrites, for the confirmation
+    OVERWRITES = "image contents"
+    # Whether the dialog offers the estimate, the handling of near-duplicates and the token and cost budget
+    GENERATION = True
+    LOG_LEVEL = "DEBUG"
+    MAX_CONCURRENCY = 16
+    STATUS_INTERVAL = 1000
+    LEASE = 60.0
+    FEED_CHUNK = 200
+    FEED_WINDOW = 1000
+    # Automatic retry rounds for failed images, with their own concurrency limit and a growing back-off in seconds
+    RETRY_ROUNDS = 2
+    RETRY_CONCURRENCY = 4
+    RETRY_DELAY = 5.0
+
+    def __init__(self, parent: QWidget = None):
+        super().__init__(parent)
+        self.setupUi(self)
+        self._folder = None
+        self._selected_images = []
+        self._current_image: Optional[str] = None
+
+        self._thread_pool = QThreadPool(self)
+        self._thread_pool.setMaxThreadCount(self.MAX_CONCURRENCY)
+        self._status_timer = QTimer(self)
+        self._feed_timer = QTimer(self)
+
+        self._pools: ProviderPools[Tuple[int, str]] = ProviderPools([])
+        self._metrics = BatchMetrics()
+        self._dispatch_times: Dict[int, float] = {}
+
+        self._state = QBatchState(self)
+        self._running: Dict[int, QRunnable] = {}
+        # The provider pool every running worker was dispatched to
+        self._assigned: Dict[int, ProviderPool] = {}
+        self._worker_queue: PriorityScheduler[Tuple[int, str]] = self._scheduler()
+        self._pending_images: Iterator[str] = iter(())
+        self._prioritized: Set[str] = set()
+        self._next_index = 0
+        self._feeding = False
+        # The signals of a worker reading what the chunk being fed is queued by, see ``_feed_chunk``
+        self._grouping: Optional[QObject] = None
+        self._retries: Set[str] = set()
+        self._retryable: Dict[int, str] = {}
+        self._retry_round = 0
+        self._retry_after = 0.0
+        self._aborted = False
+        self._paused = False
+        self._budget = TokenBudget()
+        self._usage: Dict[int, Tuple[int, int]] = {}
+
+        self._is_running = False
+        self._log_file = None
+        self._log_handlers: List[int] = []
+
+        self._journal: Optional[BatchJournal] = None
+        self._job_id: Optional[int] = None
+        self._owner = worker_id("gui")
+        self._last_heartbeat = 0.0
+
+        self._manifest: Optional[Manifest] = None
+        self._model_settings = None
+        self._only_stale = False
+        self._upload_code = True
+        self._duplicate_mode: DuplicateMode = "process"
+        self._duplicates: Optional[DuplicateIndex] = None
+        self._duplicates_lock = Lock()
+        # The first images of the groups of near-duplicates that are still in flight
+        self._representatives: Set[str] = set()
+        # Near-duplicates whose worker found their representative in flight, by index, with the representative and
+        # its distance
+        self._parked: Dict[int, Tuple[str, int]] = {}
+        # Near-duplicates waiting for the result of their representative without holding a thread or a slot, see
+        # ``_park``
+        self._waiting: Dict[str, List[Tuple[int, str, Optional[Dict[str, str]], int]]] = {}
+
+        self.__setup_ui_components()
+        self.__connect_signals()
+
+    @property
+    def folder(self) -> Path | None:
+        return self._folder
+
+    @folder.setter
+    def folder(self, value: Path) -> None:
+        self._folder = value
+
+    @property
+    def selected_images(self) -> List[str]:
+        return self._selected_images
+
+    @selected_images.setter
+    def selected_images(self, value: List[str]) -> None:
+        self._selected_images = value
+
+    @property
+    def current_image(self) -> Optional[str]:
+        return self._current_image
+
+    @current_image.setter
+    def current_image(self, value: Optional[str]) -> None:
+        self._current_image = value
+
+    @property
+    def is_running(self) -> bool:
+        """Whether a run is in progress, until its last request settles"""
+        return self._is_running
+
+    @property
+    def _section(self) -> str:
+        """The settings section of the dialog, its class name"""
+        return type(self).__name__
+
+    def __setup_ui_components(self) -> None:
+        self.check_box.setCheckState(read_settings(self._section, 'selected_images',
+                                                   Qt.CheckState.Checked, type_=Qt.CheckState))
+        self.check_box_stale.setCheckState(read_settings(self._section, 'only_stale',
+                                                         Qt.CheckState.Unchecked, type_=Qt.CheckState))
+        if self.GENERATION:
+            for text, mode in (("Process them", "process"),
+                               ("Reuse the result of a processed near-duplicate", "reuse"), ("Skip them", "skip")):
+                self.combo_box_duplicates.addItem(text, mode)
+            self.combo_box_duplicates.setCurrentIndex(
+                max(0, self.combo_box_duplicates.findData(read_settings(self._section, 'duplicates', "process"))))
+            self.spin_box_max_cost.setValue(read_settings(self._section, 'max_cost', 0.0, type_=float))
+            self.spin_box_max_tokens.setValue(read_settings(self._section, 'max_tokens', 0, type_=int))
+
+        self.estimate = QPushButton("Estimate")
+        self.start = QPushButton("Start")
+        self.rerun = QPushButton("Rerun failed")
+        self.pause = QPushButton("Pause")
+        self.model = QPushButton("Model")
+        self.abort = QPushButton("Abort")
+        self.cancel = QPushButton("Cancel")
+
+        if self.GENERATION:
+            self.button_box.addButton(self.estimate, QDialogButtonBox.ButtonRole.ActionRole)
+        self.button_box.addButton(self.start, QDialogButtonBox.ButtonRole.ActionRole)
+        self.button_box.addButton(self.rerun, QDialogButtonBox.ButtonRole.ActionRole)
+        self.button_box.addButton(self.pause, QDialogButtonBox.ButtonRole.ActionRole)
+        self.button_box.addButton(self.model, QDialogButtonBox.ButtonRole.ActionRole)
+        self.button_box.addButton(self.abort, QDialogButtonBox.ButtonRole.DestructiveRole)
+        self.button_box.addButton(self.cancel, QDialogButtonBox.ButtonRole.RejectRole)
+
+        self.pause.setDisabled(True)
+        self.model.setDisabled(True)
+        self.abort.setDisabled(True)
+
+    def __connect_signals(self) -> None:
+        self._status_timer.timeout.connect(self._update_status)
+        self._feed_timer.timeout.connect(self._feed)
+        self._state.changed.connect(self._update_progress)
+        self._state.completed.connect(self._on_completed)
+
+        self.check_box.checkStateChanged.connect(self.on_check_box_check_state_changed)
+        self.check_box_stale.checkStateChanged.connect(self.on_check_box_stale_check_state_changed)
+        if self.GENERATION:
+            self.combo_box_duplicates.currentIndexChanged.connect(self.on_combo_box_duplicates_current_index_changed)
+            self.spin_box_max_cost.valueChanged.connect(self.on_spin_box_max_cost_value_changed)
+            self.spin_box_max_tokens.valueChanged.connect(self.on_spin_box_max_tokens_value_changed)
+
+        self.estimate.clicked.connect(self.on_estimate_clicked)
+        self.start.clicked.connect(self.on_start_clicked)
+        self.rerun.clicked.connect(self.on_rerun_clicked)
+        self.pause.clicked.connect(self.on_pause_clicked)
+        self.model.clicked.connect(self.on_model_clicked)
+        self.abort.clicked.connect(self.on_abort_clicked)
+        self.cancel.clicked.connect(self.on_cancel_clicked)
+
+    def _scheduler(self) -> PriorityScheduler[Tuple[int, str]]:
+        """
+        Create the queue of a run, see ``PriorityScheduler`` for its policies
+        """
+        return PriorityScheduler()
+
+    def _settle(self, index: int, status: Literal["finished", "skipped", "failed", "canceled"]) -> None:
+        """
+        Settle a worker and keep dispatching, completion is signaled by the batch state
+        """
+        self._running.pop(index, None)
+        self._state.settle(index, status)
+        if self._is_running:
+            self._dispatch()
+
+    @Slot()
+    def _update_progress(self) -> None:
+        self.progress_bar.setValue(self._state.settled)
+
+    @Slot()
+    def _on_completed(self) -> None:
+        """
+        Handle the completion of all workers
+        """
+        if self._retryable and not self._aborted and self._retry_round < self.RETRY_ROUNDS:
+            self._start_retry_round()
+            return
+
+        self._is_running = False
+        self._status_timer.stop()
+        self._paused = False
+        self._update_status()
+        self.pause.setText("Pause")
+        self.pause.setDisabled(True)
+        self.model.setDisabled(True)
+        self.abort.setDisabled(True)
+        self.start.setEnabled(True)
+        self.rerun.setEnabled(True)
+        self.cancel.setEnabled(True)
+
+        if self._duplicates is not None:
+            self._duplicates.close()
+            self._duplicates = None
+        if self._manifest is not None:
+            self._manifest.close()
+            self._manifest = None
+
+        self._journal.release(self._job_id, self._owner)
+        if self._journal.close_job(self._job_id) == "interrupted":
+            logger.warning(f"Job {self._job_id} has unfinished images, start again to resume it")
+        report = self._save_report()
+        self._journal.close()
+        self._journal = None
+
+        task_completed(self,
+                       message=f"Succeed: {self._state.count('finished')}\rFailed: {self._state.count('failed')}"
+                               f"\rSkipped: {self._state.count('skipped')}\rCanceled: {self._state.count('canceled')}"
+                               f"{self._summary()}\nTask log file is saved to {self._log_file}{report}")
+        logger.info("All tasks completed!")
+        self._remove_log_handlers()
+
+    def _summary(self) -> str:
+        """
+        Get the lines the completion message adds to the counts of the images
+        """
+        return f"\nStopped by the budget ({self._budget.summary()}), start again to resume" \
+            if self._budget.exhausted else ""
+
+    def _save_report(self) -> str:
+        """
+        Write the JSON and CSV run report of the job
+
+        Returns:
+            A line for the completion message, empty if the report could not be written
+        """
+        try:
+            json_path, csv_path = save_report(self._journal, self._job_id, model_settings=self._model_settings,
+                                              run={"max_concurrency": self._pools.maximum,
+                                                   "retry_rounds": self._retry_round,
+                                                   "pools": self._pools.stats()})
+        except OSError as e:
+            logger.error(f"Failed to write the report of job {self._job_id}: {e}")
+            return ""
+        logger.info(f"Run report is saved to {json_path} and {csv_path.name}")
+        return f"\nRun report is saved to {json_path}"
+
+    def _add_log_handlers(self) -> None:
+        """
+        Log into the log view and into the log file of the run
+        """
+        self._log_handlers = [logger.add(self.log_view.sink, level="DEBUG"),
+                              logger.add(Path(self._log_file).open("w"), level=self.LOG_LEVEL)]
+
+    def _remove_log_handlers(self) -> None:
+        for handler in self._log_handlers:
+            logger.remove(handler)
+        self._log_handlers = []
+
+    def _reset_state(self):
+        self.log_view.clear()
+        self.progress_bar.setValue(0)
+
+        self._state.reset()
+        self._running.clear()
+        self._assigned.clear()
+        self._worker_queue = self._scheduler()
+        self._pending_images = iter(())
+        self._prioritized.clear()
+        self._next_index = 0
+        self._feeding = False
+        self._grouping = None
+        self._pools: ProviderPools[Tuple[int, str]] = ProviderPools([])
+        self._metrics = BatchMetrics()
+        self._dispatch_times.clear()
+        self._representatives.clear()
+        self._parked.clear()
+        self._waiting.clear()
+        self._retryable.clear()
+        self._retry_round = 0
+        self._retry_after = 0.0
+        self._aborted = False
+        self._paused = False
+        self._budget = TokenBudget()
+        self._usage.clear()
+        self._is_running = False
+
+        logger.remove()
+        self._log_handlers = []
+
+    def _start_retry_round(self) -> None:
+        """
+        Queue the images that failed in the last round again, they are dispatched by the status timer after a back-off
+        """
+        self._retry_round += 1
+        retryable, self._retryable = self._retryable, {}
+        delay = self.RETRY_DELAY * self._retry_round
+        logger.info(f"Retry round {self._retry_round}/{self.RETRY_ROUNDS}: retrying {len(retryable)} failed images "
+                    f"in {delay:.0f} seconds")
+
+        for pool in self._pools:
+            pool.restart(initial=1, maximum=self.RETRY_CONCURRENCY)
+        self._retry_after = time.monotonic() + delay
+        self._state.requeue(retryable)
+        for index, image_name in retryable.items():
+            self._worker_queue.put(image_name, (index, image_name), retry=True)
+
+    def _dispatch(self) -> None:
+        """
+        Start queued workers while the concurrency controller allows it
+        """
+        if self._paused or time.monotonic() < self._retry_after:
+            return
+        if self._budget.exhausted:
+            if not self._aborted:
+                logger.warning(f"Budget exhausted ({self._budget.summary()}), waiting for {len(self._running)} "
+                               f"running requests, start again to resume the rest")
+                self._stop_scheduling()
+            return
+        while True:
+            # Every pool keeps up to its concurrency limit of queued images in its shard
+            while self._pools.wants() and not self._worker_queue.empty():
+                self._pools.put(self._worker_queue.get())
+            if (picked := self._pools.next()) is None:
+                break
+            pool, (index, image_name) = picked
+            if not self._journal.claim_image(self._job_id, image_name, self._owner, self.LEASE):
+                logger.info(f"{index}: {image_name} is done or leased by another worker, skipped")
+                self._state.settle(index, "skipped")
+                continue
+            # Decode and encode the image in the preprocessing pool while the worker builds the prompt
+            image_preprocessor.prefetch([self.folder / image_name], max_edge(pool.model_settings.provider))
+            worker = self._setup_worker(index, self.folder / image_name, pool)
+            self._state.start(index)
+            self._running[index] = worker
+            self._assigned[index] = pool
+            self._dispatch_times[index] = time.monotonic()
+            pool.on_dispatch()
+            self._thread_pool.start(worker)
+        if self._feeding and not self._feed_timer.isActive() and len(self._worker_queue) < self.FEED_WINDOW:
+            self._feed_timer.start(0)
+
+    def _enqueue(self, image_name: str, group: Optional[str] = None, size: Optional[int] = None) -> None:
+        index = self._next_index
+        self._next_index += 1
+        self._state.enqueue(index)
+        self._worker_queue.put(image_name, (index, image_name), size=self._size(image_name) if size is None else size,
+                               retry=image_name in self._retries, group=group)
+
+    def _size(self, image_name: str) -> int:
+        """
+        Estimate the size of the request of an image, smaller ones are dispatched first
+        """
+        return estimated_size(self.KIND, self.folder / image_name)
+
+    @Slot()
+    def _feed(self) -> None:
+        """
+        Move the next chunk of remaining images into the queue while it is shorter than the feed window, workers are
+        only created when they are dispatched
+        """
+        if not self._feeding:
+            return
+        if self._grouping is not None or len(self._worker_queue) >= self.FEED_WINDOW:
+            # Resumed once the chunk in flight is queued, or by dispatching
+            self._feed_timer.stop()
+            return
+        self._feed_chunk(list(itertools.islice(self._pending_images, self.FEED_CHUNK)))
+
+    def _feed_chunk(self, chunk: List[str]) -> None:
+        """
+        Queue a chunk of images. A subclass may read what the images are queued by off the GUI thread first, it sets
+        ``_grouping`` to the signals of its worker meanwhile and calls ``_queue_chunk`` once they are known.
+        """
+        self._queue_chunk([(image_name, None, None) for image_name in chunk])
+
+    def _queue_chunk(self, groups: List[Tuple[str, Optional[str], Optional[int]]]) -> None:
+        """
+        Queue a chunk of images with the groups they are dispatched in and the sizes of their requests, see ``_size``
+        if a size is None, and go on feeding unless it was the last one
+        """
+        for image_name, group, size in groups:
+            self._enqueue(image_name, group, size)
+        if len(groups) < self.FEED_CHUNK:
+            self._feeding = False
+            self._feed_timer.stop()
+            self._state.seal()
+        elif not self._feed_timer.isActive():
+            self._feed_timer.start(0)
+        if self._is_running:
+            self._dispatch()
+
+    def _latency(self, index: int) -> float:
+        """
+        Get the latency of a worker since it was dispatched
+        """
+        return time.monotonic() - self._dispatch_times.pop(index, time.monotonic())
+
+    @Slot()
+    def _update_status(self) -> None:
+        """
+        Show the current concurrency limit and the live metrics, and retry dispatching after a back-off
+        """
+        self.label_status.setText(f"Concurrency limit: {self._pools.limit}"
+                                  f" | In flight: {self._pools.in_flight}"
+                                  f" | Done: {self._state.settled}/{self.progress_bar.maximum()}"
+                                  f"{self._status()}"
+                                  + (" | Paused" if self._paused else "")
+                                  + (f" | {self._pools.summary()}" if len(self._pools.pools) > 1 else ""))
+        self.label_metrics.setText(self._metrics.summary(self._state.outstanding))
+        if self._is_running:
+            if time.monotonic() - self._last_heartbeat > self.LEASE / 3:
+                self._journal.heartbeat(self._job_id, self._owner, self.LEASE)
+                self._last_heartbeat = time.monotonic()
+            self._dispatch()
+
+    def _status(self) -> str:
+        """
+        Get the fields the status line adds to the concurrency and the progress
+        """
+        return f" | Spent: {self._budget.summary()}"
+
+    def _mark(self,
+              image_path: str,
+              status: Literal["finished", "skipped", "failed", "canceled"],
+              error: str = None) -> None:
+        """
+        Record the status of an image in the job journal
+        """
+        if self._journal and self._job_id is not None:
+            self._journal.mark(self._job_id, Path(image_path).name, status, error)
+
+        # Resolve the near-duplicates waiting for this image, they only reuse a finished result
+        with self._duplicates_lock:
+            if Path(image_path).name not in self._representatives:
+                return
+            self._representatives.discard(Path(image_path).name)
+            if status != "finished":
+                self._duplicates.remove(Path(image_path).name)
+            waiting = self._waiting.pop(Path(image_path).name, [])
+        for index, image_name, inputs, distance in waiting:
+            self._resolve(index, image_name, inputs, Path(image_path).name, distance)
+
+    def _persist(self, index: int, image_path: str, result: str, model: str) -> None:
+        """
+        Write the result of a worker into its sidecar right away, so nothing but in-flight results is held in memory
+        """
+        try:
+            save_result(self.KIND, image_path, result, model)
+            if (worker := self._running.get(index)) and worker.inputs:
+                self._manifest.record(Path(image_path).name, self.KIND, worker.inputs)
+        except Exception as e:
+            logger.error(f"{index}: {image_path} failed to save! Error: {e}")
+            self._mark(image_path, "failed", str(e))
+            self._settle(index, "failed")
+            return
+
+        self._mark(image_path, "finished")
+        logger.success(f"{index}: {image_path} finished!")
+        self._settle(index, "finished")
+
+    def _setup_worker(self, index: int, image: Path, pool: ProviderPool) -> QRunnable:
+        worker = QCancellableChatWorker()
+        worker.system = system_prompt(self.KIND)
+        worker.prepare = self._prepare
+        worker.image = str(image.absolute())
+        worker.index = index
+        worker.model_settings = pool.model_settings
+
+        # Connect signals
+        self._connect_worker(worker)
+        worker.signals.usage.connect(self.on_worker_usage)
+
+        return worker
+
+    def _connect_worker(self, worker: QRunnable) -> None:
+        worker.signals.finished.connect(self.on_worker_finished)
+        worker.signals.failed.connect(self.on_worker_failed)
+        worker.signals.canceled.connect(self.on_worker_canceled)
+        worker.signals.skipped.connect(self.on_worker_skipped)
+
+    def _prepare(self, worker: QRunnable) -> bool:
+        """
+        Hash the inputs on the worker thread right before the request
+
+        Returns:
+            False if only stale images are processed and the inputs of the image are unchanged, or if the image is a
+            near-duplicate of a processed one and near-duplicates are not processed
+        """
+        image_name = Path(worker.image).name
+        worker.inputs = self._input_hashes(worker)
+        if self._only_stale and not self._manifest.is_stale(image_name, self.KIND, worker.inputs):
+            logger.info(f"{worker.index}: {worker.image} is up to date")
+            return False
+        return self._duplicates is None or not self._handle_duplicate(worker, image_name)
+
+    def _input_hashes(self, worker: QRunnable) -> Dict[str, str]:
+        """
+        Hash the inputs of the request of a worker for the manifest, see ``input_hashes``
+        """
+        return input_hashes(self.KIND, Path(worker.image), system=system_prompt(self.KIND),
+                            model_settings=worker.model_settings)
+
+    def _duplicate_of(self, worker: QRunnable, image_name: str, image_hash: int) -> List[Tuple[str, int]]:
+        """
+        Find the processed near-duplicates of an image whose result it may share, the closest first
+        """
+        return self._duplicates.matches(image_hash, exclude=image_name)
+
+    def _handle_duplicate(self, worker: QRunnable, image_name: str) -> bool:
+        """
+        Reuse the result of a near-duplicate of an image, or skip the image, on the worker thread. The first image of a
+        group of near-duplicates is processed, the others are parked until its result is known, see ``_park``.
+
+        Returns:
+            True if the image is a near-duplicate and has been handled or parked
+        """
+        image_hash = self._duplicates.hash(image_name)
+        with self._duplicates_lock:
+            matches = self._duplicate_of(worker, image_name, image_hash)
+            if not matches:
+                self._duplicates.add(image_name, image_hash)
+                self._representatives.add(image_name)
+                return False
+            duplicate, distance = matches[0]
+            if duplicate in self._representatives:
+                # Skipped for now, the worker returns right away instead of waiting for the result
+                self._parked[worker.index] = (duplicate, distance)
+                return True
+
+        self._reuse(worker.index, image_name, worker.inputs, duplicate, distance)
+        return True
+
+    def _reuse(self, index: int, image_name: str, inputs: Optional[Dict[str, str]], duplicate: str,
+               distance: int) -> None:
+        """
+        Copy the result of a processed near-duplicate into the sidecar of an image, or only log it when skipping
+        """
+        if self._duplicate_mode == "reuse":
+            copy_result(self.KIND, self.folder / duplicate, self.folder / image_name)
+            if inputs:
+                self._manifest.record(image_name, self.KIND, inputs)
+            logger.info(f"{index}: {image_name} reused the result of {duplicate} (distance {distance})")
+        else:
+            logger.info(f"{index}: {image_name} is a near-duplicate of {duplicate} (distance {distance})")
+
+    def _park(self, index: int, image_name: str, duplicate: str, distance: int) -> None:
+        """
+        Keep a near-duplicate out of the scheduler until its representative settles, its thread and concurrency slot
+        are free for other images meanwhile
+        """
+        worker = self._running.pop(index)
+        if self._aborted:
+            self._state.settle(index, "canceled")
+            return
+        self._state.park(index)
+        with self._duplicates_lock:
+            if duplicate in self._representatives:
+                self._waiting.setdefault(duplicate, []).append((index, image_name, worker.inputs, distance))
+                logger.info(f"{index}: {image_name} waits for the result of its near-duplicate {duplicate}")
+                return
+        # The representative settled while the worker was returning
+        self._resolve(index, image_name, worker.inputs, duplicate, distance)
+
+    def _resolve(self, index: int, image_name: str, inputs: Optional[Dict[str, str]], duplicate: str,
+                 distance: int) -> None:
+        """
+        Settle a parked near-duplicate with the finished result of its representative, or queue it again to be
+        processed itself if the representative did not finish
+        """
+        if duplicate not in self._duplicates:
+            logger.info(f"{index}: {image_name} is processed itself, its near-duplicate {duplicate} did not finish")
+            # Queued ahead of the fresh images, like a retry
+            self._worker_queue.put(image_name, (index, image_name), size=self._size(image_name), retry=True)
+            return
+        try:
+            self._reuse(index, image_name, inputs, duplicate, distance)
+        except Exception as e:
+            logger.error(f"{index}: {image_name} failed to reuse the result of {duplicate}! Error: {e}")
+            self._mark(str(self.folder / image_name), "failed", str(e))
+            self._retryable[index] = image_name
+            self._settle(index, "failed")
+            return
+        self._mark(str(self.folder / image_name), "skipped")
+        self._settle(index, "skipped")
+
+    def _has_images(self) -> bool:
+        """
+        Check if a new job has images to process, the selected ones are needed unless it runs over the whole folder
+        """
+        return self.check_box.checkState() != Qt.CheckState.Checked or bool(self.selected_images)
+
+    def _chosen_images(self) -> Iterator[str]:
+        """
+        Iterate over the images a new job processes, the selected ones or all images of the folder
+        """
+        if self.check_box.checkState() == Qt.CheckState.Checked:
+            return (name for name in self.selected_images if SupportedImage(self.folder / name).is_supported())
+        return (entry.name for entry in os.scandir(self.folder) if SupportedImage(entry.path).is_supported())
+
+    def _stop_scheduling(self) -> None:
+        """
+        Stop feeding and dispatching, the queued images stay unfinished in the journal and no retry round follows
+        """
+        self._aborted = True
+        self._feeding = False
+        self._grouping = None
+        self._feed_timer.stop()
+        self._pending_images = iter(())
+        while not self._worker_queue.empty():
+            index, _ = self._worker_queue.get()
+            self._state.settle(index, "canceled")
+        for index, _ in self._pools.drain():
+            self._state.settle(index, "canceled")
+        with self._duplicates_lock:
+            waiting, self._waiting = self._waiting, {}
+        for index, _, _, _ in itertools.chain.from_iterable(waiting.values()):
+            self._state.settle(index, "canceled")
+        self._state.seal()
+
+    def _run(self, journal: BatchJournal, job_id: Optional[int], only: Optional[List[str]] = None) -> None:
+        """
+        Start a run of a job
+
+        Args:
+            journal: The journal of the folder
+            job_id: The job to resume, a new job over the chosen images is created if None
+            only: Run only these images of the job, e.g. the failed ones
+        """
+        try:
+            pools = self._read_pools()
+            budget = self._read_budget(pools)
+        except ValueError as e:
+            invalid_configuration(self, message=str(e))
+            return
+
+        # Reset state
+        self._reset_state()
+        self._budget = budget
+        self._pools = pools
+        self._thread_pool.setMaxThreadCount(max(self.MAX_CONCURRENCY, pools.maximum))
+
+        # Setup logging
+        self._log_file = f"batch_{self.KIND}_{time.strftime('%Y_%m_%d_%H_%M_%S')}.log"
+        self._add_log_handlers()
+        logger.info(f"Starting... Log file is saved to {self._log_file}")
+
+        # Images are listed into the journal as a stream, and fed into the queue chunk by chunk from there
+        if only is not None:
+            logger.info(f"Rerunning {len(only)} failed images of job {job_id}")
+        elif job_id is not None:
+            logger.info(f"Resuming job {job_id}")
+        else:
+            job_id = journal.create_job(self.KIND, self._chosen_images(), {"system": system_prompt(self.KIND)})
+        self._journal, self._job_id = journal, job_id
+        self.progress_bar.setMaximum(len(only) if only is not None else self._journal.remaining_count(self._job_id))
+        logger.info(f"Found {self.progress_bar.maximum()} images to process")
+
+        self._manifest = Manifest(self.folder)
+        self._model_settings = pools.primary.model_settings
+        if len(pools.pools) > 1:
+            logger.info(f"Sharding over {len(pools.pools)} provider pools: "
+                        f"{', '.join(f'{pool.name} ({pool.tag})' for pool in pools)}")
+        if budget.max_tokens or budget.max_cost:
+            logger.info(f"Budget: {budget.summary()}")
+        self._only_stale = self.check_box_stale.checkState() == Qt.CheckState.Checked
+        self._upload_code = read_settings("upload_code", "upload_code", default=True, type_=bool)
+        self._duplicate_mode = self.combo_box_duplicates.currentData() if self.GENERATION else "process"
+        if self._duplicate_mode != "process":
+            # Images processed before are the candidates, the ones processed in this run are added as they finish
+            self._duplicates = DuplicateIndex(self.folder, hasher=image_preprocessor.dhash)
+            logger.info(f"Indexed {self._duplicates.load(self._manifest.images(self.KIND))} processed images for "
+                        f"near-duplicates")
+        self._retries = self._journal.retries(self._job_id)
+
+        if only is not None:
+            self._pending_images = iter(only)
+        else:
+            # The viewed image, the selected ones when running over the whole folder and failed images go first
+            self._worker_queue.current = self.current_image
+            prioritized = [self.current_image] if self.current_image else []
+            if self.check_box.checkState() != Qt.CheckState.Checked:
+                for image_name in self.selected_images:
+                    self._worker_queue.pin(image_name)
+                prioritized += self.selected_images
+            prioritized += sorted(self._retries)
+            for image_name in dict.fromkeys(prioritized):
+                if self._journal.is_remaining(self._job_id, image_name):
+                    self._prioritized.add(image_name)
+                    self._enqueue(image_name)
+            self._pending_images = (name for name in self._journal.iter_remaining(self._job_id)
+                                    if name not in self._prioritized)
+
+        # Update UI state
+        self._is_running = True
+        self._feeding = True
+        self._status_timer.start(self.STATUS_INTERVAL)
+        self._update_status()
+        self.start.setDisabled(True)
+        self.rerun.setDisabled(True)
+        self.pause.setEnabled(True)
+        self.abort.setEnabled(True)
+        self.cancel.setDisabled(True)
+        self._feed()
+
+    def _read_pools(self) -> ProviderPools[Tuple[int, str]]:
+        """
+        Read the provider pools the batch is sharded over, a single pool of the model settings if none are configured
+
+        Raises:
+            ValueError: If the pool file is invalid
+        """
+        model_settings = read_model_settings()
+        pools = read_pools(model_settings, max_concurrency=self.MAX_CONCURRENCY)
+        return ProviderPools(pools) if pools else ProviderPools.single(model_settings, self.MAX_CONCURRENCY)
+
+    def _read_budget(self, pools: ProviderPools) -> TokenBudget:
+        """
+        Read the token and cost cap of a run, unlimited without ``GENERATION``
+
+        Raises:
+            ValueError: If a cost cap is set and the price of a pool model is unknown
+        """
+        if not self.GENERATION:
+            return TokenBudget()
+        budget = TokenBudget(max_tokens=self.spin_box_max_tokens.value() * 1000 or None,
+                             max_cost=self.spin_box_max_cost.value() or None,
+                             model_settings=pools.primary.model_settings)
+        if budget.max_cost is not None and not pools.priced:
+            raise ValueError("The price of a pool model is unknown, use a token budget instead")
+        return budget
+
+    def _reload_model_settings(self) -> bool:
+        """
+        Pick up the model settings and provider pools changed while paused, the requests dispatched after resuming use
+        them
+
+        Returns:
+            False if the pools are invalid or the budget cannot price their models
+        """
+        try:
+            pools = self._read_pools()
+            if [pool.config for pool in pools] == [pool.config for pool in self._pools]:
+                return True
+            if self._budget.max_cost is not None and not pools.priced:
+                raise ValueError("The price of a pool model is unknown, use a token budget instead")
+            self._budget.switch_model(pools.primary.model_settings)
+        except ValueError as e:
+            invalid_configuration(self, message=str(e))
+            return False
+
+        # The limits learned by the previous pools do not hold for the new ones, the running requests still count
+        for index, pool in self._assigned.items():
+            if (same := pools.pool(pool.name)) is not None:
+                same.controller.on_dispatch()
+                self._assigned[index] = same
+        for item in self._pools.drain():
+            pools.put(item)
+        self._pools = pools
+        self._model_settings = pools.primary.model_settings
+        self._thread_pool.setMaxThreadCount(max(self.MAX_CONCURRENCY, pools.maximum))
+        logger.info(f"Model settings changed, continuing with {', '.join(pool.tag for pool in pools)}")
+        return True
+
+    def _notify_before_exiting(self, event: QCloseEvent = None):
+        # The queued images of a paused job stay unfinished in the journal, and are resumed by the next start
+        message = "The batch is paused. Do you want to close and resume the remaining images next time?" \
+            if self._paused else "Tasks are still running. Do you want to abort and close?"
+        if not self._is_running:
+            return
+        if QMessageBox.StandardButton.Yes == leave_while_running(self, message=message):
+            self.on_abort_clicked(True)
+        elif event:
+            event.ignore()
+
+    @Slot(int)
+    def on_check_box_check_state_changed(self, state: int) -> None:
+        write_settings(self._section, 'selected_images', state)
+
+    @Slot(int)
+    def on_check_box_stale_check_state_changed(self, state: int) -> None:
+        write_settings(self._section, 'only_stale', state)
+
+    @Slot(int)
+    def on_combo_box_duplicates_current_index_changed(self, _: int) -> None:
+        write_settings(self._section, 'duplicates', self.combo_box_duplicates.currentData())
+
+    @Slot(float)
+    def on_spin_box_max_cost_value_changed(self, value: float) -> None:
+        write_settings(self._section, 'max_cost', value)
+
+    @Slot(int)
+    def on_spin_box_max_tokens_value_changed(self, value: int) -> None:
+        write_settings(self._section, 'max_tokens', value)
+
+    @Slot(bool)
+    def on_estimate_clicked(self, _: bool) -> None:
+        """
+        Estimate the tokens, cost and duration of a new job in the background, without sending anything
+        """
+        if not self.folder:
+            invalid_folder(self)
+            return
+        if not self._has_images():
+            too_few_files(self, message="Please select at least one image")
+            return
+
+        journal = BatchJournal(self.folder)
+        try:
+            history = journal.history(self.KIND)
+        finally:
+            journal.close()
+        worker = QEstimateWorker(self.KIND, self.folder, self._chosen_images(), system=system_prompt(self.KIND),
+                                 model_settings=read_model_settings(),
+                                 upload_code=read_settings("upload_code", "upload_code", default=True, type_=bool),
+                                 history=history)
+        worker.signals.finished.connect(self.on_estimate_finished)
+        worker.signals.failed.connect(self.on_estimate_failed)
+        self.estimate.setDisabled(True)
+        self._thread_pool.start(worker)
+
+    @Slot(dict)
+    def on_estimate_finished(self, estimate: dict) -> None:
+        self.estimate.setEnabled(True)
+        notes = []
+        if estimate["cost"] is None:
+            notes.append("The price of the model is unknown.")
+        if estimate["duration"] is None:
+            notes.append("The duration is known once a batch has run.")
+        batch_estimate(self, message="\n".join([format_estimate(estimate), *notes]))
+
+    @Slot(Exception)
+    def on_estimate_failed(self, error: Exception) -> None:
+        self.estimate.setEnabled(True)
+        unexpected_error(self, message=f"Failed to estimate the batch: {error}")
+
+    @Slot(bool)
+    def on_start_clicked(self, _: bool) -> None:
+        if not self.folder:
+            invalid_folder(self)
+            return
+
+        # Offer to resume an interrupted job
+        journal = BatchJournal(self.folder)
+        try:
+            job_id = journal.unfinished_job(self.KIND)
+            remaining = journal.remaining_count(job_id) if job_id is not None else 0
+            if remaining:
+                reply = resume_job(self, message=f"The last batch {self.KIND} job was interrupted with {remaining}"
+                                                 f" images left. Resume it and skip the finished images?")
+                if reply == QMessageBox.StandardButton.Cancel:
+                    return
+                if reply == QMessageBox.StandardButton.No:
+                    journal.set_job_status(job_id, "discarded")
+                    remaining = 0
+            elif job_id is not None:
+                journal.close_job(job_id)
+
+            if not remaining:
+                if not self._has_images():
+                    too_few_files(self, message="Please select at least one image")
+                    return
+
+                if QMessageBox.StandardButton.No == \
+                        overwrite_files(self, message=f"This action will OVERWRITE all existing {self.OVERWRITES}. "
+                                                      f"Continue?"):
+                    return
+
+            self._run(journal, job_id if remaining else None)
+        finally:
+            # The journal of a started run is closed once it completes
+            if self._journal is not journal:
+                journal.close()
+
+    @Slot(bool)
+    def on_rerun_clicked(self, _: bool) -> None:
+        """
+        Run the failed images of the last job again, without confirmation and without touching the other images
+        """
+        if not self.folder:
+            invalid_folder(self)
+            return
+
+        journal = BatchJournal(self.folder)
+        try:
+            job_id = journal.unfinished_job(self.KIND)
+            if not (failed := journal.failed(job_id) if job_id is not None else []):
+                nothing_to_rerun(self, message=f"The last batch {self.KIND} job has no failed images")
+                return
+            self._run(journal, job_id, only=failed)
+        finally:
+            # The journal of a started run is closed once it completes
+            if self._journal is not journal:
+                journal.close()
+
+    @Slot(bool)
+    def on_pause_clicked(self, _: bool) -> None:
+        """
+        Stop dispatching while the running requests finish, or resume with the model settings saved in the meantime
+        """
+        if not self._paused:
+            self._paused = True
+            self.pause.setText("Resume")
+            self.model.setEnabled(True)
+            logger.warning(f"Paused, waiting for {len(self._running)} running requests, the queued ones are kept")
+            self._update_status()
+            return
+
+        if not self._reload_model_settings():
+            return
+        self._paused = False
+        self.pause.setText("Pause")
+        self.model.setDisabled(True)
+        logger.info("Resumed")
+        self._update_status()
+
+    @Slot(bool)
+    def on_model_clicked(self, _: bool) -> None:
+        """
+        Edit the model settings while paused, e.g. to switch the provider after errors
+        """
+        SettingsModel(self).exec()
+
+    @Slot(bool)
+    def on_abort_clicked(self, _: bool) -> None:
+        self.pause.setDisabled(True)
+        self.model.setDisabled(True)
+        self.abort.setDisabled(True)
+        for worker in self._running.values():
+            worker.cancel()
+        self._stop_scheduling()
+
+        logger.warning("User aborted...")
+
+    @Slot(bool)
+    def on_cancel_clicked(self, _: bool) -> None:
+        """
+        Handle the cancellation of the batch
+        """
+        # Asks to abort a running batch, see ``closeEvent``
+        self.close()
+
+    @Slot(int, str, object)
+    def on_worker_finished(self, index: int, image_path: str, result: object) -> None:
+        """
+        Handle the completion of a worker, the result is the chat response or the verdicts of a hallucination check
+        """
+        latency = self._latency(index)
+        pool = self._assigned.pop(index)
+        pool.controller.on_success(latency)
+        self._metrics.record("finished", latency)
+        logger.trace(f"result for {index} {image_path}: {result}")
+        self._journal.record_usage(self._job_id, Path(image_path).name, latency, *self._usage.pop(index, (0, 0)),
+                                   model=pool.tag)
+        self._persist(index, image_path, result, pool.tag)
+
+    @Slot(int, str, Exception)
+    def on_worker_failed(self, index: int, image_path: str, error: Exception) -> None:
+        """
+        Handle the failure of a worker
+        """
+        latency = self._latency(index)
+        error_kind = classify_error(error)
+        pool = self._assigned.pop(index)
+        pool.controller.on_failure(error_kind)
+        self._metrics.record("failed", latency, error_kind)
+        error_msg = str(error)
+        if hasattr(error, 'with_traceback'):
+            logger.error(f"{index}: {image_path} failed! Error: {error_msg}\n{error.with_traceback(None)}")
+        else:
+            logger.error(f"{index}: {image_path} failed! Error: {error_msg}")
+        self._mark(image_path, "failed", error_msg)
+        self._journal.record_usage(self._job_id, Path(image_path).name, latency, model=pool.tag)
+        self._retryable[index] = Path(image_path).name
+        self._settle(index, "failed")
+
+    @Slot(int, int, int)
+    def on_worker_usage(self, index: int, input_tokens: int, output_tokens: int) -> None:
+        self._metrics.record_tokens(input_tokens + output_tokens)
+        self._budget.spend(input_tokens, output_tokens, self._assigned[index].model_settings)
+        self._usage[index] = (input_tokens, output_tokens)
+
+    @Slot(int, str)
+    def on_worker_skipped(self, index: int, image_path: str) -> None:
+        """
+        Handle a worker whose image is up to date, a near-duplicate or has nothing to process
+        """
+        self._latency(index)
+        self._assigned.pop(index).controller.on_cancel()
+        with self._duplicates_lock:
+            parked = self._parked.pop(index, None)
+        if parked is not None:
+            self._park(index, Path(image_path).name, *parked)
+            if self._is_running:
+                self._dispatch()
+            return
+        logger.info(f"{index}: {image_path} skipped")
+        self._mark(image_path, "skipped")
+        self._settle(index, "skipped")
+
+    @Slot(int, str)
+    def on_worker_canceled(self, index: int, image_path: str) -> None:
+        """
+        Handle the cancellation of a worker
+        """
+        self._latency(index)
+        self._assigned.pop(index).controller.on_cancel()
+        self._metrics.record("canceled")
+        self._usage.pop(index, None)
+        logger.warning(f"{index}: {image_path} canceled!")
+        self._mark(image_path, "canceled")
+        self._settle(index, "canceled")
+
+    def closeEvent(self, event: QCloseEvent) -> None:
+        """
+        Handle the close event of the batch
+        """
+        self._notify_before_exiting(event)
+        if event.isAccepted():
+            self._remove_log_handlers()
+            # Hides the dialog and emits ``finished``
+            super().closeEvent(event)
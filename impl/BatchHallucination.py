@@ -0,0 +1,98 @@
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from PySide6.QtWidgets import QWidget
+from loguru import logger
+
+from qobject import QCancellableHallucinationWorker
+from qwindow import BatchHallucinationUi
+from util import save_verdicts, input_hashes, read_model_settings, system_prompt, estimated_size, ProviderPool, \
+    ProviderPools
+from .BatchDialog import BatchDialog
+
+
+class BatchHallucination(BatchDialog, BatchHallucinationUi):
+    """
+    Check the code of the images of a folder for hallucinated APIs, see ``BatchDialog`` for how the batch runs. The
+    check runs against the model settings only, without an estimate, near-duplicates or a budget.
+    """
+    KIND = "hallucination"
+    OVERWRITES = "hallucination verdicts"
+    GENERATION = False
+    # Every image makes one request per code block, so fewer images run at once than in the other batches
+    MAX_CONCURRENCY = 8
+    RETRY_CONCURRENCY = 2
+
+    def __init__(self, parent: QWidget = None):
+        # Images with at least one flagged code block, and the number of flagged blocks
+        self._flagged: Dict[str, int] = {}
+        super().__init__(parent)
+
+    def _summary(self) -> str:
+        return f"\nHallucinations: {sum(self._flagged.values())} code blocks in {len(self._flagged)} images"
+
+    def _reset_state(self):
+        super()._reset_state()
+        self._flagged.clear()
+
+    def _size(self, image_name: str) -> int:
+        return estimated_size("code", self.folder / image_name, source=False)
+
+    def _status(self) -> str:
+        return f" | Flagged: {len(self._flagged)}"
+
+    def _persist(self, index: int, image_path: str, verdicts: List[Optional[bool]], model: str) -> None:
+        """
+        Write the verdicts of a worker into its sidecar right away
+        """
+        try:
+            worker = self._running.get(index)
+            save_verdicts(image_path, worker.detail.code, verdicts)
+            if worker.inputs:
+                self._manifest.record(Path(image_path).name, self.KIND, worker.inputs)
+        except Exception as e:
+            logger.error(f"{index}: {image_path} failed to save! Error: {e}")
+            self._mark(image_path, "failed", str(e))
+            self._settle(index, "failed")
+            return
+
+        self._mark(image_path, "finished")
+        if flagged := verdicts.count(True):
+            self._flagged[Path(image_path).name] = flagged
+            logger.warning(f"{index}: {image_path} has hallucinations in {flagged} of {len(verdicts)} code blocks!")
+        else:
+            logger.success(f"{index}: {image_path} finished!")
+        self._settle(index, "finished")
+
+    def _setup_worker(self, index: int, image: Path, pool: ProviderPool) -> QCancellableHallucinationWorker:
+        worker = QCancellableHallucinationWorker()
+        worker.model_settings = pool.model_settings
+        worker.prepare = self._prepare
+        worker.image = str(image.absolute())
+        worker.index = index
+
+        # Connect signals
+        self._connect_worker(worker)
+
+        return worker
+
+    def _prepare(self, worker: QCancellableHallucinationWorker) -> bool:
+        """
+        Load the detail on the worker thread right before the check, see ``BatchDialog._prepare``
+
+        Returns:
+            False if the image has no code, or if only unchecked images are processed and the code and source of the
+            image are unchanged since the last check
+        """
+        if not worker.detail.code:
+            logger.info(f"{worker.index}: {worker.image} has no code to check")
+            return False
+        return super()._prepare(worker)
+
+    def _input_hashes(self, worker: QCancellableHallucinationWorker) -> Dict[str, str]:
+        return input_hashes(self.KIND, Path(worker.image), system=system_prompt(self.KIND),
+                            model_settings=worker.model_settings, detail=worker.detail)
+
+    def _read_pools(self) -> ProviderPools[Tuple[int, str]]:
+        # The check runs against the model settings, not the provider pools of the generation
+        return ProviderPools.single(read_model_settings(), self.MAX_CONCURRENCY)
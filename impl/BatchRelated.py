@@ -0,0 +1,661 @@
+import os
+import time
+from collections import deque
+from pathlib import Path
+from typing import Deque, Dict, List, Literal, Optional, Tuple
+
+from PySide6.QtCore import Slot, QThreadPool, QTimer, Qt
+from PySide6.QtGui import QCloseEvent
+from PySide6.QtWidgets import QDialog, QWidget, QPushButton, QDialogButtonBox, QMessageBox
+from loguru import logger
+
+from constant import PROMPT_RELATED
+from entity import SupportedImage
+from qmessagebox import invalid_folder, task_completed, leave_while_running, overwrite_files, too_few_files, \
+    failed_to_generate, resume_job
+from qobject import QBatchState, QCancellableChatWorker, QClusterWorker
+from qwindow import BatchRelatedUi
+from util import AIMDController, BatchJournal, BatchMetrics, classify_error, read_settings, write_settings, \
+    apply_result, load_detail, sidecar_path, system_prompt, code_prompt, MAX_GROUP, group_images, group_key, \
+    image_preprocessor, max_edge, model_tag, read_model_settings, save_report, worker_id
+from .SettingsModel import SettingsModel
+
+
+# noinspection DuplicatedCode
+class BatchRelated(QDialog, BatchRelatedUi):
+    # Every request carries a whole group of images, so fewer requests run at once than in the other batches
+    MAX_CONCURRENCY = 8
+    STATUS_INTERVAL = 1000
+    LEASE = 60.0
+    # Automatic retry rounds for failed groups, with their own concurrency limit and a growing back-off in seconds
+    RETRY_ROUNDS = 2
+    RETRY_CONCURRENCY = 2
+    RETRY_DELAY = 5.0
+
+    def __init__(self, parent: QWidget = None):
+        super().__init__(parent)
+        self.setupUi(self)
+        self._folder = None
+        self._selected_images = []
+
+        self._thread_pool = QThreadPool(self)
+        self._thread_pool.setMaxThreadCount(self.MAX_CONCURRENCY)
+        self._status_timer = QTimer(self)
+
+        self._controller = AIMDController(maximum=self.MAX_CONCURRENCY)
+        self._metrics = BatchMetrics()
+        self._dispatch_times: Dict[int, float] = {}
+
+        self._state = QBatchState(self)
+        self._running: Dict[int, QCancellableChatWorker] = {}
+        self._worker_queue: Deque[int] = deque()
+        # The image names of every group, the first one is the image whose detail is sent along
+        self._groups: Dict[int, List[str]] = {}
+        self._grouping = False
+        self._image_count = 0
+        self._retryable: List[int] = []
+        self._retry_round = 0
+        self._retry_after = 0.0
+        self._aborted = False
+        self._paused = False
+        self._usage: Dict[int, Tuple[int, int]] = {}
+
+        self._is_running = False
+        self._log_file = None
+        self._log_handlers: List[int] = []
+
+        # Every group is an item of the job, see ``group_key``
+        self._journal: Optional[BatchJournal] = None
+        self._job_id: Optional[int] = None
+        self._owner = worker_id("gui")
+        self._last_heartbeat = 0.0
+
+        self._kind: Literal["content", "code"] = "content"
+        self._system = ""
+        self._upload_code = True
+        self._model_settings = None
+
+        self.__setup_ui_components()
+        self.__connect_signals()
+
+    @property
+    def folder(self) -> Path | None:
+        return self._folder
+
+    @folder.setter
+    def folder(self, value: Path) -> None:
+        self._folder = value
+
+    @property
+    def selected_images(self) -> List[str]:
+        return self._selected_images
+
+    @selected_images.setter
+    def selected_images(self, value: List[str]) -> None:
+        self._selected_images = value
+
+    @property
+    def is_running(self) -> bool:
+        """Whether a run is in progress, from grouping until its last request settles"""
+        return self._is_running
+
+    def __setup_ui_components(self) -> None:
+        self.check_box.setCheckState(read_settings('BatchRelated', 'selected_images',
+                                                   Qt.CheckState.Checked, type_=Qt.CheckState))
+        for text, kind in (("Content", "content"), ("Code", "code")):
+            self.combo_box_kind.addItem(text, kind)
+        self.combo_box_kind.setCurrentIndex(
+            max(0, self.combo_box_kind.findData(read_settings('BatchRelated', 'kind', "content"))))
+        self.spin_box_group_size.setMaximum(MAX_GROUP)
+        self.spin_box_group_size.setValue(read_settings('BatchRelated', 'group_size', MAX_GROUP, type_=int))
+
+        self.start = QPushButton("Start")
+        self.pause = QPushButton("Pause")
+        self.model = QPushButton("Model")
+        self.abort = QPushButton("Abort")
+        self.cancel = QPushButton("Cancel")
+
+        self.button_box.addButton(self.start, QDialogButtonBox.ButtonRole.ActionRole)
+        self.button_box.addButton(self.pause, QDialogButtonBox.ButtonRole.ActionRole)
+        self.button_box.addButton(self.model, QDialogButtonBox.ButtonRole.ActionRole)
+        self.button_box.addButton(self.abort, QDialogButtonBox.ButtonRole.DestructiveRole)
+        self.button_box.addButton(self.cancel, QDialogButtonBox.ButtonRole.RejectRole)
+
+        self.pause.setDisabled(True)
+        self.model.setDisabled(True)
+        self.abort.setDisabled(True)
+
+    def __connect_signals(self) -> None:
+        self._status_timer.timeout.connect(self._update_status)
+        self._state.changed.connect(self._update_progress)
+        self._state.completed.connect(self._on_completed)
+
+        self.check_box.checkStateChanged.connect(self.on_check_box_check_state_changed)
+        self.combo_box_kind.currentIndexChanged.connect(self.on_combo_box_kind_current_index_changed)
+        self.spin_box_group_size.valueChanged.connect(self.on_spin_box_group_size_value_changed)
+
+        self.start.clicked.connect(self.on_start_clicked)
+        self.pause.clicked.connect(self.on_pause_clicked)
+        self.model.clicked.connect(self.on_model_clicked)
+        self.abort.clicked.connect(self.on_abort_clicked)
+        self.cancel.clicked.connect(self.on_cancel_clicked)
+
+    def _settle(self, index: int, status: Literal["finished", "skipped", "failed", "canceled"]) -> None:
+        """
+        Settle a worker and keep dispatching, completion is signaled by the batch state
+        """
+        self._running.pop(index, None)
+        self._state.settle(index, status)
+        if self._is_running:
+            self._dispatch()
+
+    @Slot()
+    def _update_progress(self) -> None:
+        self.progress_bar.setValue(self._state.settled)
+
+    @Slot()
+    def _on_completed(self) -> None:
+        """
+        Handle the completion of all workers
+        """
+        if self._retryable and not self._aborted and self._retry_round < self.RETRY_ROUNDS:
+            self._start_retry_round()
+            return
+
+        self._is_running = False
+        self._grouping = False
+        self._status_timer.stop()
+        self._paused = False
+        self._update_status()
+        self.pause.setText("Pause")
+        self.pause.setDisabled(True)
+        self.model.setDisabled(True)
+        self.abort.setDisabled(True)
+        self.start.setEnabled(True)
+        self.cancel.setEnabled(True)
+
+        report = ""
+        if self._job_id is not None:
+            self._journal.release(self._job_id, self._owner)
+            if self._journal.close_job(self._job_id) == "interrupted":
+                logger.warning(f"Job {self._job_id} has unfinished groups, start again to resume it")
+            report = self._save_report()
+        self._journal.close()
+        self._journal = None
+
+        task_completed(self,
+                       message=f"Succeed: {self._state.count('finished')}\rFailed: {self._state.count('failed')}"
+                               f"\rSkipped: {self._state.count('skipped')}"
+                               f"\rCanceled: {self._state.count('canceled')} groups"
+                               f"\nTask log file is saved to {self._log_file}{report}")
+        logger.info("All tasks completed!")
+        self._remove_log_handlers()
+
+    def _add_log_handlers(self) -> None:
+        """
+        Log into the log view and into the log file of the run
+        """
+        self._log_handlers = [logger.add(self.log_view.sink, level="DEBUG"),
+                              logger.add(Path(self._log_file).open("w"))]
+
+    def _remove_log_handlers(self) -> None:
+        for handler in self._log_handlers:
+            logger.remove(handler)
+        self._log_handlers = []
+
+    def _save_report(self) -> str:
+        """
+        Write the JSON and CSV run report of the job, with one row per group
+
+        Returns:
+            A line for the completion message, empty if the report could not be written
+        """
+        try:
+            json_path, csv_path = save_report(self._journal, self._job_id, model_settings=self._model_settings,
+                                              run={"max_concurrency": self.MAX_CONCURRENCY,
+                                                   "retry_rounds": self._retry_round,
+                                                   "group_size": self.spin_box_group_size.value()})
+        except OSError as e:
+            logger.error(f"Failed to write the report of job {self._job_id}: {e}")
+            return ""
+        logger.info(f"Run report is saved to {json_path} and {csv_path.name}")
+        return f"\nRun report is saved to {json_path}"
+
+    def _reset_state(self):
+        self.log_view.clear()
+        self.progress_bar.setValue(0)
+
+        self._state.reset()
+        self._running.clear()
+        self._worker_queue.clear()
+        self._groups.clear()
+        self._grouping = False
+        self._controller = AIMDController(maximum=self.MAX_CONCURRENCY)
+        self._metrics = BatchMetrics()
+        self._dispatch_times.clear()
+        self._retryable.clear()
+        self._retry_round = 0
+        self._retry_after = 0.0
+        self._aborted = False
+        self._paused = False
+        self._usage.clear()
+        self._is_running = False
+        self._job_id = None
+
+    def _start_retry_round(self) -> None:
+        """
+        Queue the groups that failed in the last round again, they are dispatched by the status timer after a back-off
+        """
+        self._retry_round += 1
+        retryable, self._retryable = self._retryable, []
+        delay = self.RETRY_DELAY * self._retry_round
+        logger.info(f"Retry round {self._retry_round}/{self.RETRY_ROUNDS}: retrying {len(retryable)} failed groups "
+                    f"in {delay:.0f} seconds")
+
+        self._controller = AIMDController(initial=1, maximum=self.RETRY_CONCURRENCY)
+        self._retry_after = time.monotonic() + delay
+        self._state.requeue(retryable)
+        self._worker_queue.extend(retryable)
+
+    def _dispatch(self) -> None:
+        """
+        Start queued workers while the concurrency controller allows it
+        """
+        if self._paused or time.monotonic() < self._retry_after:
+            return
+        while self._controller.can_dispatch() and self._worker_queue:
+            index = self._worker_queue.popleft()
+            if not self._journal.claim_image(self._job_id, group_key(self._groups[index]), self._owner, self.LEASE):
+                logger.info(f"{index}: {', '.join(self._groups[index])} is done or leased by another worker, skipped")
+                self._state.settle(index, "skipped")
+                continue
+            # Decode and encode the images in the preprocessing pool while the worker builds the prompt
+            image_preprocessor.prefetch([self.folder / image_name for image_name in self._groups[index]],
+                                        max_edge(self._model_settings.provider))
+            worker = self._setup_worker(index)
+            self._state.start(worker.index)
+            self._running[worker.index] = worker
+            self._dispatch_times[worker.index] = time.monotonic()
+            self._controller.on_dispatch()
+            self._thread_pool.start(worker)
+
+    def _latency(self, index: int) -> float:
+        """
+        Get the latency of a worker since it was dispatched
+        """
+        return time.monotonic() - self._dispatch_times.pop(index, time.monotonic())
+
+    @Slot()
+    def _update_status(self) -> None:
+        """
+        Show the current concurrency limit and the live metrics, and retry dispatching after a back-off
+        """
+        if self._grouping:
+            return
+        self.label_status.setText(f"Concurrency limit: {self._controller.limit}"
+                                  f" | In flight: {self._controller.in_flight}"
+                                  f" | Done: {self._state.settled}/{len(self._groups)} groups"
+                                  + (" | Paused" if self._paused else ""))
+        self.label_metrics.setText(self._metrics.summary(self._state.outstanding))
+        if self._is_running:
+            if time.monotonic() - self._last_heartbeat > self.LEASE / 3:
+                self._journal.heartbeat(self._job_id, self._owner, self.LEASE)
+                self._last_heartbeat = time.monotonic()
+            self._dispatch()
+
+    def _mark(self,
+              index: int,
+              status: Literal["finished", "failed", "canceled"],
+              error: str = None) -> None:
+        """
+        Record the status of a group in the job journal
+        """
+        self._journal.mark(self._job_id, group_key(self._groups[index]), status, error)
+
+    def _persist(self, index: int, result: str) -> None:
+        """
+        Write the result of a group into the sidecars of all its images right away
+        """
+        images = [self.folder / image_name for image_name in self._groups[index]]
+        # Load and update every sidecar before writing any, so that a broken one fails the group untouched
+        try:
+            details = []
+            for image in images:
+                json_path = sidecar_path(image)
+                if not os.access(json_path if json_path.exists() else self.folder, os.W_OK):
+                    raise PermissionError(f"{json_path} is not writable")
+                details.append(apply_result(self._kind, load_detail(image), result))
+        except Exception as e:
+            logger.error(f"{index}: {image.name} failed to save! Error: {e}")
+            self._mark(index, "failed", str(e))
+            self._settle(index, "failed")
+            return
+
+        for image, detail in zip(images, details):
+            try:
+                detail.save(str(sidecar_path(image)))
+            except Exception as e:
+                logger.error(f"{index}: {image.name} failed to save! Error: {e}")
+                self._mark(index, "failed", str(e))
+                self._settle(index, "failed")
+                return
+
+        self._mark(index, "finished")
+        logger.success(f"{index}: {', '.join(self._groups[index])} finished!")
+        self._settle(index, "finished")
+
+    def _setup_worker(self, index: int) -> QCancellableChatWorker:
+        first, *related = self._groups[index]
+        worker = QCancellableChatWorker()
+        worker.system = self._system
+        worker.prepare = self._prepare
+        worker.image = str((self.folder / first).absolute())
+        worker.related = [str((self.folder / image_name).absolute()) for image_name in related]
+        worker.index = index
+
+        # Connect signals
+        worker.signals.finished.connect(self.on_worker_finished)
+        worker.signals.failed.connect(self.on_worker_failed)
+        worker.signals.canceled.connect(self.on_worker_canceled)
+        worker.signals.usage.connect(self.on_worker_usage)
+
+        return worker
+
+    def _prepare(self, worker: QCancellableChatWorker) -> bool:
+        """
+        Build the prompt from the detail of the first image of the group on the worker thread, the content of a group
+        is described from its images alone, like in the content batch
+        """
+        worker.text = code_prompt(worker.detail, self._upload_code) if self._kind == "code" else None
+        return True
+
+    def _chosen_images(self) -> List[str]:
+        """
+        List the images to group, the selected ones or all images of the folder
+        """
+        if self.check_box.checkState() == Qt.CheckState.Checked:
+            return [name for name in self.selected_images if SupportedImage(self.folder / name).is_supported()]
+        return [entry.name for entry in os.scandir(self.folder) if SupportedImage(entry.path).is_supported()]
+
+    def _stop_scheduling(self) -> None:
+        """
+        Stop dispatching, the queued groups are canceled and no retry round follows
+        """
+        self._aborted = True
+        self._grouping = False
+        while self._worker_queue:
+            self._state.settle(self._worker_queue.popleft(), "canceled")
+        self._state.seal()
+
+    def _run(self, journal: BatchJournal, job_id: Optional[int], images: Optional[List[str]] = None) -> None:
+        """
+        Start a run of a job, the images of a new job are grouped on a worker thread first and the groups are generated
+        once grouping has finished
+
+        Args:
+            journal: The journal of the folder
+            job_id: The job to resume with its remaining groups, a new job over the groups of the images is created if
+                None
+            images: The image names to group for a new job
+        """
+        # Reset state
+        self._reset_state()
+
+        # Setup logging
+        self._log_file = f"batch_related_{time.strftime('%Y_%m_%d_%H_%M_%S')}.log"
+        self._add_log_handlers()
+        logger.info(f"Starting... Log file is saved to {self._log_file}")
+
+        self._kind = self.combo_box_kind.currentData()
+        self._system = system_prompt(self._kind) + PROMPT_RELATED
+        self._upload_code = read_settings("upload_code", "upload_code", default=True, type_=bool)
+        self._model_settings = read_model_settings()
+        self._journal, self._job_id = journal, job_id
+
+        # Update UI state
+        self._is_running = True
+        self._status_timer.start(self.STATUS_INTERVAL)
+        self.start.setDisabled(True)
+        self.pause.setEnabled(True)
+        self.abort.setEnabled(True)
+        self.cancel.setDisabled(True)
+
+        if job_id is not None:
+            logger.info(f"Resuming job {job_id}")
+            self._queue_groups([group_images(key) for key in journal.iter_remaining(job_id)])
+            return
+
+        self._image_count = len(images)
+        logger.info(f"Grouping {len(images)} images...")
+        worker = QClusterWorker(self.folder, images, self.spin_box_group_size.value())
+        worker.signals.progress.connect(self.on_cluster_worker_progress)
+        worker.signals.finished.connect(self.on_cluster_worker_finished)
+        worker.signals.failed.connect(self.on_cluster_worker_failed)
+        self._grouping = True
+        self._thread_pool.start(worker)
+
+    def _queue_groups(self, groups: List[List[str]]) -> None:
+        """
+        Queue one request per group of the job, all groups run concurrently
+        """
+        self.progress_bar.setMaximum(len(groups))
+        for index, group in enumerate(groups):
+            logger.info(f"{index}: {', '.join(group)}")
+            self._groups[index] = group
+            self._state.enqueue(index)
+            self._worker_queue.append(index)
+        self._state.seal()
+        self._update_status()
+        self._dispatch()
+
+    def _reload_model_settings(self) -> None:
+        """
+        Pick up the model settings changed while paused, the requests dispatched after resuming use them
+        """
+        model_settings = read_model_settings()
+        if model_settings == self._model_settings:
+            return
+        self._model_settings = model_settings
+        # The limit learned from the previous provider does not hold for the new one, the running requests still count
+        self._controller = AIMDController(maximum=self._controller.maximum)
+        for _ in self._running:
+            self._controller.on_dispatch()
+        logger.info(f"Model settings changed, continuing with {model_settings.provider.value}")
+
+    def _notify_before_exiting(self, event: QCloseEvent = None):
+        # The queued groups of a paused job stay unfinished in the journal, and are resumed by the next start
+        message = "The batch is paused. Do you want to close and resume the remaining groups next time?" \
+            if self._paused else "Tasks are still running. Do you want to abort and close?"
+        if not self._is_running:
+            return
+        if QMessageBox.StandardButton.Yes == leave_while_running(self, message=message):
+            self.on_abort_clicked(True)
+        elif event:
+            event.ignore()
+
+    @Slot(int)
+    def on_check_box_check_state_changed(self, state: int) -> None:
+        write_settings('BatchRelated', 'selected_images', state)
+
+    @Slot(int)
+    def on_combo_box_kind_current_index_changed(self, _: int) -> None:
+        write_settings('BatchRelated', 'kind', self.combo_box_kind.currentData())
+
+    @Slot(int)
+    def on_spin_box_group_size_value_changed(self, value: int) -> None:
+        write_settings('BatchRelated', 'group_size', value)
+
+    @Slot(bool)
+    def on_start_clicked(self, _: bool) -> None:
+        if not self.folder:
+            invalid_folder(self)
+            return
+
+        # Offer to resume an interrupted job of the chosen kind
+        kind = f"related_{self.combo_box_kind.currentData()}"
+        journal = BatchJournal(self.folder)
+        try:
+            job_id = journal.unfinished_job(kind)
+            remaining = journal.remaining_count(job_id) if job_id is not None else 0
+            if remaining:
+                reply = resume_job(self, message=f"The last batch related {self.combo_box_kind.currentText().lower()} "
+                                                 f"job was interrupted with {remaining} groups left. Resume it and "
+                                                 f"skip the finished groups?")
+                if reply == QMessageBox.StandardButton.Cancel:
+                    return
+                if reply == QMessageBox.StandardButton.No:
+                    journal.set_job_status(job_id, "discarded")
+                    remaining = 0
+            elif job_id is not None:
+                journal.close_job(job_id)
+
+            if remaining:
+                self._run(journal, job_id)
+                return
+
+            if len(images := self._chosen_images()) < 2:
+                too_few_files(self, message="Please select at least two images")
+                return
+
+            if QMessageBox.StandardButton.No == \
+                    overwrite_files(self, message=f"This action will OVERWRITE the existing "
+                                                  f"{self.combo_box_kind.currentText().lower()} of all grouped "
+                                                  f"images. Continue?"):
+                return
+
+            self._run(journal, None, images)
+        finally:
+            # The journal of a started run is closed once it completes
+            if self._journal is not journal:
+                journal.close()
+
+    @Slot(bool)
+    def on_pause_clicked(self, _: bool) -> None:
+        """
+        Stop dispatching while the running requests finish, or resume with the model settings saved in the meantime
+        """
+        if not self._paused:
+            self._paused = True
+            self.pause.setText("Resume")
+            self.model.setEnabled(True)
+            logger.warning(f"Paused, waiting for {len(self._running)} running requests, the queued ones are kept")
+            self._update_status()
+            return
+
+        self._reload_model_settings()
+        self._paused = False
+        self.pause.setText("Pause")
+        self.model.setDisabled(True)
+        logger.info("Resumed")
+        self._update_status()
+
+    @Slot(bool)
+    def on_model_clicked(self, _: bool) -> None:
+        """
+        Edit the model settings while paused, e.g. to switch the provider after errors
+        """
+        SettingsModel(self).exec()
+
+    @Slot(bool)
+    def on_abort_clicked(self, _: bool) -> None:
+        self.pause.setDisabled(True)
+        self.model.setDisabled(True)
+        for worker in self._running.values():
+            worker.cancel()
+        self._stop_scheduling()
+
+        logger.warning("User aborted...")
+
+    @Slot(bool)
+    def on_cancel_clicked(self, _: bool) -> None:
+        """
+        Handle the cancellation of the batch related
+        """
+        # Asks to abort a running batch, see ``closeEvent``
+        self.close()
+
+    @Slot(int, int)
+    def on_cluster_worker_progress(self, analyzed: int, total: int) -> None:
+        if self._grouping:
+            self.label_status.setText(f"Grouping: {analyzed}/{total} images analyzed")
+
+    @Slot(list)
+    def on_cluster_worker_finished(self, groups: List[List[str]]) -> None:
+        """
+        Create the job with one item per group and queue the groups
+        """
+        if not self._grouping:
+            return
+        self._grouping = False
+
+        grouped = sum(len(group) for group in groups)
+        logger.info(f"Found {len(groups)} groups of {grouped} images, "
+                    f"{self._image_count - grouped} images have no related image")
+        self._job_id = self._journal.create_job(f"related_{self._kind}", (group_key(group) for group in groups),
+                                                {"system": self._system,
+                                                 "group_size": self.spin_box_group_size.value()})
+        self._queue_groups(groups)
+
+    @Slot(Exception)
+    def on_cluster_worker_failed(self, error: Exception) -> None:
+        if not self._grouping:
+            return
+        logger.error(f"Grouping failed! Error: {error}")
+        failed_to_generate(self, exception=error)
+        self._stop_scheduling()
+
+    @Slot(int, str, str)
+    def on_worker_finished(self, index: int, _: str, result: str) -> None:
+        """
+        Handle the completion of a worker
+        """
+        latency = self._latency(index)
+        self._controller.on_success(latency)
+        self._metrics.record("finished", latency)
+        self._journal.record_usage(self._job_id, group_key(self._groups[index]), latency,
+                                   *self._usage.pop(index, (0, 0)), model=model_tag(self._model_settings))
+        self._persist(index, result)
+
+    @Slot(int, str, Exception)
+    def on_worker_failed(self, index: int, _: str, error: Exception) -> None:
+        """
+        Handle the failure of a worker
+        """
+        latency = self._latency(index)
+        error_kind = classify_error(error)
+        self._controller.on_failure(error_kind)
+        self._metrics.record("failed", latency, error_kind)
+        logger.error(f"{index}: {', '.join(self._groups[index])} failed! Error: {error}")
+        self._mark(index, "failed", str(error))
+        self._journal.record_usage(self._job_id, group_key(self._groups[index]), latency,
+                                   model=model_tag(self._model_settings))
+        self._retryable.append(index)
+        self._settle(index, "failed")
+
+    @Slot(int, str)
+    def on_worker_canceled(self, index: int, _: str) -> None:
+        """
+        Handle the cancellation of a worker
+        """
+        self._latency(index)
+        self._controller.on_cancel()
+        self._metrics.record("canceled")
+        self._usage.pop(index, None)
+        logger.warning(f"{index}: {', '.join(self._groups[index])} canceled!")
+        self._mark(index, "canceled")
+        self._settle(index, "canceled")
+
+    @Slot(int, int, int)
+    def on_worker_usage(self, index: int, input_tokens: int, output_tokens: int) -> None:
+        self._metrics.record_tokens(input_tokens + output_tokens)
+        self._usage[index] = (input_tokens, output_tokens)
+
+    def closeEvent(self, event: QCloseEvent) -> None:
+        """
+        Handle the close event of the batch related
+        """
+        self._notify_before_exiting(event)
+        if event.isAccepted():
+            self._remove_log_handlers()
+            # Hides the dialog and emits ``finished``
+            super().closeEvent(event)
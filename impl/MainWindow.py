@@ -8,12 +8,16 @@ from PySide6.QtWidgets import QMainWindow, QMessageBox, QFileDialog, QListWidget
 from constant import APPLICATION, PROMPT_CONTENT, PROMPT_CODE, PROMPT_RELATED
 from entity import ImageFileInfo, Detail, ModelSettings, ModelProvider, SupportedImage
 from qmessagebox import failed_to_generate, failed_to_save, invalid_file, save_changes, leave_without_saving, \
-    too_few_files, too_many_files, failed_to_hallucinate
+    too_few_files, too_many_files, failed_to_hallucinate, invalid_configuration, stop_pools
 from qobject import QSimpleChatWorker, HallucinationWorker
 from qwindow import MainWindowUi
-from util import analyze_image_file, read_settings, write_settings, extract_code_blocks, read_model_settings
+from util import analyze_image_file, read_settings, write_settings, extract_code_blocks, read_model_settings, \
+    read_pools
 from .BatchCode import BatchCode
 from .BatchContent import BatchContent
+from .BatchDialog import BatchDialog
+from .BatchHallucination import BatchHallucination
+from .BatchRelated import BatchRelated
 from .SettingsModel import SettingsModel
 from .SettingsPrompt import SettingsPrompt
 
@@ -30,7 +34,7 @@ class MainWindow(QMainWindow, MainWindowUi):
         self.folder_path: Optional[Path] = None
         self.image_path: Optional[SupportedImage] = None
         self.json_path: Optional[Path] = None
-        self.hallucination_result: Optional[List[bool]] = None
+        self.hallucination_result: Optional[List[Optional[bool]]] = None
         self.is_edited: bool = False
         self.shift_start_index: Optional[int] = None
         self.shift_end_index: Optional[int] = None
@@ -43,6 +47,9 @@ class MainWindow(QMainWindow, MainWindowUi):
         self._model_settings: Optional[ModelSettings] = None
         self._image_info_cache: Dict[str, ImageFileInfo] = {}
 
+        # Batch dialogs are modeless and kept while the main window lives, one of each kind
+        self._batch_dialogs: Dict[type, BatchDialog | BatchRelated] = {}
+
         self.__setup_ui_components()
         self.__connect_signals()
 
@@ -87,10 +94,14 @@ class MainWindow(QMainWindow, MainWindowUi):
         self.action_open_last.triggered.connect(self.on_action_open_last_triggered)
         self.action_model.triggered.connect(self.on_action_model_triggered)
         self.action_prompt.triggered.connect(self.on_action_prompt_triggered)
+        self.action_report.triggered.connect(self.on_action_report_triggered)
+        self.action_pools.triggered.connect(self.on_action_pools_triggered)
         self.action_batch_content.triggered.connect(self.on_action_batch_content_triggered)
         self.action_batch_code.triggered.connect(self.on_action_batch_code_triggered)
+        self.action_batch_hallucination.triggered.connect(self.on_action_batch_hallucination_triggered)
         self.action_related_content.triggered.connect(self.on_action_related_content_triggered)
         self.action_related_code.triggered.connect(self.on_action_related_code_triggered)
+        self.action_batch_related.triggered.connect(self.on_action_batch_related_triggered)
 
         # UI elements
         self.push_button_select_all.clicked.connect(self.on_push_button_select_all_clicked)
@@ -101,6 +112,7 @@ class MainWindow(QMainWindow, MainWindowUi):
         self.push_button_hallucination.clicked.connect(self.on_push_button_hallucination_clicked)
         self.push_button_save.clicked.connect(self.on_push_button_save_clicked)
         self.detail_widget.detailEdited.connect(self.on_detail_edited)
+        self.detail_widget.code_pager.stacked_widget.currentChanged.connect(self._show_hallucination)
 
         # Shortcuts
         self.shortcut_next.activated.connect(self.on_shortcut_next_triggered)
@@ -142,6 +154,26 @@ class MainWindow(QMainWindow, MainWindowUi):
         """Load image into graphics view"""
         self.graphics_view_image.load_image(str(self.image_path))
 
+    def _show_batch_dialog(self, dialog_type: type) -> None:
+        """
+        Show a batch dialog next to the main window, so requests for the current image keep running while the batch
+        does. A running batch is brought to the front as it is, an idle one picks up the folder and the checked images.
+        """
+        dialog = self._batch_dialogs.get(dialog_type)
+        if dialog is None:
+            dialog = self._batch_dialogs[dialog_type] = dialog_type(self)
+            dialog.finished.connect(self.on_batch_dialog_finished)
+        if not dialog.is_running:
+            dialog.folder = self.folder_path
+            dialog.selected_images = [self.list_widget_files.item(i).text()
+                                      for i in range(self.list_widget_files.count())
+                                      if self.list_widget_files.item(i).checkState() == Qt.CheckState.Checked]
+            if isinstance(dialog, BatchDialog):
+                dialog.current_image = self.image_path.name if self.image_path else None
+        dialog.show()
+        dialog.raise_()
+        dialog.activateWindow()
+
     def _load_metadata(self) -> None:
         """Load image metadata into panel"""
         self.line_edit_filename.setText(self.image_path.name)
@@ -155,6 +187,21 @@ class MainWindow(QMainWindow, MainWindowUi):
         self._update_metadata_table(image_file_info)
         self.detail_widget.image = str(self.image_path)
         self.detail_widget.detail = Detail.load(str(self.json_path))
+        self.hallucination_result = [block.hallucination for block in self.detail_widget.detail.code]
+        self._show_hallucination()
+
+    def _show_hallucination(self) -> None:
+        """Show the hallucination verdict of the current code block"""
+        index = self.detail_widget.code_pager.current_index
+        if not self.hallucination_result or not 0 <= index < len(self.hallucination_result) or \
+                self.hallucination_result[index] is None:
+            self.label_hallucination.setText("<html><body><p style='color: black;'>Not detected</p></body></html>")
+        elif self.hallucination_result[index]:
+            self.label_hallucination.setText(
+                "<html><body><p style='color: red;'>Hallucination detected!</p></body></html>")
+        else:
+            self.label_hallucination.setText(
+                "<html><body><p style='color: green;'>No hallucination detected!</p></body></html>")
 
     def _get_cached_image_info(self) -> ImageFileInfo:
         """Get cached image info or analyze and cache"""
@@ -236,25 +283,51 @@ class MainWindow(QMainWindow, MainWindowUi):
         """Open prompt settings dialog"""
         SettingsPrompt(self).show()
 
+    @Slot(bool)
+    def on_action_report_triggered(self, _: bool) -> None:
+        """Select the folder batch run reports are saved to, the batch folder of the image folder by default"""
+        if selected_folder := QFileDialog.getExistingDirectory(self, 'Select Report Folder',
+                                                               read_settings('Report', 'directory', default="")):
+            write_settings('Report', 'directory', selected_folder)
+
+    @Slot(bool)
+    def on_action_pools_triggered(self, _: bool) -> None:
+        """Select the JSON file of the provider pools batch content and code are sharded over"""
+        current = read_settings('Pools', 'file', default="")
+        selected_file, _ = QFileDialog.getOpenFileName(self, 'Select Provider Pools', current, "JSON (*.json)")
+        if not selected_file:
+            if current and QMessageBox.StandardButton.Yes == \
+                    stop_pools(self, message=f"Batches are sharded over the provider pools of {current}. "
+                                             f"Stop sharding and use the model settings only?"):
+                write_settings('Pools', 'file', "")
+            return
+        try:
+            read_pools(read_model_settings(), selected_file)
+        except ValueError as e:
+            invalid_configuration(self, message=str(e))
+            return
+        write_settings('Pools', 'file', selected_file)
+
     @Slot(bool)
     def on_action_batch_content_triggered(self, _: bool) -> None:
         """Open batch content dialog"""
-        batch_content = BatchContent(self)
-        batch_content.folder = self.folder_path
-        batch_content.selected_images = [self.list_widget_files.item(i).text()
-                                         for i in range(self.list_widget_files.count())
-                                         if self.list_widget_files.item(i).checkState() == Qt.CheckState.Checked]
-        batch_content.exec()
+        self._show_batch_dialog(BatchContent)
 
     @Slot(bool)
     def on_action_batch_code_triggered(self, _: bool) -> None:
         """Open batch code dialog"""
-        batch_code = BatchCode(self)
-        batch_code.folder = self.folder_path
-        batch_code.selected_images = [self.list_widget_files.item(i).text()
-                                      for i in range(self.list_widget_files.count())
-                                      if self.list_widget_files.item(i).checkState() == Qt.CheckState.Checked]
-        batch_code.exec()
+        self._show_batch_dialog(BatchCode)
+
+    @Slot(bool)
+    def on_action_batch_hallucination_triggered(self, _: bool) -> None:
+        """Open batch hallucination dialog"""
+        self._show_batch_dialog(BatchHallucination)
+
+    @Slot(int)
+    def on_batch_dialog_finished(self, _: int) -> None:
+        """Reload the current image, a batch may have written its sidecar"""
+        if self.image_path and not self.is_edited:
+            self._load_metadata()
 
     @Slot(bool)
     def on_push_button_select_all_clicked(self, _: bool) -> None:
@@ -425,6 +498,11 @@ class MainWindow(QMainWindow, MainWindowUi):
 
         self.window().setDisabled(True)
 
+    @Slot(bool)
+    def on_action_batch_related_triggered(self, _: bool) -> None:
+        """Open batch related dialog"""
+        self._show_batch_dialog(BatchRelated)
+
     @Slot()
     def on_shortcut_next_triggered(self) -> None:
         """Handle next file shortcut"""
@@ -457,20 +535,12 @@ class MainWindow(QMainWindow, MainWindowUi):
     def on_hallucination_worker_succeed(self, succeed: bool, result: list) -> None:
         """Handle hallucination succeed signal"""
         if succeed:
+            # The verdicts are saved into the sidecar, keep them in the loaded detail so that saving it keeps them
+            if detail := self.detail_widget.detail:
+                for block, verdict in zip(detail.code, result):
+                    block.hallucination = verdict
             self.hallucination_result = result
-            if not self.hallucination_result:
-                return
-
-            index = self.detail_widget.code_pager.current_index
-            if index is None:
-                return
-
-            if self.hallucination_result[index]:
-                self.label_hallucination.setText(
-                    "<html><body><p style='color: red;'>Hallucination detected!</p></body></html>")
-            else:
-                self.label_hallucination.setText(
-                    "<html><body><p style='color: green;'>No hallucination detected!</p></body></html>")
+            self._show_hallucination()
 
         else:
             failed_to_hallucinate(self)
@@ -479,6 +549,12 @@ class MainWindow(QMainWindow, MainWindowUi):
 
     def closeEvent(self, event: QCloseEvent) -> None:
         """Handle window close events"""
+        # Running batches are asked to abort first, the window stays open if one of them keeps running
+        for dialog in self._batch_dialogs.values():
+            if dialog.is_running and not dialog.close():
+                event.ignore()
+                return
+
         if not self.is_edited:
             event.accept()
             return
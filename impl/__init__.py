@@ -1,6 +1,10 @@
 from .BatchCode import BatchCode
 from .BatchContent import BatchContent
+from .BatchDialog import BatchDialog
+from .BatchHallucination import BatchHallucination
+from .BatchRelated import BatchRelated
 from .MainWindow import MainWindow
 from .SettingsModel import SettingsModel
 
-__all__ = ['BatchCode', 'BatchContent', 'MainWindow', 'SettingsModel', ]
+__all__ = ['BatchCode', 'BatchContent', 'BatchDialog', 'BatchHallucination', 'BatchRelated', 'MainWindow',
+           'SettingsModel', ]
@@ -1,3 +1,4 @@
+import multiprocessing
 import sys
 
 from PySide6.QtWidgets import QApplication
@@ -5,6 +6,8 @@ from PySide6.QtWidgets import QApplication
 from impl import MainWindow
 
 if __name__ == '__main__':
+    # The image preprocessing pool spawns processes, which needs this in a frozen executable
+    multiprocessing.freeze_support()
     app = QApplication(sys.argv)
     main_window = MainWindow()
     main_window.show()
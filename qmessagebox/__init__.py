@@ -15,9 +15,13 @@ __all__ = [
 
     # Information
     "task_completed",
+    "nothing_to_rerun",
+    "batch_estimate",
 
     # Question
     "save_changes",
+    "resume_job",
+    "stop_pools",
 
     # Warning
     "too_few_files",
@@ -13,3 +13,19 @@ def task_completed(parent: QWidget, **kwargs) -> Optional[QMessageBox.StandardBu
     if "message" not in kwargs:
         kwargs["message"] = "Task completed!"
     return MessageBoxFactory.information(parent, **kwargs)
+
+
+def nothing_to_rerun(parent: QWidget, **kwargs) -> Optional[QMessageBox.StandardButton]:
+    if "title" not in kwargs:
+        kwargs["title"] = __title__
+    if "message" not in kwargs:
+        kwargs["message"] = "Nothing to rerun!"
+    return MessageBoxFactory.information(parent, **kwargs)
+
+
+def batch_estimate(parent: QWidget, **kwargs) -> Optional[QMessageBox.StandardButton]:
+    if "title" not in kwargs:
+        kwargs["title"] = "Estimate"
+    if "message" not in kwargs:
+        kwargs["message"] = "Nothing to estimate!"
+    return MessageBoxFactory.information(parent, **kwargs)
@@ -13,3 +13,19 @@ def save_changes(parent: QWidget, **kwargs) -> Optional[QMessageBox.StandardButt
     if "message" not in kwargs:
         kwargs["message"] = "Save changes?"
     return MessageBoxFactory.question(parent, **kwargs)
+
+
+def resume_job(parent: QWidget, **kwargs) -> Optional[QMessageBox.StandardButton]:
+    if "title" not in kwargs:
+        kwargs["title"] = __title__
+    if "message" not in kwargs:
+        kwargs["message"] = "Resume the interrupted job?"
+    return MessageBoxFactory.question(parent, **kwargs)
+
+
+def stop_pools(parent: QWidget, **kwargs) -> Optional[QMessageBox.StandardButton]:
+    if "title" not in kwargs:
+        kwargs["title"] = __title__
+    if "message" not in kwargs:
+        kwargs["message"] = "Stop sharding batches over provider pools?"
+    return MessageBoxFactory.question(parent, **kwargs)
@@ -1,6 +1,6 @@
 from PySide6.QtCore import QObject, QRunnable, Signal
 
-from util import hallucination
+from util import hallucination, interactive, load_detail, save_verdicts
 
 
 class HallucinationWorkerSignals(QObject):
@@ -12,7 +12,7 @@ class HallucinationWorkerSignals(QObject):
 
 class HallucinationWorker(QRunnable):
     """
-    Worker for hallucination
+    Worker for hallucination, the verdicts are saved into the sidecar of the image
     """
 
     def __init__(self, image_path):
@@ -22,7 +22,10 @@ class HallucinationWorker(QRunnable):
 
     def run(self):
         try:
-            result = hallucination(self.image_path)
+            detail = load_detail(self.image_path)
+            with interactive():
+                result = hallucination(self.image_path, detail=detail)
+            save_verdicts(self.image_path, detail.code, result)
             self.signals.succeed.emit(True, result)
         except Exception as _:
             self.signals.succeed.emit(False, [])
@@ -0,0 +1,147 @@
+from threading import Lock
+from typing import Dict, Iterable, Literal, Set
+
+from PySide6.QtCore import QObject, Signal
+
+BatchItemState = Literal["queued", "running", "finished", "skipped", "failed", "canceled"]
+
+
+class QBatchState(QObject):
+    """
+    Event-driven state machine of a batch run.
+
+    Every item moves from queued to running to one of the final states. An outstanding counter is decremented when an
+    item settles, and ``completed`` is emitted exactly once when it reaches zero after the batch has been sealed, so
+    completion detection is O(1) per event and never reads flags written by worker threads. Failed items can be queued
+    again for a retry round, the batch then completes once more when they settle.
+    """
+    changed = Signal()
+    completed = Signal()
+
+    FINAL_STATES = ("finished", "skipped", "failed", "canceled")
+
+    def __init__(self, parent: QObject = None):
+        super().__init__(parent)
+        self._lock = Lock()
+        self._items: Dict[int, BatchItemState] = {}
+        self._states: Dict[BatchItemState, Set[int]] = {}
+        self._outstanding = 0
+        self._sealed = False
+        self._completed = False
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Forget all items
+        """
+        with self._lock:
+            self._items = {}
+            self._states = {state: set() for state in ("queued", "running", *self.FINAL_STATES)}
+            self._outstanding = 0
+            self._sealed = False
+            self._completed = False
+
+    @property
+    def outstanding(self) -> int:
+        """Number of items that have not settled yet"""
+        return self._outstanding
+
+    @property
+    def settled(self) -> int:
+        """Number of items in a final state"""
+        with self._lock:
+            return sum(len(self._states[state]) for state in self.FINAL_STATES)
+
+    def count(self, state: BatchItemState) -> int:
+        with self._lock:
+            return len(self._states[state])
+
+    def items(self, state: BatchItemState) -> Set[int]:
+        """
+        Get a snapshot of the items in a state
+        """
+        with self._lock:
+            return set(self._states[state])
+
+    def enqueue(self, index: int) -> None:
+        """
+        Add a new queued item
+        """
+        with self._lock:
+            if index in self._items:
+                raise ValueError(f"Item {index} already exists")
+            self._items[index] = "queued"
+            self._states["queued"].add(index)
+            self._outstanding += 1
+        self.changed.emit()
+
+    def start(self, index: int) -> None:
+        """
+        Move a queued item to running
+        """
+        with self._lock:
+            self._move(index, "running")
+        self.changed.emit()
+
+    def park(self, index: int) -> None:
+        """
+        Move a running item back to queued without settling it, e.g. a near-duplicate waiting for the result of another
+        item
+        """
+        with self._lock:
+            if self._items.get(index) != "running":
+                raise ValueError(f"Item {index} is not running")
+            self._move(index, "queued")
+        self.changed.emit()
+
+    def settle(self, index: int, state: Literal["finished", "skipped", "failed", "canceled"]) -> None:
+        """
+        Move a queued or running item to a final state, emitting ``completed`` if it was the last outstanding one
+        """
+        if state not in self.FINAL_STATES:
+            raise ValueError(f"Invalid final state: {state}")
+        with self._lock:
+            if self._items.get(index) in self.FINAL_STATES:
+                return
+            self._move(index, state)
+            self._outstanding -= 1
+            completed = self._check_completed()
+        self.changed.emit()
+        if completed:
+            self.completed.emit()
+
+    def requeue(self, indices: Iterable[int]) -> None:
+        """
+        Move failed items back to queued for another attempt
+        """
+        with self._lock:
+            for index in indices:
+                if self._items.get(index) != "failed":
+                    raise ValueError(f"Item {index} has not failed")
+                self._move(index, "queued")
+                self._outstanding += 1
+                self._completed = False
+        self.changed.emit()
+
+    def seal(self) -> None:
+        """
+        Declare that no more items will be enqueued, so the batch completes once all outstanding items settle
+        """
+        with self._lock:
+            self._sealed = True
+            completed = self._check_completed()
+        if completed:
+            self.completed.emit()
+
+    def _move(self, index: int, state: BatchItemState) -> None:
+        if (current := self._items.get(index)) is None:
+            raise ValueError(f"Unknown item {index}")
+        self._states[current].discard(index)
+        self._states[state].add(index)
+        self._items[index] = state
+
+    def _check_completed(self) -> bool:
+        if self._sealed and self._outstanding == 0 and not self._completed:
+            self._completed = True
+            return True
+        return False
@@ -1,16 +1,19 @@
-from typing import Literal, Optional
+from threading import Event
+from typing import Callable, Dict, List, Optional
 
 from PySide6.QtCore import QObject, Signal, QRunnable
 from loguru import logger
 
-from entity import Detail, SupportedImage
-from util import chat
+from entity import Detail, ModelSettings, SupportedImage
+from util import chat, last_usage
 
 
 class QCancellableChatWorkerSignals(QObject):
     canceled = Signal(int, str)  # index, image_path
+    skipped = Signal(int, str)  # index, image_path
     finished = Signal(int, str, str)  # index, image_path, result
     failed = Signal(int, str, Exception)  # index, image_path, error
+    usage = Signal(int, int, int)  # index, input_tokens, output_tokens
 
 
 class QCancellableChatWorker(QRunnable):
@@ -21,17 +24,17 @@ class QCancellableChatWorker(QRunnable):
         # Properties
         self._index = -1
         self._image = None
+        self._related: List[str] = []
         self._json = None
         self._detail = None
         self._system = None
         self._text = None
-        self._result = None
+        self._prepare: Optional[Callable[["QCancellableChatWorker"], bool]] = None
+        self._inputs: Optional[Dict[str, str]] = None
+        self._model_settings: Optional[ModelSettings] = None
 
-        # Status
-        self._alive = False
-        self._finished = False
-        self._failed = False
-        self._canceled = False
+        # Set from the GUI thread, read by the worker thread
+        self._canceled = Event()
 
     @property
     def index(self) -> int:
@@ -50,6 +53,17 @@ class QCancellableChatWorker(QRunnable):
         if value and SupportedImage(value).is_supported():
             self._image = value
 
+    @property
+    def related(self) -> List[str]:
+        """
+        Other images sent along with the image in the same request, e.g. related screenshots
+        """
+        return self._related
+
+    @related.setter
+    def related(self, value: List[str]):
+        self._related = [image for image in value if SupportedImage(image).is_supported()]
+
     @property
     def json(self) -> str:
         if self._json:
@@ -97,60 +111,80 @@ class QCancellableChatWorker(QRunnable):
         self._text = value
 
     @property
-    def result(self) -> Optional[str]:
-        return self._result
+    def prepare(self) -> Optional[Callable[["QCancellableChatWorker"], bool]]:
+        """
+        Called on the worker thread before chatting, e.g. to build the prompt, returns False to skip the chat
+        """
+        return self._prepare
 
-    def _update_status(self, *, status: Literal["finished", "failed", "canceled"] = "failed"):
+    @prepare.setter
+    def prepare(self, value: Optional[Callable[["QCancellableChatWorker"], bool]]):
+        self._prepare = value
+
+    @property
+    def inputs(self) -> Optional[Dict[str, str]]:
+        """
+        Hashes of the inputs of the chat for the manifest, kept after the worker is released
         """
-        Update the status of the worker
+        return self._inputs
 
-        Args:
-            status: The status of the worker.
+    @inputs.setter
+    def inputs(self, value: Optional[Dict[str, str]]):
+        self._inputs = value
+
+    @property
+    def model_settings(self) -> Optional[ModelSettings]:
+        """
+        The model settings to chat with, e.g. of the provider pool the worker was dispatched to, the saved ones if None
         """
-        match status:
-            case "finished":
-                self._finished = True
-            case "failed":
-                self._failed = True
-            case "canceled":
-                self._canceled = True
+        return self._model_settings
+
+    @model_settings.setter
+    def model_settings(self, value: Optional[ModelSettings]):
+        self._model_settings = value
 
     def run(self):
         try:
-            self._alive = True
+            if self.is_canceled():
+                self.signals.canceled.emit(self.index, self.image)
+                return
+            if self.prepare and not self.prepare(self):
+                self.signals.skipped.emit(self.index, self.image)
+                return
+            if self.is_canceled():
+                self.signals.canceled.emit(self.index, self.image)
+                return
             if not self.text and not self.image:
                 raise ValueError(f"Worker {self.index}: Missing text and image configuration")
 
             logger.trace(f"Worker {self.index} running: {self.system}")
             logger.trace(f"Worker {self.index} running: {self.image}")
+            logger.trace(f"Worker {self.index} running: {self.related}")
             logger.trace(f"Worker {self.index} running: {self.text}")
-            result = chat(system=self.system, text=self.text, image_url=self.image)
+            result = chat(system=self.system, text=self.text,
+                          image_url=[self.image, *self.related] if self.related else self.image,
+                          model_settings=self.model_settings)
+            self.signals.usage.emit(self.index, *last_usage())
 
             if self.is_canceled():
                 self.signals.canceled.emit(self.index, self.image)
-                self._update_status(status="canceled")
             else:
                 self.signals.finished.emit(self.index, self.image, result)
-                self._update_status(status="finished")
-                self._result = result
         except Exception as e:
             logger.error(f"Worker {self.index} failed: {e}")
             self.signals.failed.emit(self.index, self.image or "", e)
-            self._update_status(status="failed")
         finally:
-            self._alive = False
-
-    def is_alive(self) -> bool:
-        return self._alive
-
-    def is_finished(self) -> bool:
-        return self._finished
-
-    def is_failed(self) -> bool:
-        return self._failed
+            self.release()
 
     def is_canceled(self) -> bool:
-        return self._canceled
+        return self._canceled.is_set()
 
     def cancel(self):
-        self._canceled = True
+        self._canceled.set()
+
+    def release(self):
+        """
+        Release the prompt and the detail, the result is handed over through the signals
+        """
+        self._text = None
+        self._detail = None
@@ -0,0 +1,123 @@
+from pathlib import Path
+from threading import Event
+from typing import Callable, Dict, Optional
+
+from PySide6.QtCore import QObject, Signal, QRunnable
+from loguru import logger
+
+from entity import Detail, ModelSettings
+from util import hallucination, load_detail
+
+
+class QCancellableHallucinationWorkerSignals(QObject):
+    canceled = Signal(int, str)  # index, image_path
+    skipped = Signal(int, str)  # index, image_path
+    finished = Signal(int, str, list)  # index, image_path, verdicts
+    failed = Signal(int, str, Exception)  # index, image_path, error
+
+
+class QCancellableHallucinationWorker(QRunnable):
+    """
+    Worker for the hallucination check of the code blocks of a single image in a batch
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.signals = QCancellableHallucinationWorkerSignals()
+
+        # Properties
+        self._index = -1
+        self._image: Optional[str] = None
+        self._detail: Optional[Detail] = None
+        self._model_settings: Optional[ModelSettings] = None
+        self._prepare: Optional[Callable[["QCancellableHallucinationWorker"], bool]] = None
+        self._inputs: Optional[Dict[str, str]] = None
+
+        # Set from the GUI thread, read by the worker thread
+        self._canceled = Event()
+
+    @property
+    def index(self) -> int:
+        return self._index
+
+    @index.setter
+    def index(self, index: int):
+        self._index = index
+
+    @property
+    def image(self) -> Optional[str]:
+        return self._image
+
+    @image.setter
+    def image(self, value: Optional[str]):
+        self._image = value
+
+    @property
+    def detail(self) -> Detail:
+        """
+        The detail whose code blocks are checked, loaded from the sidecar on first use
+        """
+        if self._detail is None:
+            self._detail = load_detail(self.image)
+        return self._detail
+
+    @detail.setter
+    def detail(self, detail: Optional[Detail]):
+        self._detail = detail
+
+    @property
+    def model_settings(self) -> Optional[ModelSettings]:
+        return self._model_settings
+
+    @model_settings.setter
+    def model_settings(self, value: Optional[ModelSettings]):
+        self._model_settings = value
+
+    @property
+    def prepare(self) -> Optional[Callable[["QCancellableHallucinationWorker"], bool]]:
+        """
+        Called on the worker thread before checking, e.g. to hash the inputs, returns False to skip the check
+        """
+        return self._prepare
+
+    @prepare.setter
+    def prepare(self, value: Optional[Callable[["QCancellableHallucinationWorker"], bool]]):
+        self._prepare = value
+
+    @property
+    def inputs(self) -> Optional[Dict[str, str]]:
+        """
+        Hashes of the inputs of the check for the manifest
+        """
+        return self._inputs
+
+    @inputs.setter
+    def inputs(self, value: Optional[Dict[str, str]]):
+        self._inputs = value
+
+    def run(self):
+        try:
+            if self.is_canceled():
+                self.signals.canceled.emit(self.index, self.image)
+                return
+            if self.prepare and not self.prepare(self):
+                self.signals.skipped.emit(self.index, self.image)
+                return
+            if self.is_canceled():
+                self.signals.canceled.emit(self.index, self.image)
+                return
+
+            verdicts = hallucination(Path(self.image), self.model_settings, self.detail)
+            if self.is_canceled():
+                self.signals.canceled.emit(self.index, self.image)
+            else:
+                self.signals.finished.emit(self.index, self.image, verdicts)
+        except Exception as e:
+            logger.error(f"Worker {self.index} failed: {e}")
+            self.signals.failed.emit(self.index, self.image or "", e)
+
+    def is_canceled(self) -> bool:
+        return self._canceled.is_set()
+
+    def cancel(self):
+        self._canceled.set()
@@ -0,0 +1,35 @@
+import os
+from typing import List
+
+from PySide6.QtCore import QObject, QRunnable, Signal
+from loguru import logger
+
+from util import cluster_images
+
+
+class QClusterWorkerSignals(QObject):
+    progress = Signal(int, int)  # analyzed, total
+    finished = Signal(list)  # groups
+    failed = Signal(Exception)  # error
+
+
+class QClusterWorker(QRunnable):
+    """
+    Worker for grouping related screenshots, which reads the detail and the pixels of every image
+    """
+
+    def __init__(self, folder: str | os.PathLike, images: List[str], max_group: int):
+        super().__init__()
+        self.signals = QClusterWorkerSignals()
+        self.folder = folder
+        self.images = images
+        self.max_group = max_group
+
+    def run(self):
+        try:
+            groups = cluster_images(self.folder, self.images, max_group=self.max_group,
+                                    progress=self.signals.progress.emit)
+            self.signals.finished.emit(groups)
+        except Exception as e:
+            logger.error(f"Error while grouping: {e}")
+            self.signals.failed.emit(e)
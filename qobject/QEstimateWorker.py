@@ -0,0 +1,48 @@
+import os
+from typing import Dict, List, Literal, Optional
+
+from PySide6.QtCore import QObject, QRunnable, Signal
+from loguru import logger
+
+from entity import ModelSettings
+from util import estimate_batch
+
+
+class QEstimateWorkerSignals(QObject):
+    finished = Signal(dict)  # estimate
+    failed = Signal(Exception)  # error
+
+
+class QEstimateWorker(QRunnable):
+    """
+    Worker for the dry-run estimate of a batch, which reads every image and builds every prompt without chatting
+    """
+
+    def __init__(self,
+                 kind: Literal["content", "code"],
+                 folder: str | os.PathLike,
+                 images: List[str],
+                 *,
+                 system: str,
+                 model_settings: ModelSettings,
+                 upload_code: bool = True,
+                 history: Optional[Dict[str, float]] = None):
+        super().__init__()
+        self.signals = QEstimateWorkerSignals()
+        self.kind = kind
+        self.folder = folder
+        self.images = images
+        self.system = system
+        self.model_settings = model_settings
+        self.upload_code = upload_code
+        self.history = history
+
+    def run(self):
+        try:
+            estimate = estimate_batch(self.kind, self.folder, self.images, system=self.system,
+                                      model_settings=self.model_settings, upload_code=self.upload_code,
+                                      history=self.history)
+            self.signals.finished.emit(estimate)
+        except Exception as e:
+            logger.error(f"Error while estimating: {e}")
+            self.signals.failed.emit(e)
@@ -0,0 +1,131 @@
+from collections import deque
+from queue import SimpleQueue, Empty
+from typing import Any, Deque, List, NamedTuple
+
+from PySide6.QtCore import QAbstractListModel, QModelIndex, QPersistentModelIndex, Qt
+from PySide6.QtGui import QColor
+
+
+class LogRecord(NamedTuple):
+    seq: int
+    level: int
+    name: str
+    text: str
+
+
+class QLogModel(QAbstractListModel):
+    """
+    Ring-buffer list model of log records.
+
+    Records are appended from any thread into a queue and only become rows when ``flush`` is called on the GUI thread,
+    so the view is updated in batches. At most ``capacity`` records are kept, older ones are dropped.
+    """
+    LEVEL_COLORS = {
+        "TRACE": "gray",
+        "DEBUG": "gray",
+        "INFO": "black",
+        "SUCCESS": "green",
+        "WARNING": "orange",
+        "ERROR": "red",
+        "CRITICAL": "darkred",
+    }
+
+    def __init__(self, parent=None, capacity: int = 5000, max_length: int = 500):
+        """
+        Args:
+            parent: The parent object
+            capacity: Maximum number of records kept
+            max_length: Maximum length of a displayed record, the full text only goes to the log file
+        """
+        super().__init__(parent)
+        self.capacity = capacity
+        self.max_length = max_length
+
+        self._pending: SimpleQueue[LogRecord] = SimpleQueue()
+        self._records: Deque[LogRecord] = deque(maxlen=capacity)
+        self._visible: List[LogRecord] = []
+        self._level = 0
+        self._seq = 0
+
+    @property
+    def level(self) -> int:
+        """Minimum level number of the visible records"""
+        return self._level
+
+    @level.setter
+    def level(self, value: int) -> None:
+        self.beginResetModel()
+        self._level = value
+        self._visible = [record for record in self._records if record.level >= value]
+        self.endResetModel()
+
+    def append(self, level: int, name: str, text: str) -> None:
+        """
+        Queue a record, safe to call from any thread
+
+        Args:
+            level: The level number
+            name: The level name
+            text: The message
+        """
+        text = text.rstrip()
+        first_line, _, rest = text.partition("\n")
+        if rest or len(first_line) > self.max_length:
+            text = first_line[:self.max_length] + " …"
+        self._pending.put(LogRecord(0, level, name, text))
+
+    def flush(self) -> int:
+        """
+        Move the queued records into the model, must be called on the GUI thread
+
+        Returns:
+            The number of records flushed
+        """
+        records = []
+        while True:
+            try:
+                records.append(self._pending.get_nowait())
+            except Empty:
+                break
+        if not records:
+            return 0
+
+        # Only the tail survives the ring buffer anyway
+        records = records[-self.capacity:]
+        records = [record._replace(seq=self._seq + i) for i, record in enumerate(records)]
+        self._seq += len(records)
+        self._records.extend(records)
+
+        oldest = self._records[0].seq
+        if self._visible and self._visible[0].seq < oldest:
+            expired = next((i for i, record in enumerate(self._visible) if record.seq >= oldest), len(self._visible))
+            self.beginRemoveRows(QModelIndex(), 0, expired - 1)
+            del self._visible[:expired]
+            self.endRemoveRows()
+
+        if visible := [record for record in records if record.level >= self._level]:
+            self.beginInsertRows(QModelIndex(), len(self._visible), len(self._visible) + len(visible) - 1)
+            self._visible.extend(visible)
+            self.endInsertRows()
+        return len(records)
+
+    def clear(self) -> None:
+        while not self._pending.empty():
+            self._pending.get_nowait()
+        self.beginResetModel()
+        self._records.clear()
+        self._visible = []
+        self.endResetModel()
+
+    def rowCount(self, parent: QModelIndex | QPersistentModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self._visible)
+
+    def data(self, index: QModelIndex | QPersistentModelIndex, role: int = Qt.ItemDataRole.DisplayRole) -> Any:
+        if not index.isValid() or not 0 <= index.row() < len(self._visible):
+            return None
+        record = self._visible[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return record.text
+        if role == Qt.ItemDataRole.ForegroundRole:
+            return QColor(self.LEVEL_COLORS.get(record.name, "black"))
+        return None
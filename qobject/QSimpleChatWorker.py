@@ -3,7 +3,7 @@ from typing import Optional
 from PySide6.QtCore import QObject, QRunnable, Signal
 from loguru import logger
 
-from util import chat
+from util import chat, interactive
 
 
 class QSimpleChatWorkerSignals(QObject):
@@ -45,7 +45,8 @@ class QSimpleChatWorker(QRunnable):
 
     def run(self):
         try:
-            result = chat(system=self.system, text=self.text, image_url=self.image)
+            with interactive():
+                result = chat(system=self.system, text=self.text, image_url=self.image)
             self.signals.finished.emit(result)
         except Exception as e:
             logger.error(f"Error while chatting: {e}")
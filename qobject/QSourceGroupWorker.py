@@ -0,0 +1,40 @@
+import os
+from pathlib import Path
+from typing import List
+
+from PySide6.QtCore import QObject, QRunnable, Signal
+from loguru import logger
+
+from util import estimated_size, load_detail, source_file
+
+
+class QSourceGroupWorkerSignals(QObject):
+    finished = Signal(list)  # [(image name, source file or None, estimated size or None)]
+
+
+class QSourceGroupWorker(QRunnable):
+    """
+    Worker reading the sidecars of a chunk of images off the GUI thread, for the source file the code prompt of each
+    includes, which the batch groups images by, and for the size of each request, see ``estimated_size``
+    """
+
+    def __init__(self, folder: str | os.PathLike, images: List[str], upload_code: bool = True):
+        super().__init__()
+        self.signals = QSourceGroupWorkerSignals()
+        self.folder = Path(folder)
+        self.images = images
+        self.upload_code = upload_code
+
+    def run(self):
+        groups = []
+        for image_name in self.images:
+            try:
+                detail = load_detail(self.folder / image_name)
+                path = source_file(detail, self.upload_code)
+                size = estimated_size("code", self.folder / image_name, detail, source=self.upload_code)
+            except Exception as e:
+                # Not grouped, the chat worker reports the broken sidecar
+                logger.debug(f"Failed to read the source file of {image_name}: {e}")
+                path, size = None, None
+            groups.append((image_name, str(path) if path else None, size))
+        self.signals.finished.emit(groups)
@@ -1,15 +1,27 @@
 from .HallucinationWorker import HallucinationWorker
+from .QBatchState import QBatchState
 from .QCancellableChatWorker import QCancellableChatWorker
+from .QCancellableHallucinationWorker import QCancellableHallucinationWorker
+from .QClusterWorker import QClusterWorker
+from .QEstimateWorker import QEstimateWorker
 from .QJavaScriptHighlighter import QJavaScriptHighlighter
+from .QLogModel import QLogModel
 from .QPythonHighlighter import QPythonHighlighter
 from .QSimpleChatWorker import QSimpleChatWorker
+from .QSourceGroupWorker import QSourceGroupWorker
 from .QTypeScriptHighlighter import QTypeScriptHighlighter
 
 __all__ = [
+    'QBatchState',
     'QCancellableChatWorker',
+    'QCancellableHallucinationWorker',
+    'QClusterWorker',
+    'QEstimateWorker',
     'QJavaScriptHighlighter',
+    'QLogModel',
     'QPythonHighlighter',
     'QSimpleChatWorker',
+    'QSourceGroupWorker',
     'QTypeScriptHighlighter',
     'HallucinationWorker'
 ]
@@ -13,7 +13,7 @@ import constant
 from entity import Detail, CodeBlock
 from qmessagebox import failed_to_generate, invalid_file, invalid_folder, overwrite_files, task_completed
 from qobject import QSimpleChatWorker, QPythonHighlighter, QTypeScriptHighlighter, QJavaScriptHighlighter
-from util import block_signals, extract_code_blocks, read_settings, write_settings
+from util import block_signals, extract_code_blocks, read_settings, read_source, write_settings
 from .QCodeEdit import QCodeEdit
 from .QPager import QPager
 
@@ -464,12 +464,14 @@ class QDetailWidget(QWidget):
         if content := self.content.toPlainText():
             text += f"\nImage Content: {content}"
 
-        source_code = Path(self.project.text()) / Path(self.location.text())
-        if source_code.exists() and self.upload_code.isChecked():
-            text += f"\nSource Code:\n{source_code.read_text()}"
+        if self.upload_code.isChecked() and \
+                (source_code := read_source(Path(self.project.text()) / Path(self.location.text()))) is not None:
+            text += f"\nSource Code:\n{source_code}"
         return text
 
     def sync_detail(self) -> None:
+        # Keep the hallucination verdicts of the code blocks that are unchanged
+        verdicts = {(block.code or "").strip(): block.hallucination for block in self.detail.code} if self.detail else {}
         with block_signals(self):
             self.detail = Detail(
                 project=self.project.text().strip(),
@@ -478,6 +480,7 @@ class QDetailWidget(QWidget):
                 language=self.language.currentText().strip(),
                 tool=self.tool.currentText().strip(),
                 content=self.content.toPlainText().strip(),
-                code=[CodeBlock(language=title.strip(), code=code.toPlainText().strip())
+                code=[CodeBlock(language=title.strip(), code=code.toPlainText().strip(),
+                                hallucination=verdicts.get(code.toPlainText().strip()))
                       for title, code in self.code_pager.pages() if isinstance(code, QCodeEdit)]
             )
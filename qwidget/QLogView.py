@@ -0,0 +1,82 @@
+from PySide6.QtCore import QTimer, Slot
+from PySide6.QtGui import QFont
+from PySide6.QtWidgets import QWidget, QListView, QComboBox, QLabel, QHBoxLayout, QVBoxLayout, QAbstractItemView
+
+from qobject import QLogModel
+
+
+class QLogView(QWidget):
+    """
+    Log panel backed by a ring-buffer model, use ``sink`` as a loguru sink.
+
+    Records are flushed into the list on a timer, so logging from many workers costs one view update per interval.
+    """
+    LEVELS = {
+        "DEBUG": 10,
+        "INFO": 20,
+        "SUCCESS": 25,
+        "WARNING": 30,
+        "ERROR": 40,
+    }
+
+    def __init__(self, parent=None, capacity: int = 5000, interval: int = 200):
+        super().__init__(parent)
+        self.model = QLogModel(self, capacity=capacity)
+        self.list_view = QListView()
+        self.level_label = QLabel("Level:")
+        self.level_combo_box = QComboBox()
+        self._timer = QTimer(self)
+        self._timer.setInterval(interval)
+
+        self._init_ui()
+        self._connect_signals()
+        self._timer.start()
+
+    def _init_ui(self):
+        # Uniform row heights let the view lay out only the visible rows
+        self.list_view.setModel(self.model)
+        self.list_view.setUniformItemSizes(True)
+        self.list_view.setLayoutMode(QListView.LayoutMode.Batched)
+        self.list_view.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.list_view.setSelectionMode(QAbstractItemView.SelectionMode.ExtendedSelection)
+        self.list_view.setFont(QFont("Consolas"))
+
+        self.level_combo_box.addItems(list(self.LEVELS))
+        self.level_combo_box.setCurrentText("INFO")
+        self.model.level = self.LEVELS["INFO"]
+
+        header_row = QHBoxLayout()
+        header_row.addStretch()
+        header_row.addWidget(self.level_label)
+        header_row.addWidget(self.level_combo_box)
+
+        main_layout = QVBoxLayout(self)
+        main_layout.setContentsMargins(0, 0, 0, 0)
+        main_layout.addLayout(header_row)
+        main_layout.addWidget(self.list_view)
+
+    def _connect_signals(self):
+        self._timer.timeout.connect(self.flush)
+        self.level_combo_box.currentTextChanged.connect(self.on_level_changed)
+
+    def sink(self, message) -> None:
+        """
+        Loguru sink, safe to call from any thread
+        """
+        level = message.record["level"]
+        self.model.append(level.no, level.name, str(message))
+
+    @Slot()
+    def flush(self) -> None:
+        scroll_bar = self.list_view.verticalScrollBar()
+        follow = scroll_bar.value() == scroll_bar.maximum()
+        if self.model.flush() and follow:
+            self.list_view.scrollToBottom()
+
+    def clear(self) -> None:
+        self.model.clear()
+
+    @Slot(str)
+    def on_level_changed(self, level: str) -> None:
+        self.model.level = self.LEVELS.get(level, 0)
+        self.list_view.scrollToBottom()
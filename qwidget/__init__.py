@@ -3,6 +3,7 @@ from .QDetailWidget import QDetailWidget
 from .QFloatSlider import QFloatSlider
 from .QImageViewer import QImageViewer
 from .QLineNumberBar import QLineNumberBar
+from .QLogView import QLogView
 from .QPager import QPager
 
-__all__ = ['QCodeEdit', 'QDetailWidget', 'QFloatSlider', 'QImageViewer', 'QLineNumberBar', 'QPager']
+__all__ = ['QCodeEdit', 'QDetailWidget', 'QFloatSlider', 'QImageViewer', 'QLineNumberBar', 'QLogView', 'QPager']
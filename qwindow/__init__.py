@@ -1,5 +1,7 @@
 from .BatchCode_ui import Ui_BatchCode as BatchCodeUi
 from .BatchContent_ui import Ui_BatchContent as BatchContentUi
+from .BatchHallucination_ui import Ui_BatchHallucination as BatchHallucinationUi
+from .BatchRelated_ui import Ui_BatchRelated as BatchRelatedUi
 from .MainWindow_ui import Ui_main_window as MainWindowUi
 from .SettingsModel_ui import Ui_SettingsModel as SettingsModelUi
 from .SettingsPrompt_ui import Ui_SettingsPrompt as SettingsPromptUi
@@ -19,4 +21,10 @@ __all__ = [
 
     # batch_code
     'BatchCodeUi',
+
+    # batch_hallucination
+    'BatchHallucinationUi',
+
+    # batch_related
+    'BatchRelatedUi',
 ]
@@ -22,11 +22,13 @@ if not exist "%PYUIC%" (
 set "UI_FILES[0]=MainWindow.ui"
 set "UI_FILES[1]=BatchContent.ui"
 set "UI_FILES[2]=BatchCode.ui"
-set "UI_FILES[3]=SettingsModel.ui"
-set "UI_FILES[4]=SettingsPrompt.ui"
+set "UI_FILES[3]=BatchHallucination.ui"
+set "UI_FILES[4]=BatchRelated.ui"
+set "UI_FILES[5]=SettingsModel.ui"
+set "UI_FILES[6]=SettingsPrompt.ui"
 
 :: Compile each UI file
-for /l %%i in (0,1,4) do (
+for /l %%i in (0,1,6) do (
     set "UI_FILE=!UI_FILES[%%i]!"
     set "OUT_FILE=!UI_FILE:.ui=_ui.py!"
     
@@ -27,6 +27,8 @@ declare -a UI_FILES=(
     "MainWindow.ui"
     "BatchContent.ui"
     "BatchCode.ui"
+    "BatchHallucination.ui"
+    "BatchRelated.ui"
     "SettingsModel.ui"
     "SettingsPrompt.ui"
 )
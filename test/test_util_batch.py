@@ -0,0 +1,41 @@
+import os
+import stat
+import tempfile
+import unittest
+from pathlib import Path
+
+from util import apply_result, load_detail, save_result, sidecar_path
+
+
+class TestUtilBatch(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.image = Path(self.folder.name) / "page.png"
+        self.image.write_bytes(b"screenshot")
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_save_keeps_mode(self):
+        umask = os.umask(0)
+        os.umask(umask)
+        save_result("content", self.image, "Login page")
+        sidecar = sidecar_path(self.image)
+        self.assertEqual(stat.S_IMODE(sidecar.stat().st_mode), 0o666 & ~umask)
+
+        os.chmod(sidecar, 0o640)
+        save_result("content", self.image, "Search page")
+        self.assertEqual(stat.S_IMODE(sidecar.stat().st_mode), 0o640)
+        self.assertEqual(load_detail(self.image).content, "Search page")
+
+    def test_apply_result(self):
+        detail = apply_result("code", load_detail(self.image), "```python\ndef test_a(): pass\n```", "OpenAI/gpt")
+        self.assertEqual([block.code for block in detail.code], ["def test_a(): pass"])
+        self.assertEqual(detail.models, {"code": "OpenAI/gpt"})
+        self.assertFalse(sidecar_path(self.image).exists())
+        with self.assertRaises(ValueError):
+            apply_result("hallucination", detail, "True")
+
+
+if __name__ == "__main__":
+    unittest.main()
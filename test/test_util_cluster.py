@@ -0,0 +1,64 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from PIL import Image, ImageDraw
+
+from entity import Detail
+from util import cluster_images, group_images, group_key, histogram
+
+
+def _page(path: Path, color: str = "navy", shift: int = 0, location: str = None) -> None:
+    image = Image.new("RGB", (320, 240), "white")
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((0, 0, 319, 40), fill=color)
+    draw.rectangle((20 + shift, 80, 140 + shift, 200), fill="gray")
+    image.save(path)
+    Detail(location=location).save(str(path) + ".json")
+
+
+class TestUtilCluster(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.root = Path(self.folder.name)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_histogram(self):
+        _page(self.root / "a.png")
+        features = histogram(self.root / "a.png")
+        self.assertEqual(features.shape, (24,))
+        self.assertAlmostEqual(float(features.sum()), 3, places=4)
+
+    def test_visual_similarity(self):
+        _page(self.root / "a.png")
+        _page(self.root / "a_scrolled.png", shift=4)
+        _page(self.root / "b.png", color="darkred", shift=150)
+        self.assertEqual(cluster_images(self.root, ["b.png", "a_scrolled.png", "a.png"]),
+                         [["a.png", "a_scrolled.png"]])
+
+    def test_location(self):
+        _page(self.root / "login.png", location="src/login.ts")
+        _page(self.root / "login_error.png", color="darkred", shift=150, location="src/login.ts")
+        _page(self.root / "home.png", shift=4, location="src/home.ts")
+        # Screenshots of the same location are grouped even if they look different, never across locations
+        self.assertEqual(cluster_images(self.root, ["home.png", "login.png", "login_error.png"]),
+                         [["login.png", "login_error.png"]])
+
+    def test_max_group(self):
+        names = [f"{i}.png" for i in range(7)]
+        for name in names:
+            _page(self.root / name, location="src/app.ts")
+        groups = cluster_images(self.root, names, max_group=3)
+        self.assertEqual([len(group) for group in groups], [3, 3])
+        self.assertEqual(cluster_images(self.root, names[:1]), [])
+
+    def test_group_key(self):
+        group = ["login.png", "login error.png", "login_2.png"]
+        self.assertEqual(group_images(group_key(group)), group)
+        self.assertEqual(group_images("home.png"), ["home.png"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+from unittest import mock
+
+from util import AIMDController, interactive
+
+
+class TestUtilConcurrency(unittest.TestCase):
+    def test_additive_increase(self):
+        controller = AIMDController(initial=2, maximum=4)
+        for _ in range(2):
+            controller.on_dispatch()
+        for _ in range(2):
+            controller.on_success(1.0)
+        self.assertEqual(controller.limit, 3)
+        self.assertEqual(controller.in_flight, 0)
+
+    def test_multiplicative_decrease(self):
+        controller = AIMDController(initial=8, maximum=8)
+        controller.on_dispatch()
+        controller.on_failure("rate_limit")
+        self.assertEqual(controller.limit, 4)
+
+        # Decreases within the cooldown are ignored
+        controller.on_dispatch()
+        controller.on_failure("timeout")
+        self.assertEqual(controller.limit, 4)
+
+    def test_first_decrease_right_after_boot(self):
+        # The monotonic clock may start near zero, e.g. on a freshly booted machine
+        with mock.patch("util.util_concurrency.time.monotonic", return_value=1.0):
+            controller = AIMDController(initial=8, maximum=8)
+            controller.on_dispatch()
+            controller.on_failure("rate_limit")
+        self.assertEqual(controller.limit, 4)
+
+    def test_slow_requests_hold_limit(self):
+        controller = AIMDController(initial=1, maximum=4)
+        controller.on_dispatch()
+        controller.on_success(1.0)
+        self.assertEqual(controller.limit, 2)
+        for _ in range(4):
+            controller.on_dispatch()
+            controller.on_success(10.0)
+        self.assertEqual(controller.limit, 2)
+
+    def test_can_dispatch(self):
+        controller = AIMDController(initial=1, maximum=1)
+        self.assertTrue(controller.can_dispatch())
+        controller.on_dispatch()
+        self.assertFalse(controller.can_dispatch())
+        controller.on_cancel()
+        self.assertTrue(controller.can_dispatch())
+
+    def test_interactive_requests_go_first(self):
+        controller = AIMDController(initial=2, maximum=2)
+        controller.on_dispatch()
+        with interactive():
+            self.assertFalse(controller.can_dispatch())
+        self.assertTrue(controller.can_dispatch())
+
+
+if __name__ == "__main__":
+    unittest.main()
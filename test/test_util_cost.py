@@ -0,0 +1,73 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from PIL import Image
+
+from entity import ClaudeModel, ModelProvider, ModelSettings, OpenAIModel
+from util import TokenBudget, estimate_batch, image_tokens, text_tokens
+
+
+class TestUtilCost(unittest.TestCase):
+    def setUp(self):
+        self.openai = ModelSettings(provider=ModelProvider.OpenAI, openai_model=OpenAIModel.GPT_4O)
+        self.claude = ModelSettings(provider=ModelProvider.Claude, claude_model=ClaudeModel.CLAUDE_3_7_SONNET)
+
+    def test_text_tokens(self):
+        self.assertEqual(text_tokens(""), 0)
+        self.assertEqual(text_tokens("abcdefgh"), 2)
+        self.assertEqual(text_tokens("测试ab"), 3)
+
+    def test_image_tokens(self):
+        # 1024x1024 is scaled to 768x768, which takes 2x2 tiles
+        self.assertEqual(image_tokens((1024, 1024), self.openai), 85 + 170 * 4)
+        self.assertEqual(image_tokens((512, 512), self.openai), 85 + 170)
+        self.assertEqual(image_tokens((750, 100), self.claude), 100)
+        # Long edges are scaled down to 1568 pixels
+        self.assertEqual(image_tokens((3136, 100), self.claude), image_tokens((1568, 50), self.claude))
+
+    def test_estimate_batch(self):
+        with tempfile.TemporaryDirectory() as folder:
+            for name in ("a.png", "b.png"):
+                Image.new("RGB", (512, 512)).save(Path(folder) / name)
+
+            estimate = estimate_batch("content", folder, ["a.png", "b.png"], system="abcd",
+                                      model_settings=self.openai)
+            self.assertEqual(estimate["items"], 2)
+            self.assertEqual(estimate["input_tokens"], 2 * (1 + 85 + 170))
+            self.assertEqual(estimate["output_tokens"], 2 * 500)
+            self.assertIsNone(estimate["duration"])
+
+            estimate = estimate_batch("content", folder, ["a.png"], system="", model_settings=self.openai,
+                                      history={"output_tokens": 100, "items_per_minute": 30})
+            self.assertEqual(estimate["output_tokens"], 100)
+            self.assertAlmostEqual(estimate["duration"], 2.0)
+            self.assertAlmostEqual(estimate["cost"], (255 * 2.5 + 100 * 10.0) / 1_000_000)
+
+    def test_budget(self):
+        budget = TokenBudget(max_tokens=1000)
+        budget.spend(600, 300)
+        self.assertFalse(budget.exhausted)
+        budget.spend(100, 0)
+        self.assertTrue(budget.exhausted)
+
+        budget = TokenBudget(max_cost=0.01, model_settings=self.claude)
+        budget.spend(1000, 400)
+        self.assertFalse(budget.exhausted)
+        budget.spend(0, 300)
+        self.assertTrue(budget.exhausted)
+
+        with self.assertRaises(ValueError):
+            TokenBudget(max_cost=1.0, model_settings=ModelSettings(provider=ModelProvider.SiliconFlow))
+
+    def test_budget_switch_model(self):
+        budget = TokenBudget(max_cost=1.0, model_settings=self.claude)
+        budget.spend(1000, 400)
+        spent = budget.cost
+        budget.switch_model(self.openai)
+        budget.spend(1000, 0)
+        self.assertEqual(budget.tokens, 2400)
+        self.assertAlmostEqual(budget.cost, spent + 1000 * 2.5 / 1_000_000)
+
+        with self.assertRaises(ValueError):
+            budget.switch_model(ModelSettings(provider=ModelProvider.SiliconFlow))
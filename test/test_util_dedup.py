@@ -0,0 +1,67 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from PIL import Image, ImageDraw
+
+from util import DuplicateIndex, dhash, hamming
+
+
+def _page(path: Path, marker: int = 0, shift: int = 0) -> None:
+    image = Image.new("RGB", (320, 240), "white")
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((0, 0, 319, 40), fill="navy")
+    draw.rectangle((20 + shift, 80, 140 + shift, 200), fill="gray")
+    draw.rectangle((180, 80, 300, 120 + marker), fill="black")
+    image.save(path)
+
+
+class TestUtilDedup(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.root = Path(self.folder.name)
+        _page(self.root / "a.png")
+        _page(self.root / "a_hover.png", marker=2)
+        _page(self.root / "b.png", shift=150)
+        self.index = DuplicateIndex(self.root, max_distance=6)
+
+    def tearDown(self):
+        self.index.close()
+        self.folder.cleanup()
+
+    def test_near_duplicates(self):
+        self.assertLessEqual(hamming(dhash(self.root / "a.png"), dhash(self.root / "a_hover.png")), 6)
+        self.assertGreater(hamming(dhash(self.root / "a.png"), dhash(self.root / "b.png")), 6)
+
+        self.index.add("a.png")
+        self.index.add("b.png")
+        self.assertEqual([name for name, _ in self.index.matches(self.index.hash("a_hover.png"))], ["a.png"])
+        self.assertEqual(self.index.matches(self.index.hash("a.png"), exclude="a.png"), [])
+
+    def test_hashes_are_persisted(self):
+        for name in ("a.png", "b.png"):
+            self.index.hash(name)
+
+        index = DuplicateIndex(self.root)
+        try:
+            self.assertEqual(index.load(["a.png", "a_hover.png"]), 1)
+            self.assertEqual(len(index), 1)
+            self.assertEqual(index.hash("b.png"), dhash(self.root / "b.png"))
+        finally:
+            index.close()
+
+    def test_grows(self):
+        for i in range(100):
+            self.index.add(f"{i}.png", i)
+        self.assertEqual(self.index.matches(3, max_distance=0), [("3.png", 0)])
+        self.assertEqual(len(self.index.matches(0, max_distance=1)), 8)
+
+        self.assertTrue(self.index.remove("3.png"))
+        self.assertFalse(self.index.remove("3.png"))
+        self.assertNotIn("3.png", self.index)
+        self.assertEqual(self.index.matches(3, max_distance=0), [])
+        self.assertEqual(self.index.matches(99, max_distance=0), [("99.png", 0)])
+
+
+if __name__ == "__main__":
+    unittest.main()
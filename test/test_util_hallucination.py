@@ -1,9 +1,11 @@
+import tempfile
 from pathlib import Path
-from unittest import TestCase
+from unittest import TestCase, mock
 
 from loguru import logger
 
-from util import hallucination
+from entity import CodeBlock, Detail
+from util import hallucination, parse_verdicts
 
 
 class TestHallucination(TestCase):
@@ -12,3 +14,59 @@ class TestHallucination(TestCase):
         result = hallucination(image_path)
         logger.info(result)
         assert result
+
+    def test_parse_verdicts(self):
+        self.assertEqual(parse_verdicts("[true, false]", 2), [True, False])
+        self.assertEqual(parse_verdicts('```json\n["True", "false"]\n```', 2), [True, False])
+        self.assertIsNone(parse_verdicts("[true]", 2))
+        self.assertIsNone(parse_verdicts("True", 1))
+        self.assertIsNone(parse_verdicts("[1, 0]", 2))
+
+
+class TestBatchedHallucination(TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        root = Path(self.folder.name)
+        (root / "page.ts").write_text("export const page = 1;")
+        self.image = root / "page.png"
+        self.detail = Detail(project=str(root), location="page.ts", code=[
+            CodeBlock(language="typescript", code="test('a')"),
+            CodeBlock(language="text", code="notes"),
+            CodeBlock(language="python", code="def test_b(): pass"),
+        ])
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_one_request(self):
+        with mock.patch("util.util_hallucination.chat", return_value="[false, true]") as chat:
+            self.assertEqual(hallucination(self.image, detail=self.detail), [False, None, True])
+        self.assertEqual(chat.call_count, 1)
+        self.assertIn("Test code 2: def test_b(): pass", chat.call_args.kwargs["text"])
+
+    def test_fallback_per_block(self):
+        answers = {"test('a')": "True", "def test_b(): pass": "False"}
+
+        def _chat(*, text, **_):
+            if "Test code 1" in text:
+                return "I cannot tell"
+            return answers[text.split("\n")[0].removeprefix("Test code: ")]
+
+        # An answer that cannot be parsed
+        with mock.patch("util.util_hallucination.chat", side_effect=_chat) as chat:
+            self.assertEqual(hallucination(self.image, detail=self.detail), [True, None, False])
+        self.assertEqual(chat.call_count, 3)
+
+        # A prompt over the budget is never sent as a whole
+        with mock.patch("util.util_hallucination.chat", side_effect=_chat) as chat:
+            self.assertEqual(hallucination(self.image, detail=self.detail, max_tokens=10), [True, None, False])
+        self.assertEqual(chat.call_count, 2)
+
+    def test_precheck(self):
+        self.detail.code[2].code = "driver.find_element(By.ID, 'password')"
+        with mock.patch("util.util_hallucination.chat", return_value="False") as chat:
+            self.assertEqual(hallucination(self.image, detail=self.detail), [False, None, True])
+        self.assertEqual(chat.call_count, 1)
+        with mock.patch("util.util_hallucination.chat", return_value="[false, false]") as chat:
+            self.assertEqual(hallucination(self.image, detail=self.detail, precheck=False), [False, None, False])
+        self.assertEqual(chat.call_count, 1)
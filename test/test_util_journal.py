@@ -0,0 +1,102 @@
+import tempfile
+import unittest
+
+from util import BatchJournal
+
+
+class TestUtilJournal(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.journal = BatchJournal(self.folder.name)
+
+    def tearDown(self):
+        self.journal.close()
+        self.folder.cleanup()
+
+    def test_resume_skips_finished(self):
+        job_id = self.journal.create_job("code", ["a.png", "b.png", "c.png"], {"system": "test"})
+        self.journal.mark(job_id, "a.png", "finished")
+        self.journal.mark(job_id, "b.png", "failed", "timeout")
+
+        self.assertEqual(self.journal.unfinished_job("code"), job_id)
+        self.assertIsNone(self.journal.unfinished_job("content"))
+        self.assertEqual(self.journal.remaining(job_id), ["b.png", "c.png"])
+        self.assertEqual(self.journal.job_config(job_id), {"system": "test"})
+        self.assertEqual(self.journal.retries(job_id), {"b.png"})
+        self.assertEqual(self.journal.failed(job_id), ["b.png"])
+
+    def test_iter_remaining_pages(self):
+        job_id = self.journal.create_job("code", (f"{i}.png" for i in range(7)))
+        self.journal.mark(job_id, "3.png", "finished")
+
+        self.assertEqual(list(self.journal.iter_remaining(job_id, page=2)), ["0.png", "1.png", "2.png", "4.png",
+                                                                           "5.png", "6.png"])
+        self.assertEqual(self.journal.remaining_count(job_id), 6)
+        self.assertTrue(self.journal.is_remaining(job_id, "4.png"))
+        self.assertFalse(self.journal.is_remaining(job_id, "3.png"))
+        self.assertFalse(self.journal.is_remaining(job_id, "7.png"))
+
+    def test_history(self):
+        self.assertEqual(self.journal.history("code"), {})
+        job_id = self.journal.create_job("code", ["a.png", "b.png", "c.png"])
+        for image, input_tokens in (("a.png", 1000), ("b.png", 3000)):
+            self.journal.mark(job_id, image, "finished")
+            self.journal.record_usage(job_id, image, 2.0, input_tokens, 500)
+        self.journal.mark(job_id, "c.png", "failed", "timeout")
+
+        history = self.journal.history("code")
+        self.assertEqual(history["items"], 2)
+        self.assertEqual(history["input_tokens"], 2000)
+        self.assertEqual(history["output_tokens"], 500)
+        self.assertEqual(history["latency"], 2.0)
+        self.assertGreater(history["items_per_minute"], 0)
+        self.assertEqual(self.journal.history("content"), {})
+
+    def test_close_job(self):
+        job_id = self.journal.create_job("content", ["a.png", "b.png"])
+        self.journal.mark(job_id, "a.png", "finished")
+        self.assertEqual(self.journal.close_job(job_id), "interrupted")
+
+        self.journal.mark(job_id, "b.png", "finished")
+        self.assertEqual(self.journal.close_job(job_id), "finished")
+        self.assertIsNone(self.journal.unfinished_job("content"))
+
+    def test_claim_and_lease(self):
+        job_id, created = self.journal.open_job("code", ["a.png", "b.png", "c.png"])
+        self.assertTrue(created)
+        self.assertEqual(self.journal.open_job("code", []), (job_id, False))
+
+        self.assertEqual(self.journal.claim(job_id, "one", limit=2), ["a.png", "b.png"])
+        self.assertEqual(self.journal.claim(job_id, "two", limit=2), ["c.png"])
+        self.assertFalse(self.journal.claim_image(job_id, "a.png", "two"))
+        self.assertTrue(self.journal.claim_image(job_id, "a.png", "one"))
+        self.assertEqual(self.journal.remaining(job_id), [])
+        self.assertEqual(self.journal.close_job(job_id), "running")
+
+        # Expired leases can be claimed again
+        self.journal.heartbeat(job_id, "one", lease=-1)
+        self.assertEqual(self.journal.claim(job_id, "two", limit=5), ["a.png", "b.png"])
+
+        self.journal.mark(job_id, "a.png", "finished")
+        self.assertEqual(self.journal.release(job_id, "two"), 2)
+        self.assertEqual(self.journal.remaining(job_id), ["b.png", "c.png"])
+        self.assertEqual(self.journal.close_job(job_id), "interrupted")
+
+    def test_failed_items_settle(self):
+        job_id, _ = self.journal.open_job("code", ["a.png"])
+        for _ in range(2):
+            self.assertEqual(self.journal.claim(job_id, "one", max_attempts=2), ["a.png"])
+            self.journal.mark(job_id, "a.png", "failed", "timeout")
+            self.assertEqual(self.journal.close_job(job_id), "interrupted")
+        self.assertEqual(self.journal.claim(job_id, "one", max_attempts=2), [])
+        self.assertEqual(self.journal.close_job(job_id, max_attempts=2), "finished")
+
+        # The next run works on the new images instead of joining the settled job
+        new_job_id, created = self.journal.open_job("code", ["new.png"])
+        self.assertTrue(created)
+        self.assertNotEqual(new_job_id, job_id)
+        self.assertEqual(self.journal.claim(new_job_id, "one", max_attempts=2), ["new.png"])
+
+
+if __name__ == "__main__":
+    unittest.main()
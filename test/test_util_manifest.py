@@ -0,0 +1,81 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from entity import CodeBlock, Detail, ModelSettings
+from util import Manifest, input_hashes, load_detail, save_verdicts, sidecar_path
+
+
+class TestUtilManifest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.image = Path(self.folder.name) / "page.png"
+        self.image.write_bytes(b"screenshot")
+        self.manifest = Manifest(self.folder.name)
+        self.model_settings = ModelSettings()
+
+    def tearDown(self):
+        self.manifest.close()
+        self.folder.cleanup()
+
+    def test_unrecorded_is_stale(self):
+        inputs = input_hashes("content", self.image, system="system", model_settings=self.model_settings)
+        self.assertTrue(self.manifest.is_stale(self.image.name, "content", inputs))
+
+    def test_unchanged_inputs_are_fresh(self):
+        inputs = input_hashes("content", self.image, system="system", model_settings=self.model_settings)
+        self.manifest.record(self.image.name, "content", inputs)
+        self.assertFalse(self.manifest.is_stale(self.image.name, "content", inputs))
+        self.assertTrue(self.manifest.is_stale(self.image.name, "code", inputs))
+
+    def test_changed_inputs_are_stale(self):
+        detail = Detail(project=self.folder.name, location="App.vue", content="A page")
+        source = Path(self.folder.name) / "App.vue"
+        source.write_text("<template/>")
+        inputs = input_hashes("code", self.image, system="system", model_settings=self.model_settings, detail=detail)
+        self.manifest.record(self.image.name, "code", inputs)
+
+        source.write_text("<template><div/></template>")
+        changed = input_hashes("code", self.image, system="system", model_settings=self.model_settings, detail=detail)
+        self.assertTrue(self.manifest.is_stale(self.image.name, "code", changed))
+
+        self.image.write_bytes(b"new screenshot")
+        changed = input_hashes("content", self.image, system="system", model_settings=self.model_settings)
+        self.assertTrue(self.manifest.is_stale(self.image.name, "content", changed))
+
+    def test_hallucination_inputs(self):
+        detail = Detail(project=self.folder.name, location="App.vue", code=[CodeBlock(language="js", code="a()")])
+        (Path(self.folder.name) / "App.vue").write_text("<template/>")
+        inputs = input_hashes("hallucination", self.image, system="system", model_settings=self.model_settings,
+                              detail=detail)
+        self.manifest.record(self.image.name, "hallucination", inputs)
+
+        detail.content = "A page"
+        unchanged = input_hashes("hallucination", self.image, system="system", model_settings=self.model_settings,
+                                 detail=detail)
+        self.assertFalse(self.manifest.is_stale(self.image.name, "hallucination", unchanged))
+
+        detail.code[0].code = "b()"
+        changed = input_hashes("hallucination", self.image, system="system", model_settings=self.model_settings,
+                               detail=detail)
+        self.assertTrue(self.manifest.is_stale(self.image.name, "hallucination", changed))
+
+        self.manifest.record(self.image.name, "hallucination", changed)
+        with mock.patch("util.util_hallucination.MAX_BATCH_TOKENS", 1000):
+            changed = input_hashes("hallucination", self.image, system="system", model_settings=self.model_settings,
+                                   detail=detail)
+        self.assertTrue(self.manifest.is_stale(self.image.name, "hallucination", changed))
+
+    def test_save_verdicts(self):
+        checked = [CodeBlock(language="js", code="a()"), CodeBlock(language="js", code="b()"),
+                   CodeBlock(language="css", code="div {}")]
+        Detail(code=[checked[0], CodeBlock(language="js", code="edited()"), checked[2]]).save(
+            str(sidecar_path(self.image)))
+
+        save_verdicts(self.image, checked, [True, False, None])
+        self.assertEqual([block.hallucination for block in load_detail(self.image).code], [True, None, None])
+
+
+if __name__ == "__main__":
+    unittest.main()
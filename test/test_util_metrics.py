@@ -0,0 +1,33 @@
+import unittest
+
+from util import BatchMetrics, format_duration
+
+
+class TestUtilMetrics(unittest.TestCase):
+    def test_snapshot(self):
+        metrics = BatchMetrics()
+        for latency in (1.0, 2.0, 3.0, 4.0, 10.0):
+            metrics.record("finished", latency)
+        metrics.record("failed", 5.0, "rate_limit")
+        metrics.record("failed", 5.0, "timeout")
+        metrics.record("canceled")
+        metrics.record_tokens(1000)
+
+        snapshot = metrics.snapshot(remaining=10)
+        self.assertEqual(snapshot["p50"], 3.0)
+        self.assertEqual(snapshot["p95"], 10.0)
+        self.assertEqual(snapshot["errors"], {"rate_limit": 1, "timeout": 1})
+        self.assertAlmostEqual(snapshot["error_rate"], 2 / 7)
+        self.assertGreater(snapshot["items_per_minute"], 0)
+        self.assertGreater(snapshot["eta"], 0)
+
+    def test_empty(self):
+        snapshot = BatchMetrics().snapshot(remaining=3)
+        self.assertIsNone(snapshot["p50"])
+        self.assertIsNone(snapshot["eta"])
+        self.assertEqual(format_duration(snapshot["eta"]), "--:--:--")
+        self.assertEqual(format_duration(3725), "1:02:05")
+
+
+if __name__ == "__main__":
+    unittest.main()
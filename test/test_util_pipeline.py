@@ -0,0 +1,59 @@
+import threading
+import time
+import unittest
+
+from util import AIMDController, Pipeline, PipelineStage
+
+
+class TestUtilPipeline(unittest.TestCase):
+    def test_items_flow_through_stages(self):
+        trace = []
+        lock = threading.Lock()
+
+        def stage(name):
+            def func(item):
+                with lock:
+                    trace.append((name, item))
+                return {"value": item}
+
+            return func
+
+        pipeline = Pipeline([PipelineStage("a", stage("a"), AIMDController(initial=2, maximum=2)),
+                             PipelineStage("b", stage("b"), AIMDController(initial=2, maximum=2))])
+        events = []
+        counts = pipeline.run(range(5), lambda *event: events.append(event))
+
+        self.assertEqual(counts["a"]["finished"], 5)
+        self.assertEqual(counts["b"]["finished"], 5)
+        self.assertEqual(len(events), 10)
+        for item in range(5):
+            self.assertLess(trace.index(("a", item)), trace.index(("b", item)))
+
+    def test_failed_items_leave_the_pipeline(self):
+        def first(item):
+            if item % 2:
+                raise ValueError(item)
+
+        seen = []
+        pipeline = Pipeline([PipelineStage("a", first, AIMDController(maximum=4)),
+                             PipelineStage("b", seen.append, AIMDController(maximum=4))])
+        counts = pipeline.run(range(4))
+
+        self.assertEqual(counts["a"], {"finished": 2, "failed": 2, "skipped": 0})
+        self.assertEqual(sorted(seen), [0, 2])
+
+    def test_stages_overlap(self):
+        def slow(_):
+            time.sleep(0.1)
+
+        pipeline = Pipeline([PipelineStage("a", slow, AIMDController(initial=1, maximum=1)),
+                             PipelineStage("b", slow, AIMDController(initial=1, maximum=1))])
+        started = time.monotonic()
+        pipeline.run(range(4))
+
+        # Serial stages would take 0.8 seconds, a pipeline about 0.5
+        self.assertLess(time.monotonic() - started, 0.75)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+import json
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from entity import ClaudeModel, ModelProvider, ModelSettings, OpenAIModel
+from util import ProviderPool, ProviderPools, RateLimiter, TokenBudget, read_pools
+
+
+class TestUtilPool(unittest.TestCase):
+    def setUp(self):
+        self.claude = ModelSettings(provider=ModelProvider.Claude, claude_model=ClaudeModel.CLAUDE_3_7_SONNET)
+        self.openai = ModelSettings(provider=ModelProvider.OpenAI, openai_model=OpenAIModel.GPT_4O)
+
+    def test_rate_limiter(self):
+        limiter = RateLimiter(rpm=60, burst=2)
+        for _ in range(2):
+            self.assertTrue(limiter.ready())
+            limiter.acquire()
+        self.assertFalse(limiter.ready())
+        self.assertTrue(RateLimiter().ready())
+
+    def test_capacity_weighted_sharding(self):
+        fast = ProviderPool("fast", self.claude, max_concurrency=8)
+        slow = ProviderPool("slow", self.openai, max_concurrency=8)
+        fast.restart(initial=6)
+        slow.restart(initial=2)
+        pools = ProviderPools([fast, slow])
+        while pools.wants():
+            pools.put(len(pools))
+        taken = {"fast": 0, "slow": 0}
+        while (picked := pools.next()) is not None:
+            pool, _ = picked
+            pool.on_dispatch()
+            taken[pool.name] += 1
+        self.assertEqual(taken, {"fast": 6, "slow": 2})
+
+    def test_work_stealing(self):
+        fast = ProviderPool("fast", self.claude)
+        slow = ProviderPool("slow", self.openai)
+        pools = ProviderPools([fast, slow])
+        for item in range(4):
+            pools.put(item)
+
+        # The slow pool is saturated, the fast one takes its own items first and then steals from the back
+        slow.restart(initial=1, in_flight=1)
+        fast.restart(initial=4)
+        picked = []
+        while (taken := pools.next()) is not None:
+            taken[0].on_dispatch()
+            picked.append(taken[1])
+        self.assertEqual(sorted(picked), [0, 1, 2, 3])
+        self.assertEqual(fast.dispatched, 4)
+        self.assertEqual(fast.stolen, 2)
+        self.assertEqual(len(pools), 0)
+
+    def test_drain(self):
+        pools = ProviderPools([ProviderPool("a", self.claude), ProviderPool("b", self.openai)])
+        for item in range(3):
+            pools.put(item)
+        self.assertEqual(sorted(pools.drain()), [0, 1, 2])
+        self.assertIsNone(pools.next())
+
+    def test_read_pools(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = Path(folder) / "pools.json"
+            path.write_text(json.dumps([
+                {"name": "claude", "provider": "Claude", "api_key_env": "TEST_POOL_KEY", "concurrency": 4, "rpm": 30},
+                {"provider": "OpenAI", "model": "gpt-4o-mini", "api_key": "sk-test"},
+            ]))
+            with mock.patch.dict(os.environ, {"TEST_POOL_KEY": "claude-key"}):
+                pools = read_pools(self.claude, path, max_concurrency=8)
+            self.assertEqual([pool.name for pool in pools], ["claude", "OpenAI/gpt-4o-mini"])
+            self.assertEqual(pools[0].model_settings.claude_api_key, "claude-key")
+            self.assertEqual((pools[0].max_concurrency, pools[0].rpm), (4, 30))
+            self.assertEqual(pools[1].model_settings.openai_api_key, "sk-test")
+            self.assertEqual(pools[1].max_concurrency, 8)
+
+            path.write_text(json.dumps([{"provider": "Claude", "api_key_env": "TEST_POOL_MISSING"}]))
+            with self.assertRaises(ValueError):
+                read_pools(self.claude, path)
+
+    def test_budget_over_pools(self):
+        budget = TokenBudget(max_cost=1.0, model_settings=self.claude)
+        budget.spend(1_000_000, 0)
+        budget.spend(1_000_000, 0, self.openai)
+        self.assertEqual(budget.tokens, 2_000_000)
+        self.assertAlmostEqual(budget.cost, 3.0 + 2.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
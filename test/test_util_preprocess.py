@@ -0,0 +1,84 @@
+import base64
+import io
+import tempfile
+import os
+import unittest
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from unittest import mock
+
+from PIL import Image
+
+from entity import ModelProvider
+from util import ImagePreprocessor, dhash, max_edge
+from util.util_preprocess import prepare_image
+
+
+class TestUtilPreprocess(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.root = Path(self.folder.name)
+        Image.new("RGB", (320, 240), "navy").save(self.root / "small.png")
+        Image.new("RGB", (1000, 4000), "gray").save(self.root / "full_page.jpg")
+        self.preprocessor = ImagePreprocessor(max_workers=2, max_entries=2)
+
+    def tearDown(self):
+        self.preprocessor.close()
+        self.folder.cleanup()
+
+    def test_encode_unchanged(self):
+        media_type, data = self.preprocessor.encode(self.root / "small.png", edge=2048)
+        self.assertEqual(media_type, "image/png")
+        self.assertEqual(base64.b64decode(data), (self.root / "small.png").read_bytes())
+
+    def test_encode_downscaled(self):
+        prepared = self.preprocessor.get(self.root / "full_page.jpg", edge=2048)
+        self.assertEqual(prepared.media_type, "image/jpeg")
+        self.assertEqual(prepared.dimensions, (1000, 4000))
+        with Image.open(io.BytesIO(base64.b64decode(Path(prepared.payload).read_bytes()))) as img:
+            self.assertEqual(img.size, (512, 2048))
+
+    def test_cache(self):
+        future = self.preprocessor.submit(self.root / "small.png")
+        self.assertIs(self.preprocessor.submit(self.root / "small.png"), future)
+        self.assertEqual(self.preprocessor.dhash(self.root / "small.png"), dhash(self.root / "small.png"))
+
+        # The least recently used preparation is evicted with its payload
+        payload = future.result().payload
+        self.preprocessor.prefetch([self.root / "full_page.jpg"])
+        self.preprocessor.get(self.root / "full_page.jpg", edge=2048)
+        self.assertEqual(len(self.preprocessor), 2)
+        self.assertFalse(Path(payload).exists())
+
+    def test_broken_pool(self):
+        image = self.root / "small.png"
+        path = os.path.abspath(image)
+        stat = os.stat(path)
+        broken = Future()
+        broken.set_exception(BrokenProcessPool("terminated abruptly"))
+        self.preprocessor._entries[(path, stat.st_mtime_ns, stat.st_size, 2048)] = broken
+
+        self.assertEqual(self.preprocessor.dhash(image), dhash(image))
+        self.assertEqual(len(self.preprocessor), 0)
+
+    def test_in_process_unlocked(self):
+        locked = []
+
+        def _prepare(*args):
+            locked.append(self.preprocessor._lock.locked())
+            return prepare_image(*args)
+
+        self.preprocessor._submit = lambda *_: None
+        with mock.patch("util.util_preprocess.prepare_image", side_effect=_prepare):
+            media_type, _ = self.preprocessor.encode(self.root / "small.png")
+        self.assertEqual(media_type, "image/png")
+        self.assertEqual(locked, [False])
+
+    def test_max_edge(self):
+        self.assertEqual(max_edge(ModelProvider.OpenAI), 2048)
+        self.assertIsNone(max_edge(ModelProvider.SiliconFlow))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import csv
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+from util import BatchJournal, bucket_counts, build_report, report_directory, write_report
+
+
+class TestUtilReport(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.root = Path(self.folder.name)
+        (self.root / "a.png").write_bytes(b"x" * 2048)
+        (self.root / "b.png").write_bytes(b"x" * 1024)
+        self.journal = BatchJournal(self.root)
+
+    def tearDown(self):
+        self.journal.close()
+        self.folder.cleanup()
+
+    def test_bucket_counts(self):
+        self.assertEqual(bucket_counts([0.5, 1, 3, 100], (1, 5)),
+                         [{"le": 1, "count": 2}, {"le": 5, "count": 1}, {"le": None, "count": 1}])
+
+    def test_report(self):
+        job_id = self.journal.create_job("code", ["a.png", "b.png", "c.png"], {"system": "test", "provider": "Claude"})
+        self.journal.mark(job_id, "a.png", "failed", "timeout")
+        self.journal.mark(job_id, "a.png", "finished")
+        self.journal.record_usage(job_id, "a.png", 3.0, 1200, 800)
+        self.journal.mark(job_id, "b.png", "failed", "broken")
+        self.journal.record_usage(job_id, "b.png", 0.5)
+
+        report = build_report(self.journal, job_id)
+        self.assertEqual(report["provider"], "Claude")
+        self.assertEqual(len(report["prompt_hash"]), 16)
+        summary = report["summary"]
+        self.assertEqual(summary["statuses"], {"finished": 1, "failed": 1, "pending": 1})
+        self.assertEqual((summary["attempts"], summary["retried"]), (3, 1))
+        self.assertEqual((summary["latency"]["p50"], summary["latency"]["max"]), (0.5, 3.0))
+        self.assertEqual((summary["input_tokens"], summary["output_tokens"], summary["bytes"]), (1200, 800, 3072))
+        self.assertEqual(sum(bucket["count"] for bucket in report["histograms"]["latency"]), 2)
+        self.assertEqual(report["items"][1]["tokens"], None)
+
+        json_path, csv_path = write_report(report, report_directory(self.root, self.root / "reports"))
+        self.assertEqual(json_path.parent, self.root / "reports")
+        self.assertEqual(json.loads(json_path.read_text(encoding="utf-8"))["job"], job_id)
+        with open(csv_path, newline="", encoding="utf-8") as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual([row["image"] for row in rows], ["a.png", "b.png", "c.png"])
+        self.assertEqual((rows[0]["tokens"], rows[1]["error"]), ("2000", "broken"))
+
+    def test_report_per_model(self):
+        job_id = self.journal.create_job("content", ["a.png", "b.png"], {"system": "test", "provider": "Claude"})
+        self.journal.mark(job_id, "a.png", "finished")
+        self.journal.record_usage(job_id, "a.png", 1.0, 1_000_000, 0, "Claude/claude-3-7-sonnet-20250219")
+        self.journal.mark(job_id, "b.png", "finished")
+        self.journal.record_usage(job_id, "b.png", 1.0, 1_000_000, 0, "OpenAI/gpt-4o")
+
+        report = build_report(self.journal, job_id)
+        self.assertEqual(set(report["summary"]["models"]), {"Claude/claude-3-7-sonnet-20250219", "OpenAI/gpt-4o"})
+        self.assertAlmostEqual(report["summary"]["cost"], 3.0 + 2.5)
+
+        _, csv_path = write_report(report, self.root / "reports")
+        with open(csv_path, newline="", encoding="utf-8") as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual([(row["provider"], row["model"]) for row in rows],
+                         [("Claude", "claude-3-7-sonnet-20250219"), ("OpenAI", "gpt-4o")])
+
+
+if __name__ == "__main__":
+    unittest.main()
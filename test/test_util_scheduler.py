@@ -0,0 +1,57 @@
+import unittest
+
+from util import GROUPED_POLICIES, PriorityScheduler
+
+
+class TestUtilScheduler(unittest.TestCase):
+    def test_fifo_without_priorities(self):
+        scheduler = PriorityScheduler()
+        for key in "abc":
+            scheduler.put(key, key)
+        self.assertEqual([scheduler.get() for _ in range(3)], ["a", "b", "c"])
+        self.assertTrue(scheduler.empty())
+
+    def test_policy_order(self):
+        scheduler = PriorityScheduler()
+        scheduler.put("large", "large", size=300)
+        scheduler.put("small", "small", size=100)
+        scheduler.put("retry", "retry", size=200, retry=True)
+        scheduler.put("current", "current", size=400)
+        scheduler.put("pinned", "pinned", size=500)
+        scheduler.current = "current"
+        scheduler.pin("pinned")
+        self.assertEqual([scheduler.get() for _ in range(5)], ["pinned", "current", "retry", "small", "large"])
+
+    def test_reprioritize(self):
+        scheduler = PriorityScheduler(policies=("current",))
+        for key in "abc":
+            scheduler.put(key, key)
+        scheduler.current = "c"
+        scheduler.current = "b"
+        self.assertEqual(len(scheduler), 3)
+        self.assertEqual([scheduler.get() for _ in range(3)], ["b", "a", "c"])
+
+        scheduler.put("b", "b")
+        self.assertEqual(scheduler.get(), "b")
+        self.assertRaises(IndexError, scheduler.get)
+
+    def test_remove(self):
+        scheduler = PriorityScheduler()
+        scheduler.put("a", "a")
+        scheduler.put("b", "b")
+        self.assertEqual(scheduler.remove("a"), "a")
+        self.assertEqual(scheduler.get(), "b")
+        self.assertTrue(scheduler.empty())
+
+    def test_grouped(self):
+        scheduler = PriorityScheduler(GROUPED_POLICIES)
+        scheduler.put("a1", "a1", size=300, group="a.py")
+        scheduler.put("b1", "b1", size=100, group="b.py")
+        scheduler.put("none", "none", size=50)
+        scheduler.put("a2", "a2", size=200, group="a.py")
+        scheduler.put("b2", "b2", size=400, group="b.py", retry=True)
+        self.assertEqual([scheduler.get() for _ in range(5)], ["b2", "a2", "a1", "b1", "none"])
+
+
+if __name__ == "__main__":
+    unittest.main()
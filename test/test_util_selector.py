@@ -0,0 +1,86 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from util import Selector, SourceIndex, extract_selectors, precheck_selectors
+
+SOURCE = """
+<template>
+  <el-form id="login-form" class="login-form">
+    <el-input v-model="username" data-testid="username" placeholder="Username" />
+    <el-button :id="'submit-' + index" type="primary">Sign in</el-button>
+  </el-form>
+</template>
+"""
+
+
+class TestUtilSelector(unittest.TestCase):
+    def test_extract_selectors(self):
+        code = """
+        cy.get('#login-form .login-form [data-cy="username"]').type('admin')
+        cy.contains('button', 'Sign in').click()
+        await page.getByTestId('submit').click()
+        await page.locator('text=Welcome back')
+        screen.getByRole('button', { name: 'Save' })
+        driver.find_element(By.ID, "password")
+        cy.get(`#row-${index}`)
+        cy.get('@user')
+        """
+        self.assertEqual(extract_selectors(code), [
+            Selector("test_id", "username"),
+            Selector("id", "login-form"),
+            Selector("class", "login-form"),
+            Selector("text", "Sign in"),
+            Selector("test_id", "submit"),
+            Selector("text", "Welcome back"),
+            Selector("text", "Save"),
+            Selector("id", "password"),
+        ])
+
+    def test_source_index(self):
+        index = SourceIndex(SOURCE)
+        self.assertIn(Selector("id", "login-form"), index)
+        self.assertIn(Selector("test_id", "username"), index)
+        self.assertIn(Selector("text", "sign  in"), index)
+        # Built at runtime from the "submit-" prefix
+        self.assertIn(Selector("id", "submit-3"), index)
+        self.assertNotIn(Selector("id", "password"), index)
+
+    def test_precheck(self):
+        with tempfile.TemporaryDirectory() as project:
+            index = SourceIndex(SOURCE)
+            code = "cy.get('#login-form').find('.el-input__inner').type('admin')"
+            self.assertFalse(precheck_selectors(code, index, project))
+            # Missing texts and classes are left to the model
+            self.assertFalse(precheck_selectors("cy.contains('Forgot password?')", index, project))
+            self.assertTrue(precheck_selectors("cy.get('[data-testid=\"password\"]').type('secret')", index, project))
+            self.assertTrue(precheck_selectors("driver.find_element(By.ID, 'remember-me')", index, project))
+
+    def test_precheck_project(self):
+        with tempfile.TemporaryDirectory() as project:
+            root = Path(project)
+            (root / "public").mkdir()
+            (root / "public" / "index.html").write_text('<body><div id="app"></div></body>')
+            (root / "node_modules" / "ui").mkdir(parents=True)
+            (root / "node_modules" / "ui" / "index.js").write_text("el.id = 'remember-me'")
+
+            # Defined outside the source file, the block goes to the model
+            index = SourceIndex(SOURCE)
+            self.assertFalse(precheck_selectors("cy.get('#app').should('be.visible')", index, project))
+            # Dependencies are not searched
+            self.assertTrue(precheck_selectors("driver.find_element(By.ID, 'remember-me')", index, project))
+
+    def test_precheck_walks_once(self):
+        with tempfile.TemporaryDirectory() as project:
+            (Path(project) / "index.html").write_text('<div id="app"></div>')
+            index = SourceIndex(SOURCE)
+            with mock.patch("util.util_selector.os.walk", wraps=os.walk) as walk:
+                for _ in range(3):
+                    self.assertTrue(precheck_selectors("cy.get('#missing')", index, project))
+            self.assertEqual(walk.call_count, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
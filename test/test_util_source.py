@@ -0,0 +1,73 @@
+import codecs
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from entity import Detail
+from util import SourceCache, code_prompt, source_file
+
+
+class TestUtilSource(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.root = Path(self.folder.name)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_reads_once_until_changed(self):
+        cache = SourceCache()
+        source = self.root / "a.py"
+        source.write_text("print(1)\n")
+
+        self.assertEqual(cache.read(source), "print(1)\n")
+        self.assertEqual(cache.read(str(source)), "print(1)\n")
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        source.write_text("print(22)\n")
+        os.utime(source, ns=(0, 1))
+        self.assertEqual(cache.read(source), "print(22)\n")
+        self.assertEqual(cache.misses, 2)
+        self.assertIsNone(cache.read(self.root / "missing.py"))
+        self.assertEqual(cache.sha256(self.root), "")
+
+    def test_detects_encoding(self):
+        cache = SourceCache()
+        (self.root / "utf16.ts").write_text("const a = 'é';", encoding="utf-16")
+        (self.root / "bom.ts").write_bytes(codecs.BOM_UTF8 + b"const b = 1;")
+
+        self.assertEqual(cache.read(self.root / "utf16.ts"), "const a = 'é';")
+        self.assertEqual(cache.read(self.root / "bom.ts"), "const b = 1;")
+
+    def test_evicts_least_recently_used(self):
+        cache = SourceCache(max_bytes=10)
+        for name in "abc":
+            (self.root / name).write_text(name * 4)
+        cache.read(self.root / "a")
+        cache.read(self.root / "b")
+        cache.read(self.root / "a")
+        cache.read(self.root / "c")
+
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.bytes, 8)
+        cache.read(self.root / "a")
+        self.assertEqual(cache.hits, 2)
+
+    def test_code_prompt_prefix(self):
+        (self.root / "page.ts").write_text("export const page = 1;\n")
+        first = Detail(project=str(self.root), location="page.ts", content="Login form", framework="Playwright")
+        second = Detail(project=str(self.root), location="page.ts", content="Search results")
+
+        # The source file is part of the shared prefix, the fields of the image follow it
+        prefix = f"\nProject: {self.root}\nFile Location: page.ts\nSource Code:\nexport const page = 1;\n\n"
+        self.assertTrue(code_prompt(first).startswith(prefix))
+        self.assertTrue(code_prompt(second).startswith(prefix))
+        self.assertTrue(code_prompt(first).endswith("Image Content: Login form"))
+        self.assertEqual(source_file(first), self.root / "page.ts")
+        self.assertIsNone(source_file(first, upload_code=False))
+        self.assertNotIn("Source Code", code_prompt(first, upload_code=False))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,8 +1,24 @@
-from .util_ai import chat
+from .util_ai import chat, classify_error, last_usage, model_name, model_tag
+from .util_batch import sidecar_path, load_detail, save_result, apply_result, copy_result, save_verdicts, estimated_size
 from .util_code import extract_code_blocks, extract_code_from_files
+from .util_cluster import MAX_GROUP, GROUP_SEPARATOR, cluster_images, group_images, group_key, histogram
 from .util_common import encrypt, decrypt
-from .util_hallucination import hallucination
+from .util_concurrency import AIMDController, interactive
+from .util_cost import TokenBudget, estimate_batch, estimate_item, format_estimate, image_tokens, text_tokens
+from .util_dedup import DuplicateIndex, DuplicateMode, dhash, hamming
+from .util_hallucination import hallucination, parse_verdicts
 from .util_image import analyze_image_file, encode_image
+from .util_journal import MAX_ATTEMPTS, BatchJournal, worker_id
+from .util_manifest import Manifest, input_hashes
+from .util_metrics import BatchMetrics, format_duration
+from .util_pipeline import Pipeline, PipelineStage
+from .util_pool import ProviderPool, ProviderPools, RateLimiter, read_pools
+from .util_preprocess import ImagePreprocessor, PreparedImage, image_preprocessor, max_edge
+from .util_prompt import system_prompt, code_prompt, source_file
+from .util_report import build_report, bucket_counts, report_directory, save_report, write_report
+from .util_selector import Selector, SourceIndex, extract_selectors, precheck_selectors
+from .util_scheduler import PriorityScheduler, GROUPED_POLICIES
+from .util_source import SourceCache, read_source, source_cache
 from .util_qt import block_signals, sync_settings, read_settings, write_settings, read_model_settings, \
     write_model_settings
 
@@ -16,6 +32,95 @@ __all__ = [
 
     # util_ai
     'chat',
+    'classify_error',
+    'last_usage',
+    'model_name',
+    'model_tag',
+
+    # util_batch
+    'sidecar_path',
+    'load_detail',
+    'save_result',
+    'apply_result',
+    'copy_result',
+    'save_verdicts',
+    'estimated_size',
+
+    # util_cluster
+    'MAX_GROUP',
+    'GROUP_SEPARATOR',
+    'cluster_images',
+    'group_images',
+    'group_key',
+    'histogram',
+
+    # util_concurrency
+    'AIMDController',
+    'interactive',
+
+    # util_cost
+    'TokenBudget',
+    'estimate_batch',
+    'estimate_item',
+    'format_estimate',
+    'image_tokens',
+    'text_tokens',
+
+    # util_dedup
+    'DuplicateIndex',
+    'DuplicateMode',
+    'dhash',
+    'hamming',
+
+    # util_journal
+    'MAX_ATTEMPTS',
+    'BatchJournal',
+    'worker_id',
+
+    # util_manifest
+    'Manifest',
+    'input_hashes',
+
+    # util_metrics
+    'BatchMetrics',
+    'format_duration',
+
+    # util_pipeline
+    'Pipeline',
+    'PipelineStage',
+
+    # util_pool
+    'ProviderPool',
+    'ProviderPools',
+    'RateLimiter',
+    'read_pools',
+
+    # util_preprocess
+    'ImagePreprocessor',
+    'PreparedImage',
+    'image_preprocessor',
+    'max_edge',
+
+    # util_prompt
+    'system_prompt',
+    'code_prompt',
+    'source_file',
+
+    # util_report
+    'build_report',
+    'bucket_counts',
+    'report_directory',
+    'save_report',
+    'write_report',
+
+    # util_scheduler
+    'PriorityScheduler',
+    'GROUPED_POLICIES',
+
+    # util_source
+    'SourceCache',
+    'read_source',
+    'source_cache',
 
     # util_code
     'extract_code_blocks',
@@ -31,4 +136,11 @@ __all__ = [
 
     # util_hallucination
     'hallucination',
+    'parse_verdicts',
+
+    # util_selector
+    'Selector',
+    'SourceIndex',
+    'extract_selectors',
+    'precheck_selectors',
 ]
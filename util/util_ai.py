@@ -1,22 +1,44 @@
+import threading
 from concurrent.futures import ThreadPoolExecutor
-from typing import Any, Dict, List, Union, Optional
+from enum import Enum
+from typing import Any, Dict, List, Tuple, Union, Optional
 
+import anthropic
+import openai
 from anthropic import Anthropic
 from loguru import logger
 from openai import OpenAI
 
-from entity import ModelProvider, MAX_TOKEN_MAP
-from .util_image import encode_image, media_type
+from entity import ModelProvider, ModelSettings, MAX_TOKEN_MAP
+from .util_preprocess import image_preprocessor, max_edge
 from .util_qt import read_model_settings
 
 __DEFAULT_MAX_TOKENS = 8 * 1024
 
+# Token usage of the last chat, per thread
+_usage = threading.local()
+
+
+def last_usage() -> Tuple[int, int]:
+    """
+    Get the token usage of the last chat on the calling thread
+
+    Returns:
+        The input tokens and the output tokens, zeros if the provider did not report them
+    """
+    return getattr(_usage, "value", (0, 0))
+
+
+def _record_usage(input_tokens: Optional[int], output_tokens: Optional[int]) -> None:
+    _usage.value = (input_tokens or 0, output_tokens or 0)
+
 
 def chat(*,
          system: Optional[str] = None,
          text: Optional[Union[str, List[str]]] = None,
          image_url: Optional[Union[str, List[str]]] = None,
-         timeout: int = 120) -> str:
+         timeout: int = 120,
+         model_settings: Optional[ModelSettings] = None) -> str:
     """
     Generate chat from text and image
 
@@ -25,17 +47,19 @@ def chat(*,
         text: chat text
         image_url: chat image url (file url or http url)
         timeout: timeout in seconds
+        model_settings: model settings to use instead of the saved ones
 
     Returns:
         chat response
     """
-    try:
-        model_settings = read_model_settings()
-    except Exception as e:
-        logger.error(f"Error loading model settings: {e}")
-        raise ValueError(f"Error loading model settings: {e}") from e
+    if model_settings is None:
+        try:
+            model_settings = read_model_settings()
+        except Exception as e:
+            logger.error(f"Error loading model settings: {e}")
+            raise ValueError(f"Error loading model settings: {e}") from e
 
-    def _task() -> str:
+    def _chat() -> str:
         match model_settings.provider:
             case ModelProvider.OpenAI:
                 return chat_openai(system,
@@ -67,15 +91,60 @@ def chat(*,
             case _:
                 raise ValueError(f"Unsupported provider: {model_settings.provider}")
 
+    def _task() -> Tuple[str, Tuple[int, int]]:
+        _record_usage(0, 0)
+        return _chat(), last_usage()
+
     with ThreadPoolExecutor(max_workers=1) as executor:
         future = executor.submit(_task)
         try:
-            return future.result(timeout=timeout)
+            result, usage = future.result(timeout=timeout)
+            _usage.value = usage
+            return result
         except TimeoutError:
             future.cancel()
             raise TimeoutError(f"Chat request timed out after {timeout} seconds")
 
 
+def model_name(model_settings: ModelSettings) -> str:
+    """
+    Get the name of the model selected for the active provider
+
+    Args:
+        model_settings: The model settings
+    """
+    model = getattr(model_settings, f"{model_settings.provider.value.lower()}_model")
+    return model.value if isinstance(model, Enum) else str(model)
+
+
+def model_tag(model_settings: ModelSettings) -> str:
+    """
+    Get the provider and model that results are tagged with, e.g. ``Claude/claude-3-7-sonnet-20250219``
+
+    Args:
+        model_settings: The model settings
+    """
+    return f"{model_settings.provider.value}/{model_name(model_settings)}"
+
+
+def classify_error(error: Exception) -> str:
+    """
+    Classify a chat error for concurrency control
+
+    Args:
+        error: The exception raised by chat
+
+    Returns:
+        "rate_limit", "timeout" or "error"
+    """
+    if isinstance(error, (openai.RateLimitError, anthropic.RateLimitError)) or \
+            getattr(error, "status_code", None) == 429:
+        return "rate_limit"
+    if isinstance(error, (TimeoutError, openai.APITimeoutError, anthropic.APITimeoutError)):
+        return "timeout"
+    return "error"
+
+
 def __build_message(system: Optional[str],
                     text: Union[str, List[str], None],
                     image_url: Union[str, List[str], None],
@@ -127,75 +196,37 @@ def __build_message(system: Optional[str],
         if not _image_url:
             return []
 
-        if isinstance(_image_url, str):
-            match provider:
-                case ModelProvider.OpenAI:
-                    return [
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:{media_type(_image_url)};base64,{encode_image(_image_url)}"
-                            }
-                        }
-                    ]
-                case ModelProvider.Claude:
-                    return [
-                        {
-                            "type": "image",
-                            "source": {
-                                "type": "base64",
-                                "media_type": media_type(_image_url),
-                                "data": encode_image(_image_url)
-                            }
-                        }
-                    ]
-                case ModelProvider.SiliconFlow:
-                    return [
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:{media_type(_image_url)};base64,{encode_image(_image_url)}"
-                            }
-                        }
-                    ]
-                case _:
-                    raise ValueError(f"Unsupported provider: {provider}")
-        elif isinstance(_image_url, List):
+        urls = [_image_url] if isinstance(_image_url, str) else list(_image_url)
+        edge = max_edge(provider)
+        # Prepare all images at once in the preprocessing pool
+        image_preprocessor.prefetch(urls, edge)
+        images = []
+        for url in urls:
+            _type, data = image_preprocessor.encode(url, edge)
             match provider:
-                case ModelProvider.OpenAI:
-                    return [
+                case ModelProvider.OpenAI | ModelProvider.SiliconFlow:
+                    images.append(
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:{media_type(url)};base64,{encode_image(url)}"
+                                "url": f"data:{_type};base64,{data}"
                             }
                         }
-                        for url in _image_url
-                    ]
+                    )
                 case ModelProvider.Claude:
-                    return [
+                    images.append(
                         {
                             "type": "image",
                             "source": {
                                 "type": "base64",
-                                "media_type": media_type(url),
-                                "data": encode_image(url)
+                                "media_type": _type,
+                                "data": data
                             }
                         }
-                        for url in _image_url
-                    ]
-                case ModelProvider.SiliconFlow:
-                    return [
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:{media_type(url)};base64,{encode_image(url)}"
-                            }
-                        }
-                        for url in _image_url
-                    ]
+                    )
                 case _:
                     raise ValueError(f"Unsupported provider: {provider}")
+        return images
 
     if system:
         wrapper = [
@@ -244,6 +275,8 @@ def chat_openai(system: Optional[str],
         temperature=temperature,
     )
 
+    if usage := chat_completion.usage:
+        _record_usage(usage.prompt_tokens, usage.completion_tokens)
     return chat_completion.choices[0].message.content
 
 
@@ -268,6 +301,8 @@ def chat_claude(system: Optional[str],
         temperature=temperature,
     )
 
+    if usage := chat_completion.usage:
+        _record_usage(usage.input_tokens, usage.output_tokens)
     return chat_completion.content[0].text
 
 
@@ -287,9 +322,11 @@ def chat_siliconflow(system: Optional[str],
 
     chat_completion = client.chat.completions.create(
         max_tokens=max_tokens // 4 * 2,
-        messages=__build_message(system, text, image_url, provider=ModelProvider.OpenAI),
+        messages=__build_message(system, text, image_url, provider=ModelProvider.SiliconFlow),
         model=model,
         temperature=temperature,
     )
 
+    if usage := chat_completion.usage:
+        _record_usage(usage.prompt_tokens, usage.completion_tokens)
     return chat_completion.choices[0].message.content
@@ -0,0 +1,153 @@
+import os
+from pathlib import Path
+from typing import List, Literal, Optional
+
+from entity import CodeBlock, Detail
+from .util_code import extract_code_blocks
+
+BatchKind = Literal["content", "code"]
+
+
+def sidecar_path(image: str | os.PathLike) -> Path:
+    """
+    Get the path of the json sidecar of an image
+
+    Args:
+        image: The path to the image file.
+
+    Returns:
+        The path to the sidecar, e.g. ``page.png.json`` for ``page.png``
+    """
+    image = Path(image)
+    return image.with_suffix(image.suffix + ".json")
+
+
+def load_detail(image: str | os.PathLike) -> Detail:
+    """
+    Load the detail of an image, or an empty detail if the sidecar does not exist yet
+
+    Args:
+        image: The path to the image file.
+    """
+    json_path = sidecar_path(image)
+    if json_path.exists():
+        return Detail.load(str(json_path))
+    return Detail()
+
+
+def save_result(kind: BatchKind, image: str | os.PathLike, result: str, model: Optional[str] = None) -> Detail:
+    """
+    Write a single batch result into the sidecar of its image
+
+    The sidecar is re-read right before writing, so fields edited since the batch started are kept,
+    and the write itself is atomic.
+
+    Args:
+        kind: "content" or "code"
+        image: The path to the image file.
+        result: The chat response
+        model: The provider and model that generated the result, see ``model_tag``
+
+    Returns:
+        The saved detail
+    """
+    detail = apply_result(kind, load_detail(image), result, model)
+    detail.save(str(sidecar_path(image)))
+    return detail
+
+
+def apply_result(kind: BatchKind, detail: Detail, result: str, model: Optional[str] = None) -> Detail:
+    """
+    Put a batch result into a detail without saving it
+
+    Args:
+        kind: "content" or "code"
+        detail: The detail of the image
+        result: The chat response
+        model: The provider and model that generated the result, see ``model_tag``
+
+    Returns:
+        The updated detail
+    """
+    match kind:
+        case "content":
+            detail.content = result
+        case "code":
+            detail.code = extract_code_blocks(result)
+        case _:
+            raise ValueError(f"Invalid batch kind: {kind}")
+    if model:
+        detail.models[kind] = model
+    return detail
+
+
+def copy_result(kind: BatchKind, source: str | os.PathLike, image: str | os.PathLike) -> Detail:
+    """
+    Copy a batch result from the sidecar of another image, e.g. a near-duplicate screenshot
+
+    Args:
+        kind: "content" or "code"
+        source: The path to the image file to copy from.
+        image: The path to the image file to copy to.
+
+    Returns:
+        The saved detail
+    """
+    origin = load_detail(source)
+    detail = load_detail(image)
+    match kind:
+        case "content":
+            detail.content = origin.content
+        case "code":
+            detail.code = origin.code
+        case _:
+            raise ValueError(f"Invalid batch kind: {kind}")
+    if kind in origin.models:
+        detail.models[kind] = origin.models[kind]
+    detail.save(str(sidecar_path(image)))
+    return detail
+
+
+def save_verdicts(image: str | os.PathLike, checked: List[CodeBlock], verdicts: List[Optional[bool]]) -> Detail:
+    """
+    Write the hallucination verdicts of the code blocks of an image into its sidecar
+
+    The sidecar is re-read right before writing, a verdict is only kept for a block whose code is still the one that
+    was checked.
+
+    Args:
+        image: The path to the image file.
+        checked: The code blocks that were checked
+        verdicts: The verdict of every checked code block
+
+    Returns:
+        The saved detail
+    """
+    detail = load_detail(image)
+    for block, checked_block, verdict in zip(detail.code, checked, verdicts):
+        if (block.language, block.code) == (checked_block.language, checked_block.code):
+            block.hallucination = verdict
+    detail.save(str(sidecar_path(image)))
+    return detail
+
+
+def estimated_size(kind: str, image: str | os.PathLike, detail: Detail = None, *, source: bool = True) -> int:
+    """
+    Estimate the size of a batch request in bytes, for scheduling the smaller ones first
+
+    Args:
+        kind: The kind of the batch
+        image: The path to the image file.
+        detail: The detail of the image, loaded from the sidecar if not given
+        source: Whether to add the size of the source file for code generation, which needs the detail
+
+    Returns:
+        The size of the image, plus the size of the source file for code generation
+    """
+    image = Path(image)
+    size = image.stat().st_size if image.exists() else 0
+    if kind == "code" and source:
+        detail = detail or load_detail(image)
+        if detail.project and detail.location and (source := Path(detail.project) / detail.location).is_file():
+            size += source.stat().st_size
+    return size
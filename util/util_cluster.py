@@ -0,0 +1,148 @@
+import os
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+from PIL import Image
+
+from .util_batch import load_detail
+from .util_dedup import dhash
+
+# Most screenshots sent along in a single related request
+MAX_GROUP = 5
+
+# Joins the image names of a group into one journal item, file names never contain it
+GROUP_SEPARATOR = "/"
+
+# Bins per RGB channel of the color histogram
+_BINS = 8
+
+
+def histogram(image: str | os.PathLike) -> np.ndarray:
+    """
+    Compute the normalized color histogram of an image, which matches pages sharing a theme and layout even when their
+    contents have moved
+
+    Args:
+        image: The path to the image file.
+
+    Returns:
+        The concatenated per-channel histograms of a 64x64 thumbnail, each summing to one
+    """
+    with Image.open(image) as img:
+        pixels = np.asarray(img.convert("RGB").resize((64, 64), Image.Resampling.BILINEAR))
+    bins = (pixels // (256 // _BINS)).reshape(-1, 3)
+    counts = np.stack([np.bincount(bins[:, channel], minlength=_BINS) for channel in range(3)])
+    return (counts / counts.sum(axis=1, keepdims=True)).astype(np.float32).ravel()
+
+
+def similarity(bits: np.ndarray, histograms: np.ndarray, index: int) -> np.ndarray:
+    """
+    Compute the visual similarity of one image to all images at once
+
+    Args:
+        bits: The unpacked 64-bit difference hashes, one row per image
+        histograms: The color histograms, one row per image
+        index: The row of the image to compare
+
+    Returns:
+        The similarities between 0 and 1, the mean of the matching hash bits and the histogram intersection
+    """
+    hash_similarity = 1 - np.count_nonzero(bits != bits[index], axis=1) / bits.shape[1]
+    histogram_similarity = np.minimum(histograms, histograms[index]).sum(axis=1) / 3
+    return (hash_similarity + histogram_similarity) / 2
+
+
+def group_key(group: Iterable[str]) -> str:
+    """
+    Join the image names of a group into the item of a related batch in the journal
+
+    Args:
+        group: The image names of the group, the first one is the image whose detail is sent along
+
+    Returns:
+        The journal item of the group
+    """
+    return GROUP_SEPARATOR.join(group)
+
+
+def group_images(key: str) -> List[str]:
+    """
+    Split the journal item of a group back into its image names, see ``group_key``
+
+    Args:
+        key: The journal item, a single image name is a group of one
+
+    Returns:
+        The image names of the group
+    """
+    return key.split(GROUP_SEPARATOR)
+
+
+def cluster_images(folder: str | os.PathLike,
+                   images: Iterable[str],
+                   *,
+                   max_group: int = MAX_GROUP,
+                   min_similarity: float = 0.8,
+                   min_location_similarity: float = 0.5,
+                   progress: Optional[Callable[[int, int], None]] = None) -> List[List[str]]:
+    """
+    Group related screenshots for a related request.
+
+    Screenshots of the same ``Detail.location`` are grouped at a low visual similarity, screenshots of different
+    locations never, and screenshots without a location only when they look alike. Groups grow greedily around the
+    first ungrouped screenshot by name with its most similar neighbours.
+
+    Args:
+        folder: The image folder
+        images: Image names relative to the folder
+        max_group: The most screenshots in a group
+        min_similarity: The least visual similarity of screenshots to group without a shared location
+        min_location_similarity: The least visual similarity of screenshots of the same location to group
+        progress: Called with the number of images analyzed so far and the total
+
+    Returns:
+        The groups of at least two image names, in the order of their first image
+    """
+    folder = Path(folder)
+    names = sorted(images)
+    if len(names) < 2:
+        return []
+
+    locations: List[Optional[str]] = []
+    hashes: List[int] = []
+    histograms: List[np.ndarray] = []
+    for count, name in enumerate(names, start=1):
+        locations.append(load_detail(folder / name).location or None)
+        hashes.append(dhash(folder / name))
+        histograms.append(histogram(folder / name))
+        if progress:
+            progress(count, len(names))
+
+    bits = np.unpackbits(np.array(hashes, dtype=">u8").view(np.uint8).reshape(len(names), 8), axis=1)
+    histogram_matrix = np.stack(histograms)
+    location_ids: Dict[Optional[str], int] = {None: -1}
+    location_array = np.array([location_ids.setdefault(location, len(location_ids)) for location in locations])
+
+    grouped = np.zeros(len(names), dtype=bool)
+    groups: List[List[str]] = []
+    for seed in range(len(names)):
+        if grouped[seed]:
+            continue
+        grouped[seed] = True
+        scores = similarity(bits, histogram_matrix, seed)
+        if location_array[seed] >= 0:
+            same_location = location_array == location_array[seed]
+            threshold = np.where(same_location, min_location_similarity, min_similarity)
+            eligible = ~grouped & (same_location | (location_array < 0)) & (scores >= threshold)
+        else:
+            eligible = ~grouped & (location_array < 0) & (scores >= min_similarity)
+
+        # Prefer the same location, then the most similar
+        candidates = np.flatnonzero(eligible)
+        order = np.lexsort((-scores[candidates], location_array[candidates] != location_array[seed]))
+        members = candidates[order][:max_group - 1]
+        if len(members):
+            grouped[members] = True
+            groups.append([names[seed], *(names[member] for member in sorted(members))])
+    return groups
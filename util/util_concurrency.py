@@ -0,0 +1,181 @@
+import time
+from collections import deque
+from contextlib import contextmanager
+from threading import Lock
+from typing import Deque, Iterator, Literal, Optional
+
+ErrorKind = Literal["rate_limit", "timeout", "error"]
+
+_interactive_lock = Lock()
+_interactive = 0
+
+
+@contextmanager
+def interactive() -> Iterator[None]:
+    """
+    Mark an interactive request while it runs, batch controllers hold back one slot for each of them so that the user
+    never waits behind queued batch work
+
+    Only controllers of the same process see the mark, i.e. the batch dialogs running next to the main window. Headless
+    batches run in processes of their own.
+    """
+    global _interactive
+    with _interactive_lock:
+        _interactive += 1
+    try:
+        yield
+    finally:
+        with _interactive_lock:
+            _interactive -= 1
+
+
+def interactive_requests() -> int:
+    """Number of running interactive requests"""
+    return _interactive
+
+
+class AIMDController:
+    """
+    Additive-increase / multiplicative-decrease concurrency controller.
+
+    The limit grows by ``increase`` once every ``limit`` healthy completions (roughly once per round trip) and is
+    multiplied by ``decrease`` on rate limits, timeouts or a high error rate. Decreases are rate-limited by
+    ``cooldown`` so that a burst of 429s from the same window only backs off once.
+    """
+
+    def __init__(self, *,
+                 initial: int = 2,
+                 minimum: int = 1,
+                 maximum: int = 16,
+                 increase: int = 1,
+                 decrease: float = 0.5,
+                 cooldown: float = 10.0,
+                 latency_tolerance: float = 2.0,
+                 error_threshold: float = 0.2,
+                 window: float = 60.0):
+        """
+        Args:
+            initial: Initial concurrency limit
+            minimum: Lower bound of the limit
+            maximum: Upper bound of the limit
+            increase: Additive increase step
+            decrease: Multiplicative decrease factor
+            cooldown: Minimum seconds between two decreases
+            latency_tolerance: A request slower than ``latency_tolerance`` times the best average latency is unhealthy
+            error_threshold: Error rate within the window above which the limit is decreased
+            window: Length of the sliding window in seconds for throughput and error rate
+        """
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.latency_tolerance = latency_tolerance
+        self.error_threshold = error_threshold
+        self.window = window
+
+        self._lock = Lock()
+        self._limit = float(min(max(initial, self.minimum), self.maximum))
+        self._in_flight = 0
+        self._healthy_streak = 0
+        self._last_decrease = float("-inf")
+        self._latency_ewma: Optional[float] = None
+        self._latency_floor: Optional[float] = None
+        self._events: Deque[tuple[float, bool]] = deque()
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def latency(self) -> Optional[float]:
+        """Exponentially weighted average latency in seconds"""
+        return self._latency_ewma
+
+    def can_dispatch(self) -> bool:
+        """Check if another request may be started, running interactive requests take precedence"""
+        with self._lock:
+            return self._in_flight + interactive_requests() < int(self._limit)
+
+    def on_dispatch(self) -> None:
+        """Record that a request has been started"""
+        with self._lock:
+            self._in_flight += 1
+
+    def on_success(self, latency: float) -> None:
+        """
+        Record a successful request
+
+        Args:
+            latency: Request latency in seconds
+        """
+        with self._lock:
+            self._in_flight = max(0, self._in_flight - 1)
+            self._record(True)
+
+            self._latency_ewma = latency if self._latency_ewma is None else 0.8 * self._latency_ewma + 0.2 * latency
+            if self._latency_floor is None or self._latency_ewma < self._latency_floor:
+                self._latency_floor = self._latency_ewma
+
+            if latency > self.latency_tolerance * self._latency_floor:
+                # Provider is slowing down, hold the limit
+                self._healthy_streak = 0
+                return
+
+            self._healthy_streak += 1
+            if self._healthy_streak >= int(self._limit) and self._error_rate() <= self.error_threshold:
+                self._healthy_streak = 0
+                self._limit = min(self.maximum, self._limit + self.increase)
+
+    def on_failure(self, kind: ErrorKind = "error") -> None:
+        """
+        Record a failed request
+
+        Args:
+            kind: The kind of the failure
+        """
+        with self._lock:
+            self._in_flight = max(0, self._in_flight - 1)
+            self._record(False)
+            self._healthy_streak = 0
+
+            if kind in ("rate_limit", "timeout") or self._error_rate() > self.error_threshold:
+                self._back_off()
+
+    def on_cancel(self) -> None:
+        """Record that a started request has been canceled"""
+        with self._lock:
+            self._in_flight = max(0, self._in_flight - 1)
+
+    def throughput(self) -> float:
+        """Completed requests per minute within the sliding window"""
+        with self._lock:
+            self._expire(time.monotonic())
+            if not self._events:
+                return 0.0
+            return len(self._events) * 60.0 / self.window
+
+    def _back_off(self) -> None:
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        self._limit = max(self.minimum, self._limit * self.decrease)
+
+    def _record(self, succeed: bool) -> None:
+        now = time.monotonic()
+        self._events.append((now, succeed))
+        self._expire(now)
+
+    def _expire(self, now: float) -> None:
+        while self._events and now - self._events[0][0] > self.window:
+            self._events.popleft()
+
+    def _error_rate(self) -> float:
+        if len(self._events) < 5:
+            return 0.0
+        return sum(1 for _, succeed in self._events if not succeed) / len(self._events)
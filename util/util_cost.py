@@ -0,0 +1,259 @@
+import math
+import os
+from pathlib import Path
+from threading import Lock
+from typing import Dict, Iterable, Literal, Optional, Tuple
+
+from entity import ModelProvider, ModelSettings, PRICE_MAP
+from .util_ai import model_name
+from .util_batch import load_detail
+from .util_image import analyze_image_file
+from .util_metrics import format_duration
+from .util_prompt import code_prompt
+
+CostKind = Literal["content", "code"]
+
+# Output tokens per item assumed when no batch of the kind has recorded its usage yet
+DEFAULT_OUTPUT_TOKENS: Dict[CostKind, int] = {"content": 500, "code": 2000}
+
+# Base and per-tile tokens of an image in high detail, by OpenAI model
+_OPENAI_TILE_TOKENS: Dict[str, Tuple[int, int]] = {
+    "gpt-4o-mini": (2833, 5667),
+    "o1": (75, 150),
+}
+
+
+def text_tokens(text: Optional[str]) -> int:
+    """
+    Estimate the tokens of a text without a tokenizer: about four ASCII characters per token, and one token per other
+    character, e.g. CJK
+
+    Args:
+        text: The text
+
+    Returns:
+        The estimated number of tokens
+    """
+    if not text:
+        return 0
+    ascii_chars = sum(1 for char in text if char.isascii())
+    return math.ceil(ascii_chars / 4) + len(text) - ascii_chars
+
+
+def image_tokens(dimensions: Tuple[int, int], model_settings: ModelSettings) -> int:
+    """
+    Estimate the input tokens of an image the way the provider resizes and tiles it
+
+    Args:
+        dimensions: The width and height of the image
+        model_settings: The model settings
+
+    Returns:
+        The estimated number of tokens
+    """
+    width, height = dimensions
+    if width <= 0 or height <= 0:
+        return 0
+    match model_settings.provider:
+        case ModelProvider.OpenAI:
+            # Fit into 2048x2048, then scale the shortest side down to 768, and count 512px tiles
+            scale = min(1.0, 2048 / max(width, height))
+            scale = min(scale, 768 / (min(width, height) * scale)) if min(width, height) * scale > 768 else scale
+            tiles = math.ceil(width * scale / 512) * math.ceil(height * scale / 512)
+            base, per_tile = _OPENAI_TILE_TOKENS.get(model_name(model_settings), (85, 170))
+            return base + per_tile * tiles
+        case ModelProvider.Claude:
+            # Fit the long edge into 1568px and the area into about 1.15 megapixels, one token per 750 pixels
+            scale = min(1.0, 1568 / max(width, height), math.sqrt(1_150_000 / (width * height)))
+            return math.ceil(width * scale * height * scale / 750)
+        case _:
+            # Vision transformers with 28px patches and a cap of 1280 patches, e.g. Qwen-VL
+            return min(1280, math.ceil(width / 28) * math.ceil(height / 28))
+
+
+def price(model_settings: ModelSettings) -> Optional[Tuple[float, float]]:
+    """
+    Get the price of the selected model in USD per million input and output tokens, None if unknown
+    """
+    return PRICE_MAP.get(model_name(model_settings))
+
+
+def cost(input_tokens: float, output_tokens: float, model_settings: ModelSettings) -> Optional[float]:
+    """
+    Compute the cost of tokens in USD, None if the price of the model is unknown
+    """
+    if not (prices := price(model_settings)):
+        return None
+    return (input_tokens * prices[0] + output_tokens * prices[1]) / 1_000_000
+
+
+def estimate_item(kind: CostKind,
+                  image: str | os.PathLike,
+                  *,
+                  system: str,
+                  model_settings: ModelSettings,
+                  upload_code: bool = True) -> Dict[str, int]:
+    """
+    Estimate the input tokens of a single batch request without sending it
+
+    Args:
+        kind: "content" or "code"
+        image: The path to the image file.
+        system: The system prompt
+        model_settings: The model settings
+        upload_code: Whether the source code is part of the code prompt
+
+    Returns:
+        The text_tokens of the system prompt and the prompt, and the image_tokens
+    """
+    text = code_prompt(load_detail(image), upload_code) if kind == "code" else ""
+    dimensions = analyze_image_file(image).dimensions
+    return {
+        "text_tokens": text_tokens(system) + text_tokens(text),
+        "image_tokens": image_tokens(dimensions, model_settings) if dimensions else 0,
+    }
+
+
+def estimate_batch(kind: CostKind,
+                   folder: str | os.PathLike,
+                   images: Iterable[str],
+                   *,
+                   system: str,
+                   model_settings: ModelSettings,
+                   upload_code: bool = True,
+                   history: Optional[Dict[str, float]] = None) -> Dict[str, Optional[float]]:
+    """
+    Estimate the tokens, cost and duration of a batch without sending anything
+
+    Args:
+        kind: "content" or "code"
+        folder: The image folder
+        images: Image names relative to the folder
+        system: The system prompt
+        model_settings: The model settings
+        upload_code: Whether the source code is part of the code prompt
+        history: The recorded usage of earlier batches of the kind, see ``BatchJournal.history``
+
+    Returns:
+        items, input_tokens, output_tokens, cost in USD and duration in seconds, the last two None if unknown
+    """
+    history = history or {}
+    items = input_tokens = 0
+    for name in images:
+        estimate = estimate_item(kind, Path(folder) / name, system=system, model_settings=model_settings,
+                                 upload_code=upload_code)
+        items += 1
+        input_tokens += estimate["text_tokens"] + estimate["image_tokens"]
+
+    output_tokens = items * (history.get("output_tokens") or DEFAULT_OUTPUT_TOKENS[kind])
+    items_per_minute = history.get("items_per_minute")
+    return {
+        "items": items,
+        "input_tokens": input_tokens,
+        "output_tokens": round(output_tokens),
+        "cost": cost(input_tokens, output_tokens, model_settings),
+        "duration": items / items_per_minute * 60 if items_per_minute else None,
+    }
+
+
+def format_estimate(estimate: Dict[str, Optional[float]]) -> str:
+    """
+    Format a batch estimate as a single line
+    """
+    cost_text = f"${estimate['cost']:.2f}" if estimate["cost"] is not None else "unknown cost"
+    return (f"{estimate['items']} images | {estimate['input_tokens'] / 1000:.1f}k input + "
+            f"{estimate['output_tokens'] / 1000:.1f}k output tokens | {cost_text} | "
+            f"about {format_duration(estimate['duration'])}")
+
+
+class TokenBudget:
+    """
+    Hard cap on the tokens or the cost of a batch, the batch stops scheduling new items once it is exhausted
+    """
+
+    def __init__(self,
+                 max_tokens: Optional[int] = None,
+                 max_cost: Optional[float] = None,
+                 model_settings: Optional[ModelSettings] = None):
+        """
+        Args:
+            max_tokens: The maximum input plus output tokens, unlimited if None
+            max_cost: The maximum cost in USD, unlimited if None
+            model_settings: The model settings to price the tokens with
+
+        Raises:
+            ValueError: If a cost cap is given but the price of the model is unknown
+        """
+        if max_cost is not None and (model_settings is None or price(model_settings) is None):
+            raise ValueError("The price of the model is unknown, use a token budget instead")
+        self.max_tokens = max_tokens
+        self.max_cost = max_cost
+        self.model_settings = model_settings
+        self._lock = Lock()
+        self._input_tokens = 0
+        self._output_tokens = 0
+        # Spent with the models used before the current one
+        self._spent_tokens = 0
+        self._spent_cost = 0.0
+
+    def switch_model(self, model_settings: ModelSettings) -> None:
+        """
+        Price the tokens spent from now on with another model, e.g. after a batch is resumed with other settings, the
+        cost spent so far is kept
+
+        Raises:
+            ValueError: If a cost cap is set but the price of the model is unknown
+        """
+        if self.max_cost is not None and price(model_settings) is None:
+            raise ValueError("The price of the model is unknown, use a token budget instead")
+        with self._lock:
+            if self.model_settings is not None:
+                self._spent_cost += cost(self._input_tokens, self._output_tokens, self.model_settings) or 0.0
+            self._spent_tokens += self._input_tokens + self._output_tokens
+            self._input_tokens = self._output_tokens = 0
+            self.model_settings = model_settings
+
+    def spend(self, input_tokens: int, output_tokens: int, model_settings: Optional[ModelSettings] = None) -> None:
+        """
+        Record the tokens used by a request
+
+        Args:
+            input_tokens: The input tokens
+            output_tokens: The output tokens
+            model_settings: The model the request was sent to if not the one of the budget, e.g. of another provider
+                pool
+        """
+        with self._lock:
+            if model_settings is None or model_settings == self.model_settings:
+                self._input_tokens += input_tokens
+                self._output_tokens += output_tokens
+            else:
+                self._spent_cost += cost(input_tokens, output_tokens, model_settings) or 0.0
+                self._spent_tokens += input_tokens + output_tokens
+
+    @property
+    def tokens(self) -> int:
+        return self._spent_tokens + self._input_tokens + self._output_tokens
+
+    @property
+    def cost(self) -> Optional[float]:
+        if self.model_settings is None:
+            return None
+        current = cost(self._input_tokens, self._output_tokens, self.model_settings)
+        return self._spent_cost + current if current is not None else None
+
+    @property
+    def exhausted(self) -> bool:
+        if self.max_tokens is not None and self.tokens >= self.max_tokens:
+            return True
+        return self.max_cost is not None and self.cost >= self.max_cost
+
+    def summary(self) -> str:
+        """
+        Format the spending against the caps
+        """
+        spent = [f"{self.tokens / 1000:.1f}k" + (f"/{self.max_tokens / 1000:.1f}k" if self.max_tokens else "")
+                 + " tokens"]
+        if (spent_cost := self.cost) is not None:
+            spent.append(f"${spent_cost:.2f}" + (f"/${self.max_cost:.2f}" if self.max_cost is not None else ""))
+        return ", ".join(spent)
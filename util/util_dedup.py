@@ -0,0 +1,194 @@
+import os
+from pathlib import Path
+from threading import Lock
+from typing import Callable, Dict, Iterable, List, Literal, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from .util_journal import connect
+
+DuplicateMode = Literal["process", "reuse", "skip"]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS image_hash
+(
+    image TEXT PRIMARY KEY,
+    hash  INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    size  INTEGER NOT NULL
+);
+"""
+
+# Number of set bits of every byte value
+_POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+
+def dhash(image: str | os.PathLike) -> int:
+    """
+    Compute the 64-bit difference hash of an image: the sign of the horizontal gradients of a 9x8 grayscale thumbnail,
+    which survives rescaling, compression and small changes like a hover state
+
+    Args:
+        image: The path to the image file.
+
+    Returns:
+        The hash as an unsigned 64-bit integer
+    """
+    with Image.open(image) as img:
+        return image_dhash(img)
+
+
+def image_dhash(img: Image.Image) -> int:
+    """
+    Compute the difference hash of an opened image, see ``dhash``
+    """
+    thumbnail = img.convert("L").resize((9, 8), Image.Resampling.LANCZOS)
+    pixels = np.asarray(thumbnail, dtype=np.int16)
+    return int.from_bytes(np.packbits(pixels[:, 1:] > pixels[:, :-1]).tobytes(), "big")
+
+
+def hamming(a: int, b: int) -> int:
+    """
+    Count the bits that differ between two hashes
+    """
+    return (a ^ b).bit_count()
+
+
+class DuplicateIndex:
+    """
+    Near-duplicate index of the images of a folder by perceptual hash.
+
+    Hashes are persisted in the batch database of the folder and recomputed only when an image changes. The indexed
+    hashes are packed into one array, a search XORs the query against all of them at once and counts the differing
+    bits with a lookup table.
+    """
+
+    def __init__(self,
+                 folder: str | os.PathLike,
+                 max_distance: int = 6,
+                 hasher: Callable[[Path], int] = dhash):
+        """
+        Args:
+            folder: The image folder
+            max_distance: The largest Hamming distance of two near-duplicates, out of 64 bits
+            hasher: Computes the difference hash of an image path, e.g. ``ImagePreprocessor.dhash`` to share the decode
+                with the upload
+        """
+        self.folder = Path(folder)
+        self.max_distance = max_distance
+        self.hasher = hasher
+        self._lock = Lock()
+        self._conn = connect(self.folder)
+        self._conn.executescript(_SCHEMA)
+        self._names: List[str] = []
+        self._positions: Dict[str, int] = {}
+        self._hashes = np.zeros(64, dtype=np.uint64)
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def __contains__(self, image: str) -> bool:
+        return image in self._positions
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def hash(self, image: str) -> int:
+        """
+        Get the hash of an image, from the database if the image is unchanged since it was hashed
+
+        Args:
+            image: The image name relative to the folder
+        """
+        stat = (self.folder / image).stat()
+        with self._lock:
+            row = self._conn.execute("SELECT hash FROM image_hash WHERE image = ? AND mtime = ? AND size = ?",
+                                     (image, stat.st_mtime_ns, stat.st_size)).fetchone()
+        if row:
+            return row["hash"] & 0xFFFF_FFFF_FFFF_FFFF
+
+        image_hash = self.hasher(self.folder / image)
+        with self._lock:
+            # SQLite integers are signed
+            self._conn.execute("INSERT OR REPLACE INTO image_hash (image, hash, mtime, size) VALUES (?, ?, ?, ?)",
+                               (image, image_hash - (1 << 64) if image_hash >> 63 else image_hash, stat.st_mtime_ns,
+                                stat.st_size))
+        return image_hash
+
+    def load(self, images: Iterable[str]) -> int:
+        """
+        Add the images that have been hashed before to the index, without hashing the others
+
+        Returns:
+            The number of images added
+        """
+        images = set(images)
+        with self._lock:
+            rows = self._conn.execute("SELECT image, hash FROM image_hash").fetchall()
+        added = 0
+        for row in rows:
+            if row["image"] in images:
+                self.add(row["image"], row["hash"] & 0xFFFF_FFFF_FFFF_FFFF)
+                added += 1
+        return added
+
+    def add(self, image: str, image_hash: Optional[int] = None) -> None:
+        """
+        Add an image to the index, replacing its previous hash
+
+        Args:
+            image: The image name relative to the folder
+            image_hash: The hash of the image, computed if not given
+        """
+        if image_hash is None:
+            image_hash = self.hash(image)
+        with self._lock:
+            if (position := self._positions.get(image)) is None:
+                position = len(self._names)
+                if position == len(self._hashes):
+                    self._hashes = np.concatenate([self._hashes, np.zeros_like(self._hashes)])
+                self._names.append(image)
+                self._positions[image] = position
+            self._hashes[position] = image_hash
+
+    def remove(self, image: str) -> bool:
+        """
+        Remove an image from the index, e.g. because its result could not be produced
+
+        Returns:
+            Whether the image was indexed
+        """
+        with self._lock:
+            if (position := self._positions.pop(image, None)) is None:
+                return False
+            # Move the last image into the gap
+            last = self._names.pop()
+            if last != image:
+                self._names[position] = last
+                self._positions[last] = position
+                self._hashes[position] = self._hashes[len(self._names)]
+            return True
+
+    def matches(self, image_hash: int, max_distance: Optional[int] = None,
+                exclude: Optional[str] = None) -> List[Tuple[str, int]]:
+        """
+        Find the indexed images near a hash
+
+        Args:
+            image_hash: The hash to search for
+            max_distance: The largest Hamming distance, the one of the index by default
+            exclude: An image to leave out, e.g. the one searched for
+
+        Returns:
+            The image names and their distances, nearest first
+        """
+        max_distance = self.max_distance if max_distance is None else max_distance
+        with self._lock:
+            count = len(self._names)
+            differences = self._hashes[:count] ^ np.uint64(image_hash)
+            distances = _POPCOUNT[differences.view(np.uint8)].reshape(count, 8).sum(axis=1)
+            candidates = np.flatnonzero(distances <= max_distance)
+            found = sorted(((self._names[i], int(distances[i])) for i in candidates), key=lambda match: match[1])
+        return [match for match in found if match[0] != exclude]
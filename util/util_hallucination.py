@@ -1,41 +1,151 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List
+from typing import List, Optional
 
-from constant import PROMPT_HALLUCINATION
-from entity import Detail
+from constant import PROMPT_HALLUCINATION, PROMPT_HALLUCINATION_BATCH
+from entity import CodeBlock, Detail, ModelSettings
 from util import chat
+from .util_cost import text_tokens
+from .util_selector import SourceIndex, precheck_rules, precheck_selectors
+from .util_source import read_source
 
+# Languages the check understands, blocks of other languages are not checked
+CHECKED_LANGUAGES = {"python", "javascript", "typescript"}
 
-def hallucination(image_path: Path) -> List[bool]:
+# Text tokens of a request checking all blocks of an image at once, within the smallest context windows of the
+# supported models together with the screenshot and the answer
+MAX_BATCH_TOKENS = 24_000
+
+
+def hallucination(image_path: Path,
+                  model_settings: Optional[ModelSettings] = None,
+                  detail: Optional[Detail] = None,
+                  *,
+                  max_tokens: int = MAX_BATCH_TOKENS,
+                  max_workers: int = 4,
+                  precheck: bool = True) -> List[Optional[bool]]:
     """
     Detect if the test code is not correct and the hallucination exists in the test code given the screenshot and source code.
 
+    Blocks that look an element up by an id or test id missing from every source file of the project are flagged
+    without a request, see ``precheck_selectors``. The other blocks are checked in a single request that answers one
+    verdict per block. If that prompt exceeds ``max_tokens`` or the answer cannot be parsed, every block is checked in
+    a request of its own, concurrently.
+
     Args:
         image_path: The path to the image file.
+        model_settings: Model settings to use instead of the saved ones.
+        detail: The detail of the image, loaded from the sidecar if not given.
+        max_tokens: The most estimated text tokens of the request checking all blocks at once.
+        max_workers: The most requests running at once when every block is checked on its own.
+        precheck: Whether to flag blocks with selectors missing from the project before asking the model.
 
     Returns:
-        A list of boolean values indicating if the test code is not correct and the hallucination not exists in the test code
-        given the screenshot and source code.
+        The verdict of every code block, True if a hallucination exists, or None if the block is not checked because
+        of its language or an empty source file.
     """
-    detail = Detail.load(str(image_path) + ".json")
+    detail = detail or Detail.load(str(image_path) + ".json")
     if not detail.project or not detail.location:
         raise ValueError("Cannot read source code from detail")
 
-    rst = []
-    for code in detail.code:
-        if code.language.lower() not in {"python", "javascript", "typescript"}:
-            rst.append(True)
-            continue
+    checked = [i for i, code in enumerate(detail.code) if code.language.lower() in CHECKED_LANGUAGES]
+    rst: List[Optional[bool]] = [None] * len(detail.code)
+    if not checked:
+        return rst
+
+    source_path = Path(detail.project).joinpath(detail.location)
+    source_code = read_source(source_path)
+    if source_code is None:
+        raise FileNotFoundError(f"Source code not found: {source_path}")
+    if not source_code:
+        return rst
 
-        if source_code := Path(detail.project).joinpath(detail.location).read_text():
-            system = PROMPT_HALLUCINATION
+    if precheck:
+        index = SourceIndex(source_code)
+        for i in checked:
+            if precheck_selectors(detail.code[i].code or "", index, detail.project):
+                rst[i] = True
+        checked = [i for i in checked if rst[i] is None]
+        if not checked:
+            return rst
+
+    blocks = [detail.code[i] for i in checked]
+    verdicts = None
+    if len(blocks) > 1:
+        text = _batch_text(blocks, source_code)
+        if text_tokens(PROMPT_HALLUCINATION_BATCH) + text_tokens(text) <= max_tokens:
+            answer = chat(system=PROMPT_HALLUCINATION_BATCH, text=text, image_url=str(image_path),
+                          model_settings=model_settings)
+            verdicts = parse_verdicts(answer, len(blocks))
+
+    if verdicts is None:
+        def _check(code: CodeBlock) -> bool:
             text = "Test code: " + code.code + "\nSource code: " + source_code
-            image_url = str(image_path)
-            if (chat(system=system, text=text, image_url=image_url)).lower() == "true":
-                rst.append(True)
-            else:
-                rst.append(False)
-        else:
-            rst.append(True)
+            answer = chat(system=PROMPT_HALLUCINATION, text=text, image_url=str(image_path),
+                          model_settings=model_settings)
+            return answer.lower() == "true"
+
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(blocks)))) as executor:
+            verdicts = list(executor.map(_check, blocks))
 
+    for i, verdict in zip(checked, verdicts):
+        rst[i] = verdict
     return rst
+
+
+def verdict_rules() -> str:
+    """
+    Describe what the verdicts depend on besides the image, the code blocks, the source file and the per-block prompt:
+    the prompt checking all blocks at once, the budget deciding between one request and one per block, and the rules of
+    the precheck
+
+    Returns:
+        The rules as a JSON text, hashed into the manifest inputs of the hallucination field
+    """
+    return json.dumps({
+        "batch_prompt": PROMPT_HALLUCINATION_BATCH,
+        "max_batch_tokens": MAX_BATCH_TOKENS,
+        "precheck": precheck_rules(),
+    }, sort_keys=True)
+
+
+def _batch_text(blocks: List[CodeBlock], source_code: str) -> str:
+    """
+    Build the prompt checking several code blocks at once, the source code first so that it is a stable prefix
+    """
+    text = "Source code: " + source_code
+    for number, code in enumerate(blocks, start=1):
+        text += f"\nTest code {number}: " + code.code
+    return text
+
+
+def parse_verdicts(answer: str, count: int) -> Optional[List[bool]]:
+    """
+    Parse the verdicts of a request checking several code blocks at once
+
+    Args:
+        answer: The answer, a JSON array of booleans, possibly wrapped in other text or a code fence
+        count: The number of checked code blocks
+
+    Returns:
+        The verdict of every block, None if the answer is not an array of ``count`` verdicts
+    """
+    start, end = answer.find("["), answer.rfind("]")
+    if start < 0 or end < start:
+        return None
+    try:
+        values = json.loads(answer[start:end + 1])
+    except ValueError:
+        return None
+    if not isinstance(values, list) or len(values) != count:
+        return None
+
+    verdicts = []
+    for value in values:
+        if isinstance(value, str) and value.lower() in {"true", "false"}:
+            value = value.lower() == "true"
+        if not isinstance(value, bool):
+            return None
+        verdicts.append(value)
+    return verdicts
@@ -2,6 +2,7 @@ import base64
 import datetime
 import os
 from pathlib import Path
+from typing import Optional
 
 from PIL import Image
 
@@ -89,7 +90,20 @@ def media_type(image_url: str) -> str:
     Returns:
         image media type
     """
-    match analyze_image_file(image_url).image_format.lower():
+    return format_media_type(analyze_image_file(image_url).image_format)
+
+
+def format_media_type(image_format: Optional[str]) -> str:
+    """
+    Get the media type of a Pillow image format
+
+    Args:
+        image_format: image format, e.g. "PNG"
+
+    Returns:
+        image media type
+    """
+    match (image_format or "").lower():
         case "jpg" | "jpeg":
             _type = "image/jpeg"
         case "png":
@@ -99,5 +113,5 @@ def media_type(image_url: str) -> str:
         case "webp":
             _type = "image/webp"
         case _:
-            raise ValueError(f"Unsupported image format for chat: {analyze_image_file(image_url).image_format}")
+            raise ValueError(f"Unsupported image format for chat: {image_format}")
     return _type
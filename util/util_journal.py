@@ -0,0 +1,443 @@
+import json
+import os
+import socket
+import sqlite3
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from threading import Lock
+from typing import Any, Dict, Iterable, Iterator, List, Literal, Optional, Set, Tuple
+
+from constant import BATCH_FOLDER, BATCH_DATABASE
+
+JobStatus = Literal["running", "interrupted", "finished", "discarded"]
+ItemStatus = Literal["pending", "running", "finished", "skipped", "failed", "canceled"]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS job
+(
+    id      INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind    TEXT NOT NULL,
+    status  TEXT NOT NULL,
+    config  TEXT NOT NULL,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS item
+(
+    job_id   INTEGER NOT NULL REFERENCES job (id),
+    seq      INTEGER NOT NULL,
+    image    TEXT    NOT NULL,
+    status   TEXT    NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error    TEXT,
+    updated  REAL    NOT NULL,
+    owner    TEXT,
+    lease    REAL,
+    latency       REAL,
+    input_tokens  INTEGER,
+    output_tokens INTEGER,
+    model         TEXT,
+    PRIMARY KEY (job_id, image)
+);
+CREATE INDEX IF NOT EXISTS item_status ON item (job_id, status, seq);
+"""
+
+# Columns added after the first release of the schema
+_MIGRATIONS = {
+    "owner": "ALTER TABLE item ADD COLUMN owner TEXT",
+    "lease": "ALTER TABLE item ADD COLUMN lease REAL",
+    "latency": "ALTER TABLE item ADD COLUMN latency REAL",
+    "input_tokens": "ALTER TABLE item ADD COLUMN input_tokens INTEGER",
+    "output_tokens": "ALTER TABLE item ADD COLUMN output_tokens INTEGER",
+    "model": "ALTER TABLE item ADD COLUMN model TEXT",
+}
+
+# An item can be claimed if nobody works on it, if the lease of its owner expired, or if it failed with attempts left
+_CLAIMABLE = "(status IN ('pending', 'canceled') OR (status = 'running' AND lease < :now) " \
+             "OR (status = 'failed' AND attempts < :max_attempts))"
+
+# Attempts of a failed item before the workers sharing a job give up on it
+MAX_ATTEMPTS = 3
+
+
+def worker_id(role: str = "worker") -> str:
+    """
+    Get a unique owner id of this process for leases, e.g. ``host:1234:worker``
+    """
+    return f"{socket.gethostname()}:{os.getpid()}:{role}"
+
+
+def batch_database(folder: str | os.PathLike) -> Path:
+    """
+    Get the path of the batch database of an image folder, creating its parent folder if needed
+
+    Args:
+        folder: The image folder.
+    """
+    path = Path(folder) / BATCH_FOLDER / BATCH_DATABASE
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def connect(folder: str | os.PathLike) -> sqlite3.Connection:
+    """
+    Open the batch database of an image folder in WAL mode, so that readers never block the writer
+
+    Args:
+        folder: The image folder.
+    """
+    conn = sqlite3.connect(batch_database(folder), timeout=30, isolation_level=None, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class BatchJournal:
+    """
+    On-disk journal of batch jobs: the job configuration, its item list and the status of every item.
+
+    Images are stored relative to the folder, so a journal stays valid when the folder is moved. The journal doubles as
+    a work queue shared by several processes: an item is claimed with a lease that its owner renews by heartbeats, and
+    an item whose lease expired, e.g. because its worker crashed, can be claimed again by anybody.
+    """
+
+    def __init__(self, folder: str | os.PathLike):
+        self.folder = Path(folder)
+        self._lock = Lock()
+        self._conn = connect(self.folder)
+        self._conn.executescript(_SCHEMA)
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(item)")}
+        for column, migration in _MIGRATIONS.items():
+            if column not in columns:
+                self._conn.execute(migration)
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def create_job(self, kind: str, images: Iterable[str], config: Optional[Dict[str, Any]] = None) -> int:
+        """
+        Record a new job and its items
+
+        Args:
+            kind: The kind of the batch, e.g. "content" or "code"
+            images: Image names relative to the folder
+            config: The job configuration
+
+        Returns:
+            The id of the job
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            job_id = conn.execute("INSERT INTO job (kind, status, config, created, updated) VALUES (?, ?, ?, ?, ?)",
+                                  (kind, "running", json.dumps(config or {}), now, now)).lastrowid
+            conn.executemany("INSERT OR IGNORE INTO item (job_id, seq, image, status, updated) VALUES (?, ?, ?, ?, ?)",
+                             ((job_id, seq, image, "pending", now) for seq, image in enumerate(images)))
+        return job_id
+
+    def open_job(self, kind: str, images: Iterable[str], config: Optional[Dict[str, Any]] = None) -> Tuple[int, bool]:
+        """
+        Join the unfinished job of a kind, or create it, atomically so that workers started together share one job
+
+        Returns:
+            The id of the job and whether it has been created
+        """
+        with self._transaction() as conn:
+            row = conn.execute("SELECT id FROM job WHERE kind = ? AND status IN ('running', 'interrupted') "
+                               "ORDER BY id DESC LIMIT 1", (kind,)).fetchone()
+            if row:
+                conn.execute("UPDATE job SET status = 'running', updated = ? WHERE id = ?", (time.time(), row["id"]))
+                return row["id"], False
+
+            now = time.time()
+            job_id = conn.execute("INSERT INTO job (kind, status, config, created, updated) VALUES (?, ?, ?, ?, ?)",
+                                  (kind, "running", json.dumps(config or {}), now, now)).lastrowid
+            conn.executemany("INSERT OR IGNORE INTO item (job_id, seq, image, status, updated) VALUES (?, ?, ?, ?, ?)",
+                             ((job_id, seq, image, "pending", now) for seq, image in enumerate(images)))
+        return job_id, True
+
+    def unfinished_job(self, kind: str) -> Optional[int]:
+        """
+        Get the latest job of a kind that has been interrupted by a crash, a restart or an abort
+
+        Args:
+            kind: The kind of the batch
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT id FROM job WHERE kind = ? AND status IN ('running', 'interrupted') "
+                                     "ORDER BY id DESC LIMIT 1", (kind,)).fetchone()
+        return row["id"] if row else None
+
+    def job_config(self, job_id: int) -> Dict[str, Any]:
+        with self._lock:
+            row = self._conn.execute("SELECT config FROM job WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row["config"]) if row else {}
+
+    def job(self, job_id: int) -> Dict[str, Any]:
+        """
+        Get the kind, status, config and the created and updated times of a job, empty if it does not exist
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM job WHERE id = ?", (job_id,)).fetchone()
+        return {**dict(row), "config": json.loads(row["config"])} if row else {}
+
+    def items(self, job_id: int) -> List[Dict[str, Any]]:
+        """
+        Get the items of a job in their original order, with their status, attempts, error, last update, latency,
+        token usage and model
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT image, status, attempts, error, updated, latency, input_tokens, "
+                                      "output_tokens, model FROM item WHERE job_id = ? ORDER BY seq",
+                                      (job_id,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def set_job_status(self, job_id: int, status: JobStatus) -> None:
+        with self._transaction() as conn:
+            conn.execute("UPDATE job SET status = ?, updated = ? WHERE id = ?", (status, time.time(), job_id))
+
+    def remaining(self, job_id: int) -> List[str]:
+        """
+        Get the images of a job that have neither finished nor been skipped yet, in their original order, except the
+        ones other workers currently hold a lease on
+        """
+        return list(self.iter_remaining(job_id))
+
+    def iter_remaining(self, job_id: int, page: int = 500) -> Iterator[str]:
+        """
+        Iterate over the remaining images of a job page by page, so that large jobs are never loaded at once
+        """
+        seq = -1
+        while True:
+            with self._lock:
+                rows = self._conn.execute("SELECT seq, image FROM item WHERE job_id = ? AND seq > ? "
+                                          "AND status NOT IN ('finished', 'skipped') "
+                                          "AND NOT (status = 'running' AND lease >= ?) ORDER BY seq LIMIT ?",
+                                          (job_id, seq, time.time(), page)).fetchall()
+            if not rows:
+                return
+            yield from (row["image"] for row in rows)
+            seq = rows[-1]["seq"]
+
+    def is_remaining(self, job_id: int, image: str) -> bool:
+        """
+        Check if an image belongs to a job and has neither finished nor been skipped yet
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM item WHERE job_id = ? AND image = ? "
+                                     "AND status NOT IN ('finished', 'skipped')", (job_id, image)).fetchone()
+        return row is not None
+
+    def remaining_count(self, job_id: int) -> int:
+        """
+        Count the images of a job that have neither finished nor been skipped yet
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT COUNT(*) AS n FROM item WHERE job_id = ? "
+                                     "AND status NOT IN ('finished', 'skipped')", (job_id,)).fetchone()
+        return row["n"]
+
+    def claim(self, job_id: int, owner: str, limit: int = 1, lease: float = 60.0, max_attempts: int = 0) -> List[str]:
+        """
+        Claim the next claimable images of a job in their original order
+
+        Args:
+            job_id: The id of the job
+            owner: The id of the claiming worker
+            limit: Maximum number of images to claim
+            lease: Seconds until the claim expires unless renewed by ``heartbeat``
+            max_attempts: Attempts of a failed image before it is no longer claimed, failed images are never claimed
+                if 0
+
+        Returns:
+            The claimed image names
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            rows = conn.execute(f"SELECT image FROM item WHERE job_id = :job AND {_CLAIMABLE} "
+                                f"ORDER BY seq LIMIT :limit",
+                                {"job": job_id, "now": now, "limit": limit, "max_attempts": max_attempts}).fetchall()
+            images = [row["image"] for row in rows]
+            conn.executemany("UPDATE item SET status = 'running', owner = ?, lease = ?, updated = ? "
+                             "WHERE job_id = ? AND image = ?",
+                             ((owner, now + lease, now, job_id, image) for image in images))
+        return images
+
+    def claim_image(self, job_id: int, image: str, owner: str, lease: float = 60.0) -> bool:
+        """
+        Claim a specific image of a job, failed images can be claimed explicitly, and an image the owner already holds
+        is claimed again with a renewed lease
+
+        Returns:
+            Whether the image has been claimed, False if it is done or another worker holds a lease on it
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            cursor = conn.execute(f"UPDATE item SET status = 'running', owner = :owner, lease = :lease, updated = :now "
+                                  f"WHERE job_id = :job AND image = :image "
+                                  f"AND (status = 'failed' OR (status = 'running' AND owner = :owner) OR {_CLAIMABLE})",
+                                  {"owner": owner, "lease": now + lease, "now": now, "job": job_id, "image": image,
+                                   "max_attempts": 0})
+        return cursor.rowcount > 0
+
+    def heartbeat(self, job_id: int, owner: str, lease: float = 60.0) -> int:
+        """
+        Renew the leases of all running images of a worker
+
+        Returns:
+            The number of renewed leases
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            cursor = conn.execute("UPDATE item SET lease = ? WHERE job_id = ? AND owner = ? AND status = 'running'",
+                                  (now + lease, job_id, owner))
+        return cursor.rowcount
+
+    def release(self, job_id: int, owner: str) -> int:
+        """
+        Return the running images of a worker to the queue, e.g. when it shuts down
+
+        Returns:
+            The number of released images
+        """
+        with self._transaction() as conn:
+            cursor = conn.execute("UPDATE item SET status = 'pending', owner = NULL, lease = NULL, updated = ? "
+                                  "WHERE job_id = ? AND owner = ? AND status = 'running'", (time.time(), job_id, owner))
+        return cursor.rowcount
+
+    def leased(self, job_id: int) -> int:
+        """
+        Count the images of a job that workers currently hold a live lease on
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT COUNT(*) AS n FROM item WHERE job_id = ? AND status = 'running' "
+                                     "AND lease >= ?", (job_id, time.time())).fetchone()
+        return row["n"]
+
+    def retries(self, job_id: int) -> Set[str]:
+        """
+        Get the images of a job that failed or were canceled in an earlier run
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT image FROM item WHERE job_id = ? AND status IN ('failed', 'canceled')",
+                                      (job_id,)).fetchall()
+        return {row["image"] for row in rows}
+
+    def failed(self, job_id: int) -> List[str]:
+        """
+        Get the images of a job whose last attempt failed, in their original order
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT image FROM item WHERE job_id = ? AND status = 'failed' ORDER BY seq",
+                                      (job_id,)).fetchall()
+        return [row["image"] for row in rows]
+
+    def mark(self, job_id: int, image: str, status: ItemStatus, error: Optional[str] = None) -> None:
+        """
+        Record the status of an item
+
+        Args:
+            job_id: The id of the job
+            image: The image name relative to the folder
+            status: The new status
+            error: The error message if the item failed
+        """
+        attempts = 1 if status in ("finished", "failed") else 0
+        with self._transaction() as conn:
+            conn.execute("UPDATE item SET status = ?, error = ?, attempts = attempts + ?, updated = ?, "
+                         "owner = NULL, lease = NULL WHERE job_id = ? AND image = ?",
+                         (status, error, attempts, time.time(), job_id, image))
+
+    def record_usage(self,
+                     job_id: int,
+                     image: str,
+                     latency: float,
+                     input_tokens: Optional[int] = None,
+                     output_tokens: Optional[int] = None,
+                     model: Optional[str] = None) -> None:
+        """
+        Record the latency and the token usage of the last request of an item, for projecting later batches and for
+        the run report. The usage is None if it is not reported, e.g. by a hallucination check, and the model is the
+        provider and model the request was sent to, see ``model_tag``
+        """
+        with self._transaction() as conn:
+            conn.execute("UPDATE item SET latency = ?, input_tokens = ?, output_tokens = ?, model = ? "
+                         "WHERE job_id = ? AND image = ?",
+                         (latency, input_tokens, output_tokens, model, job_id, image))
+
+    def history(self, kind: str, jobs: int = 20) -> Dict[str, float]:
+        """
+        Summarize the recorded usage of the latest jobs of a kind
+
+        Args:
+            kind: The kind of the batch
+            jobs: Number of latest jobs to summarize
+
+        Returns:
+            items, and per item the average input_tokens, output_tokens and latency in seconds, plus the
+            items_per_minute of the jobs while they ran, empty if nothing has been recorded
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT COUNT(*) AS n, SUM(input_tokens) AS input, SUM(output_tokens) AS output, "
+                                      "SUM(latency) AS latency, MIN(item.updated - latency) AS first, "
+                                      "MAX(item.updated) AS last FROM item JOIN job ON job.id = item.job_id "
+                                      "WHERE job.kind = ? AND item.status = 'finished' AND latency IS NOT NULL "
+                                      "GROUP BY job_id ORDER BY job_id DESC LIMIT ?", (kind, jobs)).fetchall()
+        items = sum(row["n"] for row in rows)
+        if not items:
+            return {}
+        # A resumed job has gaps between its runs, so the throughput is a lower bound
+        minutes = sum(max(row["last"] - row["first"], row["latency"] / row["n"]) for row in rows) / 60
+        return {
+            "items": items,
+            "input_tokens": sum(row["input"] or 0 for row in rows) / items,
+            "output_tokens": sum(row["output"] or 0 for row in rows) / items,
+            "latency": sum(row["latency"] for row in rows) / items,
+            "items_per_minute": items / minutes,
+        }
+
+    def counts(self, job_id: int) -> Dict[str, int]:
+        """
+        Count the items of a job by status
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) AS n FROM item WHERE job_id = ? GROUP BY status",
+                                      (job_id,)).fetchall()
+        return {row["status"]: row["n"] for row in rows}
+
+    def close_job(self, job_id: int, max_attempts: int = 0) -> JobStatus:
+        """
+        Close a job after its run, it stays resumable as long as any of its items has not finished, and running as long
+        as other workers hold leases on its items
+
+        Args:
+            job_id: The id of the job
+            max_attempts: Attempts after which a failed item is settled, see ``claim``, failed items keep the job
+                resumable if 0
+
+        Returns:
+            The new status of the job
+        """
+        if self.leased(job_id):
+            return "running"
+        with self._lock:
+            row = self._conn.execute("SELECT COUNT(*) AS n FROM item WHERE job_id = ? "
+                                     "AND status NOT IN ('finished', 'skipped') "
+                                     "AND NOT (status = 'failed' AND ? > 0 AND attempts >= ?)",
+                                     (job_id, max_attempts, max_attempts)).fetchone()
+        status: JobStatus = "interrupted" if row["n"] else "finished"
+        self.set_job_status(job_id, status)
+        return status
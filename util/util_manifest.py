@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from threading import Lock
+from typing import Dict, List, Literal, Optional
+
+from entity import Detail, ModelSettings
+from .util_ai import model_name
+from .util_hallucination import verdict_rules
+from .util_journal import connect
+from .util_source import source_cache
+
+ManifestField = Literal["content", "code", "hallucination"]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS manifest
+(
+    image       TEXT NOT NULL,
+    field       TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    inputs      TEXT NOT NULL,
+    updated     REAL NOT NULL,
+    PRIMARY KEY (image, field)
+);
+"""
+
+
+def _sha256(data: bytes | str) -> str:
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def input_hashes(field: ManifestField,
+                 image: str | os.PathLike,
+                 *,
+                 system: str,
+                 model_settings: ModelSettings,
+                 detail: Optional[Detail] = None,
+                 upload_code: bool = True) -> Dict[str, str]:
+    """
+    Hash every input that produces a sidecar field
+
+    Args:
+        field: The sidecar field, "content", "code" or "hallucination"
+        image: The path to the image file
+        system: The system prompt
+        model_settings: The model settings, API keys and hosts are not part of the inputs
+        detail: The detail the code prompt is built from, or whose code blocks are checked for hallucinations
+        upload_code: Whether the source code is part of the code prompt
+
+    Returns:
+        The hashes of the inputs by name
+    """
+    inputs = {
+        "image": _sha256(Path(image).read_bytes()),
+        "system": _sha256(system),
+        "model": _sha256(f"{model_settings.provider.value}/{model_name(model_settings)}/{model_settings.temperature}"),
+    }
+    if field == "code" and detail:
+        inputs["detail"] = _sha256(detail.model_dump_json(include={
+            "project", "location", "framework", "language", "tool", "content"}))
+        if upload_code and detail.project and detail.location:
+            inputs["source"] = source_cache.sha256(Path(detail.project) / Path(detail.location))
+    if field == "hallucination" and detail:
+        inputs["code"] = _sha256(json.dumps([[block.language, block.code] for block in detail.code]))
+        inputs["rules"] = _sha256(verdict_rules())
+        if detail.project and detail.location:
+            inputs["source"] = source_cache.sha256(Path(detail.project) / Path(detail.location))
+    return inputs
+
+
+def fingerprint(inputs: Dict[str, str]) -> str:
+    """
+    Combine the input hashes into a single fingerprint
+    """
+    return _sha256(json.dumps(inputs, sort_keys=True))
+
+
+class Manifest:
+    """
+    Per-folder manifest of the inputs that produced each sidecar field, stored in the batch database.
+
+    A field is stale when the fingerprint of its current inputs differs from the recorded one, or nothing is recorded.
+    """
+
+    def __init__(self, folder: str | os.PathLike):
+        self.folder = Path(folder)
+        self._lock = Lock()
+        self._conn = connect(self.folder)
+        self._conn.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def recorded(self, image: str, field: ManifestField) -> Optional[str]:
+        """
+        Get the fingerprint recorded for a sidecar field
+
+        Args:
+            image: The image name relative to the folder
+            field: The sidecar field
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT fingerprint FROM manifest WHERE image = ? AND field = ?",
+                                     (image, field)).fetchone()
+        return row["fingerprint"] if row else None
+
+    def images(self, field: ManifestField) -> List[str]:
+        """
+        Get the images that a sidecar field has been recorded for
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT image FROM manifest WHERE field = ?", (field,)).fetchall()
+        return [row["image"] for row in rows]
+
+    def is_stale(self, image: str, field: ManifestField, inputs: Dict[str, str]) -> bool:
+        return self.recorded(image, field) != fingerprint(inputs)
+
+    def record(self, image: str, field: ManifestField, inputs: Dict[str, str]) -> None:
+        """
+        Record the inputs that produced a sidecar field
+
+        Args:
+            image: The image name relative to the folder
+            field: The sidecar field
+            inputs: The input hashes
+        """
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO manifest (image, field, fingerprint, inputs, updated) "
+                               "VALUES (?, ?, ?, ?, ?)",
+                               (image, field, fingerprint(inputs), json.dumps(inputs), time.time()))
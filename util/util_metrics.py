@@ -0,0 +1,127 @@
+import math
+import time
+from collections import Counter, deque
+from threading import Lock
+from typing import Deque, Dict, List, Literal, Optional
+
+MetricEvent = Literal["finished", "failed", "canceled"]
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """
+    Get a percentile of some values by the nearest-rank method
+
+    Args:
+        values: The values
+        q: The percentile between 0 and 100
+
+    Returns:
+        The percentile, None if there are no values
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def format_duration(seconds: Optional[float]) -> str:
+    """
+    Format a duration as ``H:MM:SS``, or ``--:--:--`` if unknown
+    """
+    if seconds is None or math.isinf(seconds):
+        return "--:--:--"
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+class BatchMetrics:
+    """
+    Live metrics of a batch over a sliding window of worker events: throughput, latency percentiles, tokens per minute,
+    error rate by type and an ETA
+    """
+
+    def __init__(self, window: float = 300.0):
+        """
+        Args:
+            window: Length of the sliding window in seconds
+        """
+        self.window = window
+        self._lock = Lock()
+        self._started = time.monotonic()
+        # (time, event, latency, error kind)
+        self._events: Deque[tuple[float, MetricEvent, Optional[float], Optional[str]]] = deque()
+        # (time, tokens)
+        self._tokens: Deque[tuple[float, int]] = deque()
+
+    def record(self, event: MetricEvent, latency: Optional[float] = None, error_kind: Optional[str] = None) -> None:
+        """
+        Record a settled request
+
+        Args:
+            event: How the request settled
+            latency: Request latency in seconds
+            error_kind: The kind of the error of a failed request
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._events.append((now, event, latency, error_kind))
+            self._expire(now)
+
+    def record_tokens(self, tokens: int) -> None:
+        """
+        Record the tokens used by a request
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens.append((now, tokens))
+            self._expire(now)
+
+    def snapshot(self, remaining: int = 0) -> Dict[str, object]:
+        """
+        Compute the metrics of the window
+
+        Args:
+            remaining: Number of items not settled yet, for the ETA
+
+        Returns:
+            items_per_minute, p50, p95, tokens_per_minute, error_rate, errors (count by kind) and eta in seconds
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now)
+            # A window that has not been filled yet only covers the time since the start
+            span = max(1e-6, min(self.window, now - self._started))
+            settled = [event for event in self._events if event[1] != "canceled"]
+            latencies = [latency for _, event, latency, _ in settled if event == "finished" and latency is not None]
+            errors = Counter(kind or "error" for _, event, _, kind in settled if event == "failed")
+            tokens = sum(count for _, count in self._tokens)
+
+        per_second = len(settled) / span
+        return {
+            "items_per_minute": per_second * 60,
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "tokens_per_minute": tokens / span * 60,
+            "error_rate": sum(errors.values()) / len(settled) if settled else 0.0,
+            "errors": dict(errors),
+            "eta": remaining / per_second if per_second else (0.0 if not remaining else None),
+        }
+
+    def summary(self, remaining: int = 0) -> str:
+        """
+        Format the metrics as a single status line
+        """
+        metrics = self.snapshot(remaining)
+        p50, p95 = metrics["p50"], metrics["p95"]
+        latency = f"p50 {p50:.1f}s, p95 {p95:.1f}s" if p50 is not None else "p50 -, p95 -"
+        errors = ", ".join(f"{kind} {count}" for kind, count in sorted(metrics["errors"].items())) or "none"
+        return (f"{metrics['items_per_minute']:.1f} items/min | {latency} | "
+                f"{metrics['tokens_per_minute'] / 1000:.1f}k tokens/min | "
+                f"Errors {metrics['error_rate']:.0%} ({errors}) | ETA {format_duration(metrics['eta'])}")
+
+    def _expire(self, now: float) -> None:
+        while self._events and now - self._events[0][0] > self.window:
+            self._events.popleft()
+        while self._tokens and now - self._tokens[0][0] > self.window:
+            self._tokens.popleft()
@@ -0,0 +1,115 @@
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Deque, Dict, Iterable, List, Literal, Optional, Sequence, Tuple
+
+from .util_ai import classify_error
+from .util_concurrency import AIMDController
+
+StageStatus = Literal["finished", "failed", "skipped"]
+PipelineCallback = Callable[[Any, str, StageStatus, Dict[str, Any]], None]
+
+
+class PipelineStage:
+    """
+    A stage of a pipeline: a function applied to one item at a time, with its own concurrency limit
+    """
+
+    def __init__(self, name: str, func: Callable[[Any], Optional[Dict[str, Any]]], controller: AIMDController):
+        """
+        Args:
+            name: The stage name
+            func: Processes an item and returns extra fields for the progress callback. Return {"skipped": True} to
+                  pass an item on without doing any work.
+            controller: The concurrency controller of the stage, its maximum is the size of the stage's thread pool
+        """
+        self.name = name
+        self.func = func
+        self.controller = controller
+
+
+class Pipeline:
+    """
+    Runs every item through a sequence of stages independently.
+
+    An item enters the next stage as soon as it leaves the previous one, each stage has its own thread pool and
+    concurrency controller, so the total time approaches that of the slowest stage instead of the sum of all stages. An
+    item that fails a stage does not enter the later ones.
+    """
+
+    def __init__(self, stages: Sequence[PipelineStage]):
+        if not stages:
+            raise ValueError("A pipeline needs at least one stage")
+        self.stages = list(stages)
+        self._stopped = False
+
+    def stop(self) -> None:
+        """
+        Stop admitting items to any stage, running items finish their current stage
+        """
+        self._stopped = True
+
+    def run(self,
+            items: Iterable[Any],
+            on_event: Optional[PipelineCallback] = None) -> Dict[str, Dict[str, int]]:
+        """
+        Run the items through the stages, blocks until every item has left the pipeline
+
+        Args:
+            items: The items
+            on_event: Called on the calling thread with the item, the stage name, its status and extra fields each
+                      time an item leaves a stage
+
+        Returns:
+            Counts of each status by stage
+        """
+        self._stopped = False
+        queues: List[Deque[Any]] = [deque(items)] + [deque() for _ in self.stages[1:]]
+        running: Dict[Future, Tuple[int, Any, float]] = {}
+        counts = {stage.name: {"finished": 0, "failed": 0, "skipped": 0} for stage in self.stages}
+        executors = [ThreadPoolExecutor(max_workers=stage.controller.maximum, thread_name_prefix=stage.name)
+                     for stage in self.stages]
+
+        try:
+            while running or (not self._stopped and any(queues)):
+                try:
+                    if not self._stopped:
+                        # Later stages first, so that items already in the pipeline leave it sooner
+                        for depth in reversed(range(len(self.stages))):
+                            stage, queue = self.stages[depth], queues[depth]
+                            while queue and stage.controller.can_dispatch():
+                                item = queue.popleft()
+                                stage.controller.on_dispatch()
+                                future = executors[depth].submit(stage.func, item)
+                                running[future] = (depth, item, time.monotonic())
+
+                    done, _ = wait(running, timeout=1.0, return_when=FIRST_COMPLETED)
+                except KeyboardInterrupt:
+                    self.stop()
+                    continue
+
+                for future in done:
+                    depth, item, started = running.pop(future)
+                    stage = self.stages[depth]
+                    latency = time.monotonic() - started
+                    fields: Dict[str, Any] = {"latency": round(latency, 3)}
+                    try:
+                        fields.update(future.result() or {})
+                        stage.controller.on_success(latency)
+                        status: StageStatus = "skipped" if fields.pop("skipped", False) else "finished"
+                    except Exception as e:
+                        error_kind = classify_error(e)
+                        stage.controller.on_failure(error_kind)
+                        status = "failed"
+                        fields.update(error=str(e), error_kind=error_kind)
+
+                    counts[stage.name][status] += 1
+                    if status != "failed" and depth + 1 < len(self.stages):
+                        queues[depth + 1].append(item)
+                    if on_event:
+                        on_event(item, stage.name, status, fields)
+        finally:
+            for executor in executors:
+                executor.shutdown(wait=True, cancel_futures=True)
+
+        return counts
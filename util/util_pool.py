@@ -0,0 +1,299 @@
+import json
+import os
+import time
+from collections import deque
+from pathlib import Path
+from threading import Lock
+from typing import Any, Deque, Dict, Generic, List, Optional, Tuple, TypeVar
+
+from entity import ModelProvider, ModelSettings
+from .util_ai import model_tag
+from .util_concurrency import AIMDController
+from .util_cost import price
+from .util_qt import read_settings
+
+T = TypeVar("T")
+
+
+class RateLimiter:
+    """
+    Token bucket on the requests per minute of a provider pool, e.g. the rate limit of its API key
+    """
+
+    def __init__(self, rpm: Optional[float] = None, burst: Optional[int] = None):
+        """
+        Args:
+            rpm: The requests per minute, unlimited if None
+            burst: The requests that may start at once, ten seconds worth of requests by default
+        """
+        self.rpm = rpm
+        self.burst = burst or max(1, round(rpm / 6)) if rpm else 0
+        self._lock = Lock()
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+
+    def ready(self) -> bool:
+        """Check if a request may be started now"""
+        if not self.rpm:
+            return True
+        with self._lock:
+            self._refill()
+            return self._tokens >= 1
+
+    def acquire(self) -> None:
+        """Record that a request has been started"""
+        if not self.rpm:
+            return
+        with self._lock:
+            self._refill()
+            self._tokens -= 1
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rpm / 60)
+        self._updated = now
+
+
+class ProviderPool:
+    """
+    A provider, model and API key a batch sends requests to, with its own concurrency controller and rate limiter
+    """
+
+    def __init__(self,
+                 name: str,
+                 model_settings: ModelSettings,
+                 *,
+                 max_concurrency: int = 16,
+                 rpm: Optional[float] = None,
+                 controller: Optional[AIMDController] = None):
+        """
+        Args:
+            name: The name of the pool in logs and reports
+            model_settings: The model settings requests of the pool are sent with
+            max_concurrency: The most requests of the pool running at once
+            rpm: The most requests of the pool started per minute, unlimited if None
+            controller: The concurrency controller, a new one up to ``max_concurrency`` if None
+        """
+        self.name = name
+        self.model_settings = model_settings
+        self.max_concurrency = controller.maximum if controller else max_concurrency
+        self.rpm = rpm
+        self.controller = controller or AIMDController(maximum=max_concurrency)
+        self.limiter = RateLimiter(rpm)
+        self.dispatched = 0
+        self.stolen = 0
+
+    @property
+    def tag(self) -> str:
+        """The provider and model results of the pool are tagged with, see ``model_tag``"""
+        return model_tag(self.model_settings)
+
+    @property
+    def config(self) -> Tuple[str, ModelSettings, int, Optional[float]]:
+        """The configuration of the pool, to tell whether it changed"""
+        return self.name, self.model_settings, self.max_concurrency, self.rpm
+
+    def can_dispatch(self) -> bool:
+        return self.controller.can_dispatch() and self.limiter.ready()
+
+    def on_dispatch(self) -> None:
+        self.controller.on_dispatch()
+        self.limiter.acquire()
+        self.dispatched += 1
+
+    def restart(self, *, initial: int = 2, maximum: Optional[int] = None, in_flight: int = 0) -> None:
+        """
+        Start the concurrency control over, e.g. for a retry round
+
+        Args:
+            initial: The initial limit
+            maximum: The upper bound of the limit, capped by the maximum of the pool
+            in_flight: The requests of the pool still running
+        """
+        self.controller = AIMDController(initial=initial, maximum=min(maximum or self.max_concurrency,
+                                                                      self.max_concurrency))
+        for _ in range(in_flight):
+            self.controller.on_dispatch()
+
+
+class ProviderPools(Generic[T]):
+    """
+    Shards the queue of a batch over provider pools.
+
+    Items are put into the shard of the pool with the least queued and running items per slot of its current
+    concurrency limit, so shards follow the capacity the pools have shown. Every pool takes from the front of its own
+    shard, and a pool with a free slot and an empty shard steals from the back of the most loaded one, so fast pools
+    take more items and a throttled pool never holds items back.
+    """
+
+    def __init__(self, pools: List[ProviderPool]):
+        """
+        Raises:
+            ValueError: If two pools have the same name
+        """
+        if len({pool.name for pool in pools}) != len(pools):
+            raise ValueError("The names of the provider pools are not unique")
+        self.pools = pools
+        self._shards: Dict[str, Deque[T]] = {pool.name: deque() for pool in pools}
+
+    @classmethod
+    def single(cls, model_settings: ModelSettings, max_concurrency: int = 16) -> "ProviderPools[T]":
+        """
+        Get a single pool of the model settings, the batch runs as without pools
+        """
+        return cls([ProviderPool(model_tag(model_settings), model_settings, max_concurrency=max_concurrency)])
+
+    def __len__(self) -> int:
+        return sum(len(shard) for shard in self._shards.values())
+
+    def __iter__(self):
+        return iter(self.pools)
+
+    @property
+    def primary(self) -> ProviderPool:
+        """The first pool, whose model settings describe the batch"""
+        return self.pools[0]
+
+    @property
+    def limit(self) -> int:
+        return sum(pool.controller.limit for pool in self.pools)
+
+    @property
+    def in_flight(self) -> int:
+        return sum(pool.controller.in_flight for pool in self.pools)
+
+    @property
+    def maximum(self) -> int:
+        return sum(pool.max_concurrency for pool in self.pools)
+
+    @property
+    def priced(self) -> bool:
+        """Whether the price of every model is known, so that a cost cap can be enforced"""
+        return all(price(pool.model_settings) is not None for pool in self.pools)
+
+    def pool(self, name: str) -> Optional[ProviderPool]:
+        return next((pool for pool in self.pools if pool.name == name), None)
+
+    def wants(self) -> bool:
+        """
+        Check if a shard is shorter than the concurrency limit of its pool, so that more items should be put
+        """
+        return any(len(self._shards[pool.name]) < pool.controller.limit for pool in self.pools)
+
+    def put(self, item: T) -> ProviderPool:
+        """
+        Put an item into the shard of the least loaded pool
+
+        Returns:
+            The pool
+        """
+        pool = min(self.pools, key=self._load)
+        self._shards[pool.name].append(item)
+        return pool
+
+    def next(self) -> Optional[Tuple[ProviderPool, T]]:
+        """
+        Take the next item for a pool that may start a request, the least busy pool first. The caller calls
+        ``ProviderPool.on_dispatch`` once the request is started.
+
+        Returns:
+            The pool and the item, None if no pool may start a request or all shards are empty
+        """
+        for pool in sorted((pool for pool in self.pools if pool.can_dispatch()),
+                           key=lambda pool: pool.controller.in_flight / max(1, pool.controller.limit)):
+            if shard := self._shards[pool.name]:
+                return pool, shard.popleft()
+            victim = max(self.pools, key=lambda other: len(self._shards[other.name]))
+            if self._shards[victim.name]:
+                pool.stolen += 1
+                return pool, self._shards[victim.name].pop()
+        return None
+
+    def drain(self) -> List[T]:
+        """
+        Take all items out of the shards, e.g. when the batch is aborted
+        """
+        items = [item for shard in self._shards.values() for item in shard]
+        for shard in self._shards.values():
+            shard.clear()
+        return items
+
+    def summary(self) -> str:
+        """
+        Format the limit, the running requests and the taken items of every pool
+        """
+        return ", ".join(f"{pool.name}: {pool.controller.in_flight}/{pool.controller.limit}, {pool.dispatched} taken"
+                         + (f" ({pool.stolen} stolen)" if pool.stolen else "") for pool in self.pools)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Describe every pool for the run report, its model, limits and the items it took
+        """
+        return {pool.name: {"model": pool.tag, "max_concurrency": pool.max_concurrency, "rpm": pool.rpm,
+                            "dispatched": pool.dispatched, "stolen": pool.stolen} for pool in self.pools}
+
+    def _load(self, pool: ProviderPool) -> float:
+        return (len(self._shards[pool.name]) + pool.controller.in_flight) / max(1, pool.controller.limit)
+
+
+def _read_pool(entry: Dict[str, Any], model_settings: ModelSettings, max_concurrency: int) -> ProviderPool:
+    provider = ModelProvider(entry.get("provider", model_settings.provider.value))
+    prefix = provider.value.lower()
+    update: Dict[str, Any] = {"provider": provider}
+    if "model" in entry:
+        update[f"{prefix}_model"] = entry["model"]
+    if "api_host" in entry:
+        update[f"{prefix}_api_host"] = entry["api_host"]
+    if "api_key_env" in entry:
+        if (api_key := os.environ.get(entry["api_key_env"])) is None:
+            raise ValueError(f"Environment variable {entry['api_key_env']} is not set")
+        update[f"{prefix}_api_key"] = api_key
+    elif "api_key" in entry:
+        update[f"{prefix}_api_key"] = entry["api_key"]
+    if "temperature" in entry:
+        update["temperature"] = entry["temperature"]
+    settings = ModelSettings.model_validate({**model_settings.model_dump(), **update})
+    return ProviderPool(entry.get("name") or model_tag(settings), settings,
+                        max_concurrency=int(entry.get("concurrency", max_concurrency)), rpm=entry.get("rpm"))
+
+
+def read_pools(model_settings: ModelSettings,
+               path: Optional[str | os.PathLike] = None,
+               *,
+               max_concurrency: int = 16) -> List[ProviderPool]:
+    """
+    Read the provider pools a batch is sharded over from a JSON file, a list of pools such as
+    ``{"name": "claude-2", "provider": "Claude", "model": "claude-3-5-haiku-20241022", "api_key_env": "CLAUDE_KEY_2",
+    "concurrency": 8, "rpm": 50}``. Every field is optional, the ones left out are taken from the model settings, and
+    the API key is either given as ``api_key`` or read from the environment variable ``api_key_env``.
+
+    Args:
+        model_settings: The model settings the pools are based on
+        path: The pool file, the one configured in the settings if None
+        max_concurrency: The concurrency of a pool without ``concurrency``
+
+    Returns:
+        The pools, empty if no pool file is configured
+
+    Raises:
+        ValueError: If the file cannot be read or a pool is invalid
+    """
+    if not (path := path or read_settings('Pools', 'file', default="")):
+        return []
+    try:
+        entries = json.loads(Path(path).read_text(encoding="utf-8"))
+    except (OSError, ValueError) as e:
+        raise ValueError(f"Failed to read the provider pools from {path}: {e}") from e
+    if not isinstance(entries, list) or not entries:
+        raise ValueError(f"{path} is not a list of provider pools")
+
+    pools = []
+    for number, entry in enumerate(entries, start=1):
+        try:
+            pool = _read_pool(entry, model_settings, max_concurrency)
+        except (AttributeError, TypeError, ValueError) as e:
+            raise ValueError(f"Invalid provider pool {number} in {path}: {e}") from e
+        if any(other.name == pool.name for other in pools):
+            pool.name = f"{pool.name} #{number}"
+        pools.append(pool)
+    return pools
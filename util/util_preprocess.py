@@ -0,0 +1,263 @@
+import atexit
+import base64
+import io
+import multiprocessing
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from threading import Lock
+from typing import Dict, Iterable, NamedTuple, Optional, Tuple
+
+from PIL import Image
+from loguru import logger
+
+from entity import ModelProvider
+from .util_dedup import image_dhash
+from .util_image import format_media_type
+
+# Longest edge sent to a provider. Claude rejects larger images and OpenAI fits images into 2048x2048 on its side, so
+# downscaling before the upload changes nothing the model sees
+_MAX_EDGE: Dict[ModelProvider, int] = {
+    ModelProvider.OpenAI: 2048,
+    ModelProvider.Claude: 8000,
+}
+
+
+class PreparedImage(NamedTuple):
+    media_type: str
+    # The temp file holding the base64 encoded image
+    payload: str
+    # The dimensions of the original image
+    dimensions: Tuple[int, int]
+    dhash: int
+
+
+def max_edge(provider: Optional[ModelProvider]) -> Optional[int]:
+    """
+    Get the longest image edge a provider needs, None to upload images unchanged
+    """
+    return _MAX_EDGE.get(provider)
+
+
+def prepare_image(image: str | os.PathLike, directory: str | os.PathLike, edge: Optional[int] = None) -> PreparedImage:
+    """
+    Decode, hash, downscale and base64 encode an image, the CPU-bound part of sending it. Runs in a child process, so it
+    is a module-level function.
+
+    Args:
+        image: The path to the image file.
+        directory: The directory to write the encoded image into
+        edge: The longest edge, larger images are downscaled and recompressed
+
+    Returns:
+        The prepared image
+
+    Raises:
+        ValueError: If the image format is not supported for chat
+    """
+    with Image.open(image) as img:
+        image_format = img.format
+        _type = format_media_type(image_format)
+        dimensions = img.size
+        image_hash = image_dhash(img)
+        if edge and max(dimensions) > edge:
+            img.thumbnail((edge, edge), Image.Resampling.LANCZOS)
+            if image_format not in ("JPEG", "WEBP"):
+                image_format, _type = "PNG", "image/png"
+            if image_format == "PNG" and img.mode not in ("RGB", "RGBA", "L", "LA"):
+                img = img.convert("RGBA")
+            buffer = io.BytesIO()
+            img.save(buffer, image_format, quality=90, optimize=True)
+            data = buffer.getvalue()
+        else:
+            data = Path(image).read_bytes()
+
+    fd, payload = tempfile.mkstemp(dir=directory, suffix=".b64")
+    with os.fdopen(fd, "wb") as f:
+        f.write(base64.b64encode(data))
+    return PreparedImage(_type, payload, dimensions, image_hash)
+
+
+class ImagePreprocessor:
+    """
+    Process pool for the CPU-bound preprocessing of images before they are sent.
+
+    Decoding, hashing, downscaling and encoding run in child processes, so they do not hold the GIL of the threads
+    waiting on HTTP. Encoded images are handed over through temp files and cached by path, modification time, size and
+    longest edge, so a prefetched image, its near-duplicate check and its retries share one preparation. The pool is
+    started on first use, and images are prepared on the calling thread if it cannot run.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, max_entries: int = 256):
+        """
+        Args:
+            max_workers: The number of processes, up to four by default
+            max_entries: The most prepared images kept, the least recently used ones are evicted above it
+        """
+        self.max_workers = max_workers or min(4, os.cpu_count() or 1)
+        self.max_entries = max_entries
+        self._lock = Lock()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._directory: Optional[str] = None
+        self._entries: OrderedDict[Tuple[str, int, int, Optional[int]], Future] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def submit(self, image: str | os.PathLike, edge: Optional[int] = None) -> Future:
+        """
+        Start preparing an image, or get the preparation already started
+
+        Args:
+            image: The path to the image file.
+            edge: The longest edge, see ``max_edge``
+
+        Returns:
+            The future of the ``PreparedImage``
+        """
+        path = os.path.abspath(image)
+        stat = os.stat(path)
+        key = (path, stat.st_mtime_ns, stat.st_size, edge)
+        with self._lock:
+            if (future := self._entries.get(key)) is not None:
+                self._entries.move_to_end(key)
+                return future
+            directory = self._ensure_directory()
+            pooled = self._submit(path, directory, edge)
+            # Without a pool, other threads wait on the placeholder of this image only, not on the lock
+            future = pooled or Future()
+            self._entries[key] = future
+            while len(self._entries) > self.max_entries:
+                _, evicted = self._entries.popitem(last=False)
+                evicted.add_done_callback(_remove_payload)
+        if pooled is None:
+            try:
+                future.set_result(prepare_image(path, directory, edge))
+            except Exception as e:
+                future.set_exception(e)
+        return future
+
+    def prefetch(self, images: Iterable[str | os.PathLike], edge: Optional[int] = None) -> None:
+        """
+        Start preparing images ahead of sending them, e.g. when they are dispatched
+        """
+        for image in images:
+            try:
+                self.submit(image, edge)
+            except OSError as e:
+                logger.warning(f"Failed to prefetch {image}: {e}")
+
+    def get(self, image: str | os.PathLike, edge: Optional[int] = None) -> PreparedImage:
+        """
+        Wait for the preparation of an image, the waiting thread releases the GIL
+        """
+        try:
+            return self.submit(image, edge).result()
+        except BrokenProcessPool as e:
+            return self._prepare_in_process(image, edge, e)
+
+    def encode(self, image: str | os.PathLike, edge: Optional[int] = None) -> Tuple[str, str]:
+        """
+        Get an image ready to send
+
+        Args:
+            image: The path to the image file.
+            edge: The longest edge, see ``max_edge``
+
+        Returns:
+            The media type and the base64 encoded image
+        """
+        prepared = self.get(image, edge)
+        try:
+            return prepared.media_type, Path(prepared.payload).read_text("ascii")
+        except FileNotFoundError:
+            # Evicted in the meantime
+            prepared = prepare_image(image, self._ensure_directory(), edge)
+            try:
+                return prepared.media_type, Path(prepared.payload).read_text("ascii")
+            finally:
+                os.unlink(prepared.payload)
+
+    def dhash(self, image: str | os.PathLike) -> int:
+        """
+        Get the difference hash of an image from any preparation of it, see ``dhash``
+        """
+        path = os.path.abspath(image)
+        stat = os.stat(path)
+        with self._lock:
+            futures = [future for (key_path, mtime, size, _), future in self._entries.items()
+                       if key_path == path and mtime == stat.st_mtime_ns and size == stat.st_size]
+        if not futures:
+            return self.get(image).dhash
+        try:
+            return futures[0].result().dhash
+        except BrokenProcessPool as e:
+            return self._prepare_in_process(image, None, e).dhash
+
+    def close(self) -> None:
+        """
+        Stop the processes and delete the prepared images
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+            directory, self._directory = self._directory, None
+            self._entries.clear()
+        if executor:
+            executor.shutdown(wait=True, cancel_futures=True)
+        if directory:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def _prepare_in_process(self,
+                            image: str | os.PathLike,
+                            edge: Optional[int],
+                            error: BrokenProcessPool) -> PreparedImage:
+        """
+        Drop the broken pool and its preparations, and prepare the image in process
+        """
+        logger.warning(f"Image preprocessing pool is broken, preparing {image} in process: {error}")
+        with self._lock:
+            self._executor = None
+            self._entries.clear()
+        return prepare_image(image, self._ensure_directory(), edge)
+
+    def _ensure_directory(self) -> str:
+        if self._directory is None:
+            self._directory = tempfile.mkdtemp(prefix="tcg_images_")
+        return self._directory
+
+    def _submit(self, path: str, directory: str, edge: Optional[int]) -> Optional[Future]:
+        """
+        Submit a preparation to the pool, started on first use
+
+        Returns:
+            The future of the preparation, None if the pool cannot run and the image is prepared in process
+        """
+        if self._executor is None:
+            try:
+                # Forking a process with Qt and HTTP threads is unsafe
+                self._executor = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+            except (OSError, NotImplementedError) as e:
+                logger.warning(f"Failed to start the image preprocessing pool, preparing in process: {e}")
+        if self._executor is not None:
+            try:
+                return self._executor.submit(prepare_image, path, directory, edge)
+            except (BrokenProcessPool, RuntimeError) as e:
+                logger.warning(f"Image preprocessing pool is unavailable, preparing in process: {e}")
+                self._executor = None
+        return None
+
+
+def _remove_payload(future: Future) -> None:
+    if not future.cancelled() and future.exception() is None:
+        try:
+            os.unlink(future.result().payload)
+        except OSError:
+            pass
+
+
+image_preprocessor = ImagePreprocessor()
+atexit.register(image_preprocessor.close)
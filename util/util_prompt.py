@@ -0,0 +1,78 @@
+from pathlib import Path
+from typing import Literal, Optional
+
+import constant
+from entity import Detail
+from .util_qt import read_settings
+from .util_source import read_source
+
+PromptKind = Literal["content", "code", "hallucination"]
+
+
+def system_prompt(kind: PromptKind) -> str:
+    """
+    Read the system prompt configured in the prompt settings
+
+    Args:
+        kind: "content", "code" or "hallucination", the hallucination prompt is not configurable
+    """
+    match kind:
+        case "content":
+            return read_settings('Prompt', 'content', default=constant.PROMPT_CONTENT)
+        case "code":
+            return read_settings('Prompt', 'code', default=constant.PROMPT_CODE)
+        case "hallucination":
+            return constant.PROMPT_HALLUCINATION
+        case _:
+            raise ValueError(f"Invalid prompt kind: {kind}")
+
+
+def code_prompt(detail: Detail, upload_code: bool = True) -> str:
+    """
+    Build the user prompt for code generation from the detail of an image
+
+    The project, the file location and the source code come first, and the fields of the image last, so that the
+    prompts of images of the same source file start with the same bytes after the system prompt, which providers
+    cache as a prompt prefix.
+
+    Args:
+        detail: The detail of the image
+        upload_code: Whether to include the source code file of the detail
+
+    Returns:
+        The prompt text
+    """
+    text = ""
+    if project := detail.project:
+        text += f"\nProject: {project}"
+    if location := detail.location:
+        text += f"\nFile Location: {location}"
+    if (path := source_file(detail, upload_code)) and (source_code := read_source(path)) is not None:
+        text += f"\nSource Code:\n{source_code}\n"
+
+    if framework := detail.framework:
+        text += f"\nUsing Framework: {framework}"
+    if language := detail.language:
+        text += f"\nCode Language: {language}"
+    if tool := detail.tool:
+        text += f"\nTest Tool: {tool}"
+    if content := detail.content:
+        text += f"\nImage Content: {content}"
+    return text
+
+
+def source_file(detail: Detail, upload_code: bool = True) -> Optional[Path]:
+    """
+    Get the source code file the code prompt of a detail includes, images of the same file are batched together so
+    that their requests share the cached prompt prefix
+
+    Args:
+        detail: The detail of the image
+        upload_code: Whether the source code is part of the code prompt
+
+    Returns:
+        The path to the source code file, None if the prompt includes no source code
+    """
+    if upload_code and detail.project and detail.location:
+        return Path(detail.project) / Path(detail.location)
+    return None
@@ -0,0 +1,241 @@
+import csv
+import hashlib
+import itertools
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from constant import BATCH_FOLDER
+from entity import ModelSettings, PRICE_MAP
+from .util_ai import model_name
+from .util_cluster import group_images
+from .util_cost import cost
+from .util_journal import BatchJournal
+from .util_metrics import percentile
+from .util_qt import read_settings
+
+# Upper bounds of the histogram buckets, the last bucket is open
+LATENCY_BUCKETS = (1, 2, 5, 10, 20, 30, 60, 120, 300)
+TOKEN_BUCKETS = (500, 1000, 2000, 5000, 10_000, 20_000, 50_000, 100_000)
+BYTE_BUCKETS = (100 << 10, 250 << 10, 500 << 10, 1 << 20, 2 << 20, 5 << 20, 10 << 20)
+
+CSV_COLUMNS = ("job", "kind", "provider", "model", "prompt_hash", "image", "status", "attempts", "latency",
+               "input_tokens", "output_tokens", "tokens", "bytes", "error")
+
+
+def bucket_counts(values: Iterable[float], bounds: Sequence[float]) -> List[Dict[str, Any]]:
+    """
+    Count values into histogram buckets
+
+    Args:
+        values: The values
+        bounds: The inclusive upper bounds of the buckets, in ascending order
+
+    Returns:
+        One ``{"le": bound, "count": n}`` per bucket, and a last one with the bound None for larger values
+    """
+    counts = [0] * (len(bounds) + 1)
+    for value in values:
+        counts[next((i for i, bound in enumerate(bounds) if value <= bound), len(bounds))] += 1
+    return [{"le": bound, "count": count} for bound, count in zip([*bounds, None], counts)]
+
+
+def _model_summary(items: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """
+    Sum the items and tokens per provider and model, for a batch sharded over several provider pools
+    """
+    models: Dict[str, Dict[str, Any]] = {}
+    for item in items:
+        if not item["model"]:
+            continue
+        summary = models.setdefault(item["model"], {"items": 0, "input_tokens": 0, "output_tokens": 0})
+        summary["items"] += 1
+        summary["input_tokens"] += item["input_tokens"] or 0
+        summary["output_tokens"] += item["output_tokens"] or 0
+    for tag, summary in models.items():
+        prices = PRICE_MAP.get(tag.split("/", 1)[-1])
+        summary["cost"] = (summary["input_tokens"] * prices[0] + summary["output_tokens"] * prices[1]) / 1_000_000 \
+            if prices else None
+    return models
+
+
+def _total_cost(models: Dict[str, Dict[str, Any]],
+                input_tokens: int,
+                output_tokens: int,
+                model_settings: Optional[ModelSettings]) -> Optional[float]:
+    """
+    Price the tokens of every model with its own price if the items are tagged with their model, otherwise all tokens
+    with the model the job ran with
+    """
+    if len(models) > 1:
+        costs = [summary["cost"] for summary in models.values()]
+        return sum(costs) if None not in costs else None
+    return cost(input_tokens, output_tokens, model_settings) if model_settings else None
+
+
+def report_directory(folder: str | os.PathLike, directory: Optional[str | os.PathLike] = None) -> Path:
+    """
+    Get the directory run reports are written to
+
+    Args:
+        folder: The image folder
+        directory: The directory to use, the one configured in the settings or the batch folder of the image folder
+            if None
+    """
+    if directory := directory or read_settings('Report', 'directory', default=""):
+        return Path(directory)
+    return Path(folder) / BATCH_FOLDER / "reports"
+
+
+def build_report(journal: BatchJournal,
+                 job_id: int,
+                 *,
+                 model_settings: Optional[ModelSettings] = None,
+                 run: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Build the report of a batch job from its journal
+
+    Args:
+        journal: The journal of the folder
+        job_id: The job
+        model_settings: The model settings the job ran with, for the model and the cost
+        run: Extra fields describing the run, e.g. where it ran and its concurrency
+
+    Returns:
+        The job, its model and prompt hash, a summary with latency percentiles, the histograms and every item
+    """
+    job = journal.job(job_id)
+    config = job.get("config", {})
+    system = config.get("system")
+
+    items = []
+    for item in journal.items(job_id):
+        try:
+            # The item of a related batch is a group of images, see ``group_key``
+            size = sum((journal.folder / image).stat().st_size for image in group_images(item["image"]))
+        except OSError:
+            size = None
+        tokens = (item["input_tokens"] or 0) + (item["output_tokens"] or 0) \
+            if item["input_tokens"] is not None or item["output_tokens"] is not None else None
+        items.append({
+            "image": item["image"],
+            "status": item["status"],
+            "attempts": item["attempts"],
+            "latency": round(item["latency"], 3) if item["latency"] is not None else None,
+            "input_tokens": item["input_tokens"],
+            "output_tokens": item["output_tokens"],
+            "tokens": tokens,
+            "bytes": size,
+            "model": item["model"],
+            "error": item["error"],
+            "started": item["updated"] - item["latency"] if item["latency"] is not None else None,
+            "updated": item["updated"],
+        })
+
+    latencies = [item["latency"] for item in items if item["latency"] is not None]
+    token_counts = [item["tokens"] for item in items if item["tokens"] is not None]
+    sizes = [item["bytes"] for item in items if item["bytes"] is not None]
+    input_tokens = sum(item["input_tokens"] or 0 for item in items)
+    output_tokens = sum(item["output_tokens"] or 0 for item in items)
+    statuses: Dict[str, int] = {}
+    for item in items:
+        statuses[item["status"]] = statuses.get(item["status"], 0) + 1
+    models = _model_summary(items)
+
+    # Wall time from the first request to the last result, across the runs of a resumed job
+    started = [item["started"] for item in items if item["started"] is not None]
+    duration = max(item["updated"] for item in items if item["started"] is not None) - min(started) \
+        if started else None
+    for item in items:
+        del item["started"], item["updated"]
+
+    return {
+        "job": job_id,
+        "kind": job.get("kind"),
+        "status": job.get("status"),
+        "folder": str(journal.folder),
+        "created": job.get("created"),
+        "generated": time.time(),
+        "provider": model_settings.provider.value if model_settings else config.get("provider"),
+        "model": model_name(model_settings) if model_settings else None,
+        "prompt_hash": hashlib.sha256(system.encode("utf-8")).hexdigest()[:16] if system else None,
+        "run": run or {},
+        "summary": {
+            "items": len(items),
+            "statuses": statuses,
+            "attempts": sum(item["attempts"] for item in items),
+            "retried": sum(1 for item in items if item["attempts"] > 1),
+            "latency": {
+                "mean": round(sum(latencies) / len(latencies), 3) if latencies else None,
+                **{f"p{q}": percentile(latencies, q) for q in (50, 90, 99)},
+                "max": max(latencies, default=None),
+            },
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "bytes": sum(sizes),
+            "cost": _total_cost(models, input_tokens, output_tokens, model_settings),
+            "models": models,
+            "duration": round(duration, 3) if duration is not None else None,
+            "items_per_minute": round(len(latencies) / duration * 60, 2) if duration else None,
+        },
+        "histograms": {
+            "latency": bucket_counts(latencies, LATENCY_BUCKETS),
+            "tokens": bucket_counts(token_counts, TOKEN_BUCKETS),
+            "bytes": bucket_counts(sizes, BYTE_BUCKETS),
+        },
+        "items": items,
+    }
+
+
+def write_report(report: Dict[str, Any], directory: str | os.PathLike) -> Tuple[Path, Path]:
+    """
+    Write a report as JSON, and its items as CSV with the job, model and prompt hash on every row, so that the rows of
+    several runs can be concatenated and compared
+
+    Args:
+        report: The report, see ``build_report``
+        directory: The directory, created if needed
+
+    Returns:
+        The paths of the JSON and the CSV file
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    name = f"batch_{report['kind']}_{report['job']}_{time.strftime('%Y_%m_%d_%H_%M_%S')}"
+    # A rerun of the job within the same second
+    for run in itertools.count(2):
+        if not (directory / f"{name}.json").exists():
+            break
+        name = f"{name.rsplit('.', 1)[0]}.{run}"
+
+    json_path = directory / f"{name}.json"
+    json_path.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    csv_path = directory / f"{name}.csv"
+    with open(csv_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_COLUMNS)
+        writer.writeheader()
+        for item in report["items"]:
+            # Items sent to another provider pool carry their own provider and model
+            provider, model = item["model"].split("/", 1) if item["model"] else (report["provider"], report["model"])
+            writer.writerow({"job": report["job"], "kind": report["kind"], "prompt_hash": report["prompt_hash"],
+                             **item, "provider": provider, "model": model})
+    return json_path, csv_path
+
+
+def save_report(journal: BatchJournal,
+                job_id: int,
+                *,
+                model_settings: Optional[ModelSettings] = None,
+                directory: Optional[str | os.PathLike] = None,
+                run: Optional[Dict[str, Any]] = None) -> Tuple[Path, Path]:
+    """
+    Build the report of a batch job and write it into the report directory
+
+    Returns:
+        The paths of the JSON and the CSV file
+    """
+    report = build_report(journal, job_id, model_settings=model_settings, run=run)
+    return write_report(report, report_directory(journal.folder, directory))
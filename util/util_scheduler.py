@@ -0,0 +1,147 @@
+import heapq
+import itertools
+from typing import Dict, Generic, List, Literal, Optional, Sequence, Set, Tuple, TypeVar
+
+T = TypeVar("T")
+
+SchedulingPolicy = Literal["pinned", "current", "retry", "grouped", "shortest"]
+DEFAULT_POLICIES: Tuple[SchedulingPolicy, ...] = ("pinned", "current", "retry", "shortest")
+# Items of the same source file back to back, so that their requests share the cached prompt prefix
+GROUPED_POLICIES: Tuple[SchedulingPolicy, ...] = ("pinned", "current", "retry", "grouped", "shortest")
+
+
+class PriorityScheduler(Generic[T]):
+    """
+    Priority queue of batch items, drop-in for the FIFO queue of the batch dialogs.
+
+    Items are ordered by the policies in turn, and by insertion order last:
+
+    - pinned: items pinned by the user first
+    - current: the currently viewed item first
+    - retry: items that failed or were canceled in an earlier run first
+    - grouped: items of the same group back to back, groups in the order they were first queued, an item without a
+      group is a group of its own
+    - shortest: items with the smallest estimated size first, for fast early feedback
+
+    Pinning or changing the current item re-prioritizes lazily, stale heap entries are skipped on ``get``.
+    """
+
+    def __init__(self, policies: Sequence[SchedulingPolicy] = DEFAULT_POLICIES):
+        """
+        Args:
+            policies: The policies, the first one has the highest precedence
+        """
+        self.policies = tuple(policies)
+        self._heap: List[Tuple[tuple, int, str]] = []
+        self._items: Dict[str, T] = {}
+        self._sizes: Dict[str, int] = {}
+        self._retries: Set[str] = set()
+        self._groups: Dict[str, int] = {}
+        self._item_groups: Dict[str, int] = {}
+        self._pinned: Set[str] = set()
+        self._current: Optional[str] = None
+        self._versions: Dict[str, int] = {}
+        self._order: Dict[str, int] = {}
+        self._counter = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def empty(self) -> bool:
+        return not self._items
+
+    def put(self, key: str, item: T, *, size: int = 0, retry: bool = False, group: Optional[str] = None) -> None:
+        """
+        Add an item, replacing a queued item with the same key
+
+        Args:
+            key: The unique key of the item, e.g. the image name
+            item: The item
+            size: The estimated size of the item
+            retry: Whether the item failed or was canceled before
+            group: The group of the item, e.g. the source file of its prompt
+        """
+        self._items[key] = item
+        self._sizes[key] = size
+        if retry:
+            self._retries.add(key)
+        else:
+            self._retries.discard(key)
+        self._order.setdefault(key, next(self._counter))
+        self._item_groups[key] = self._groups.setdefault(group, self._order[key]) if group is not None \
+            else self._order[key]
+        self._push(key)
+
+    def get(self) -> T:
+        """
+        Remove and return the item with the highest priority
+
+        Raises:
+            IndexError: If the scheduler is empty
+        """
+        while self._heap:
+            _, version, key = heapq.heappop(self._heap)
+            if key in self._items and self._versions.get(key) == version:
+                self._forget(key)
+                return self._items.pop(key)
+        raise IndexError("get from an empty scheduler")
+
+    def remove(self, key: str) -> Optional[T]:
+        """
+        Remove a queued item without running it
+        """
+        self._forget(key)
+        return self._items.pop(key, None)
+
+    def pin(self, key: str, pinned: bool = True) -> None:
+        """
+        Pin or unpin an item, pinned items are kept across ``put`` calls
+        """
+        if pinned:
+            self._pinned.add(key)
+        else:
+            self._pinned.discard(key)
+        if key in self._items:
+            self._push(key)
+
+    @property
+    def current(self) -> Optional[str]:
+        return self._current
+
+    @current.setter
+    def current(self, key: Optional[str]) -> None:
+        previous, self._current = self._current, key
+        for changed in (previous, key):
+            if changed in self._items:
+                self._push(changed)
+
+    def _priority(self, key: str) -> tuple:
+        priority = []
+        for policy in self.policies:
+            match policy:
+                case "pinned":
+                    priority.append(key not in self._pinned)
+                case "current":
+                    priority.append(key != self._current)
+                case "retry":
+                    priority.append(key not in self._retries)
+                case "grouped":
+                    priority.append(self._item_groups[key])
+                case "shortest":
+                    priority.append(self._sizes.get(key, 0))
+                case _:
+                    raise ValueError(f"Invalid scheduling policy: {policy}")
+        priority.append(self._order[key])
+        return tuple(priority)
+
+    def _forget(self, key: str) -> None:
+        # Versions are kept, so that stale heap entries never match a key queued again
+        self._sizes.pop(key, None)
+        self._retries.discard(key)
+        self._item_groups.pop(key, None)
+        self._order.pop(key, None)
+
+    def _push(self, key: str) -> None:
+        version = self._versions.get(key, 0) + 1
+        self._versions[key] = version
+        heapq.heappush(self._heap, (self._priority(key), version, key))
@@ -0,0 +1,244 @@
+import functools
+import json
+import os
+import re
+import time
+from pathlib import Path
+from threading import Lock
+from typing import Dict, Iterator, List, Literal, NamedTuple, Set, Tuple
+
+from constant import BATCH_FOLDER
+from .util_source import decode_source
+
+SelectorKind = Literal["id", "class", "test_id", "text"]
+
+# An id or test id missing from the whole project is a clear hallucination, a missing class or text may come from a
+# component library, translations or data and is left to the model
+CLEAR_KINDS: Set[SelectorKind] = {"id", "test_id"}
+
+# Files an id or test id of the page may be defined in, e.g. a child component, a layout or index.html
+SOURCE_SUFFIXES = {".html", ".htm", ".vue", ".svelte", ".js", ".jsx", ".mjs", ".cjs", ".ts", ".tsx", ".py", ".php",
+                   ".ejs", ".hbs", ".pug", ".jsp", ".erb"}
+# Dependencies, build output and tooling, skipped when searching the project
+SKIPPED_DIRECTORIES = {"node_modules", "bower_components", "dist", "build", "coverage", "out", "__pycache__", "venv",
+                       BATCH_FOLDER}
+MAX_SOURCE_BYTES = 1 << 20
+# Seconds a listing of the source files of a project is reused, so that checking a folder of screenshots of the same
+# project walks it once rather than once per code block
+PROJECT_TTL = 60.0
+
+_listings: Dict[str, Tuple[float, List[Tuple[str, int, int]]]] = {}
+_listings_lock = Lock()
+
+_STRING = r"""(?P<quote>["'`])(?P<value>(?:(?!(?P=quote))[^\\\n]|\\.)*)(?P=quote)"""
+
+# Calls taking a CSS selector as their first argument, in Jest, Cypress, Playwright and Selenium
+_CSS_CALL = re.compile(
+    r"(?:\bcy\.get|\.find|\bquerySelector(?:All)?|\bquery_selector(?:_all)?|\.locator|\bwaitForSelector|"
+    r"\bwait_for_selector|\$\$?|\b(?:page|frame)\.(?:click|dblclick|fill|type|check|uncheck|hover|press|"
+    r"textContent|text_content|innerText|inner_text|isVisible|is_visible|selectOption|select_option))"
+    r"\(\s*" + _STRING)
+_TEST_ID_CALL = re.compile(r"\b(?:(?:get|query|find)(?:All)?ByTestId|get_by_test_id)\(\s*" + _STRING)
+_TEXT_CALL = re.compile(
+    r"\b(?:(?:get|query|find)(?:All)?By(?:Text|LabelText|Label|PlaceholderText|Placeholder|DisplayValue|Title|"
+    r"AltText)|get_by_(?:text|label|placeholder|title|alt_text)|cy\.contains|\.contains)\(\s*(?:[\"'`][^\"'`]*"
+    r"[\"'`]\s*,\s*)?" + _STRING)
+_ROLE_NAME = re.compile(r"\b(?:(?:get|query|find)(?:All)?ByRole|get_by_role)\([^)]*?\bname\s*[:=]\s*" + _STRING)
+_BY = re.compile(r"\bBy\.(?P<by>ID|CLASS_NAME|CSS_SELECTOR|LINK_TEXT|PARTIAL_LINK_TEXT)\s*,\s*" + _STRING)
+
+# Parts of a CSS selector
+_TEST_ID_ATTRIBUTE = re.compile(
+    r"\[\s*(?:data-testid|data-test-id|data-test|data-cy|data-qa)\s*[~|^$*]?=\s*[\"']?(?P<value>[^\"'\]]+)[\"']?\s*]")
+_ID_ATTRIBUTE = re.compile(r"\[\s*id\s*=\s*[\"']?(?P<value>[^\"'\]]+)[\"']?\s*]")
+_HAS_TEXT = re.compile(r"(?::has-text|:text(?:-is)?)\(\s*[\"'](?P<value>[^\"']+)[\"']\s*\)")
+_TEXT_ENGINE = re.compile(r"^text\s*=\s*[\"']?(?P<value>[^\"']+)[\"']?$")
+_ATTRIBUTE_OR_QUOTED = re.compile(r"\[[^\]]*]|\([^)]*\)|\"[^\"]*\"|'[^']*'")
+_ID = re.compile(r"#(?P<value>-?[A-Za-z_][\w-]*)")
+_CLASS = re.compile(r"(?<![\w-])\.(?P<value>-?[A-Za-z_][\w-]*)")
+
+_TOKEN = re.compile(r"[\w-]+")
+
+
+class Selector(NamedTuple):
+    """A reference of test code to an element of the page"""
+    kind: SelectorKind
+    value: str
+
+
+def _css_selectors(selector: str) -> List[Selector]:
+    """
+    Split a CSS or Playwright selector into the ids, classes, test ids and texts it references
+    """
+    selector = selector.strip()
+    if selector.startswith(("@", "/", "xpath=")) or "{" in selector:
+        # Cypress aliases, XPath and selectors built at runtime
+        return []
+    if match := _TEXT_ENGINE.match(selector):
+        return [Selector("text", match["value"])]
+
+    selectors = [Selector("test_id", m["value"]) for m in _TEST_ID_ATTRIBUTE.finditer(selector)]
+    selectors += [Selector("id", m["value"]) for m in _ID_ATTRIBUTE.finditer(selector)]
+    selectors += [Selector("text", m["value"]) for m in _HAS_TEXT.finditer(selector)]
+    # Attribute values, arguments of pseudo-classes and quoted parts are not ids or classes
+    selector = _ATTRIBUTE_OR_QUOTED.sub(" ", selector)
+    selectors += [Selector("id", m["value"]) for m in _ID.finditer(selector)]
+    selectors += [Selector("class", m["value"]) for m in _CLASS.finditer(selector)]
+    return selectors
+
+
+def extract_selectors(code: str) -> List[Selector]:
+    """
+    Extract the ids, classes, test ids and texts test code looks elements up by, from the selector arguments of
+    Jest, Testing Library, Cypress, Playwright and Selenium calls
+
+    Args:
+        code: The test code
+
+    Returns:
+        The selectors in the order they appear, without duplicates. Values with placeholders, e.g. of template
+        strings, are skipped.
+    """
+    found = []
+    for match in _CSS_CALL.finditer(code):
+        found.append((match.start(), _css_selectors(match["value"])))
+    for match in _TEST_ID_CALL.finditer(code):
+        found.append((match.start(), [Selector("test_id", match["value"])]))
+    for pattern in (_TEXT_CALL, _ROLE_NAME):
+        for match in pattern.finditer(code):
+            found.append((match.start(), [Selector("text", match["value"])]))
+    for match in _BY.finditer(code):
+        by = match["by"]
+        match by:
+            case "ID":
+                selectors = [Selector("id", match["value"])]
+            case "CLASS_NAME":
+                selectors = [Selector("class", match["value"])]
+            case "CSS_SELECTOR":
+                selectors = _css_selectors(match["value"])
+            case _:
+                selectors = [Selector("text", match["value"])]
+        found.append((match.start(), selectors))
+
+    selectors = {}
+    for _, group in sorted(found, key=lambda item: item[0]):
+        for selector in group:
+            if selector.value.strip() and "{" not in selector.value:
+                selectors.setdefault(selector, None)
+    return list(selectors)
+
+
+class SourceIndex:
+    """
+    Index of the identifiers, attribute values, classes and template text of a source file, to look selectors up in
+    """
+
+    def __init__(self, source: str):
+        """
+        Args:
+            source: The text of the source file
+        """
+        self.tokens: Set[str] = set(_TOKEN.findall(source))
+        # Prefixes of values built at runtime, e.g. the "row-" of :id="'row-' + index" or `row-${index}`
+        self.prefixes: Set[str] = {token for token in self.tokens if len(token) >= 3 and token[-1] in "-_"}
+        self.text = " ".join(source.split()).lower()
+
+    def __contains__(self, selector: Selector) -> bool:
+        value = selector.value.strip()
+        if selector.kind == "text":
+            return " ".join(value.split()).lower() in self.text
+        return value in self.tokens or any(value.startswith(prefix) for prefix in self.prefixes)
+
+    def missing(self, selectors: List[Selector]) -> List[Selector]:
+        """
+        Get the selectors that are not found in the source file
+        """
+        return [selector for selector in selectors if selector not in self]
+
+
+def project_files(project: str | os.PathLike) -> Iterator[Path]:
+    """
+    List the source files of a project that may define elements of a page, without dependencies and build output
+    """
+    for root, directories, files in os.walk(project):
+        directories[:] = [name for name in directories if name not in SKIPPED_DIRECTORIES and not name.startswith(".")]
+        for name in files:
+            if os.path.splitext(name)[1].lower() in SOURCE_SUFFIXES:
+                yield Path(root) / name
+
+
+def _project_listing(project: str | os.PathLike) -> List[Tuple[str, int, int]]:
+    """
+    List the source files of a project with their modification time and size, cached for ``PROJECT_TTL`` seconds
+    """
+    root = os.path.abspath(project)
+    now = time.monotonic()
+    with _listings_lock:
+        listed = _listings.get(root)
+    if listed and now - listed[0] < PROJECT_TTL:
+        return listed[1]
+
+    listing = []
+    for path in project_files(root):
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        if stat.st_size <= MAX_SOURCE_BYTES:
+            listing.append((str(path), stat.st_mtime_ns, stat.st_size))
+    with _listings_lock:
+        _listings[root] = (now, listing)
+    return listing
+
+
+@functools.lru_cache(maxsize=1024)
+def _file_index(path: str, mtime: int, size: int) -> SourceIndex:
+    """
+    Index a file of the project, cached until it changes on disk
+    """
+    with open(path, "rb") as f:
+        return SourceIndex(decode_source(f.read()))
+
+
+def precheck_rules() -> str:
+    """
+    Describe the rules of the precheck, so that verdicts are redone when the rules change
+    """
+    patterns = [_CSS_CALL, _TEST_ID_CALL, _TEXT_CALL, _ROLE_NAME, _BY, _TEST_ID_ATTRIBUTE, _ID_ATTRIBUTE, _HAS_TEXT,
+                _TEXT_ENGINE, _ATTRIBUTE_OR_QUOTED, _ID, _CLASS, _TOKEN]
+    return json.dumps({
+        "kinds": sorted(CLEAR_KINDS),
+        "suffixes": sorted(SOURCE_SUFFIXES),
+        "skipped": sorted(SKIPPED_DIRECTORIES),
+        "max_bytes": MAX_SOURCE_BYTES,
+        "patterns": [pattern.pattern for pattern in patterns],
+    }, sort_keys=True)
+
+
+def precheck_selectors(code: str, index: SourceIndex, project: str | os.PathLike) -> bool:
+    """
+    Check test code against its source file and project without a model
+
+    Ids and test ids missing from the source file are looked up in the other source files of the project, since they
+    are often defined in child components, layouts or index.html. The files of the project are listed once every
+    ``PROJECT_TTL`` seconds.
+
+    Args:
+        code: The test code
+        index: The index of the source file
+        project: The project folder
+
+    Returns:
+        True if the code looks an element up by an id or test id that no source file of the project has, which is a
+        hallucination, False if the check is left to the model
+    """
+    missing = [selector for selector in index.missing(extract_selectors(code)) if selector.kind in CLEAR_KINDS]
+    if not missing:
+        return False
+    for path, mtime, size in _project_listing(project):
+        try:
+            missing = _file_index(path, mtime, size).missing(missing)
+        except OSError:
+            continue
+        if not missing:
+            return False
+    return True
@@ -0,0 +1,142 @@
+import codecs
+import hashlib
+import locale
+import os
+from collections import OrderedDict
+from pathlib import Path
+from threading import Lock
+from typing import NamedTuple, Optional
+
+_BOMS = (
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
+
+
+def decode_source(data: bytes) -> str:
+    """
+    Decode a source file, detecting its encoding from the BOM, then trying UTF-8 and the locale encoding
+
+    Args:
+        data: The content of the file
+
+    Returns:
+        The text, undecodable bytes are replaced if no encoding fits
+    """
+    for bom, encoding in _BOMS:
+        if data.startswith(bom):
+            return data.decode(encoding, errors="replace")
+    for encoding in dict.fromkeys(("utf-8", locale.getpreferredencoding(False))):
+        try:
+            return data.decode(encoding)
+        except (UnicodeDecodeError, LookupError):
+            continue
+    return data.decode("utf-8", errors="replace")
+
+
+class _Entry(NamedTuple):
+    mtime: int
+    size: int
+    text: str
+    sha256: str
+
+
+class SourceCache:
+    """
+    Thread-safe LRU cache of source files keyed by path, modification time and size, so that screenshots of the same
+    component share one read. A file that changed on disk is read again.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        """
+        Args:
+            max_bytes: The memory cap, the least recently used files are evicted above it
+        """
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._bytes = 0
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def bytes(self) -> int:
+        return self._bytes
+
+    def read(self, path: str | os.PathLike) -> Optional[str]:
+        """
+        Read a source file
+
+        Returns:
+            The text of the file, None if it is not a file
+        """
+        entry = self._get(path)
+        return entry.text if entry else None
+
+    def sha256(self, path: str | os.PathLike) -> str:
+        """
+        Hash a source file
+
+        Returns:
+            The SHA-256 hex digest of the file, empty if it is not a file
+        """
+        entry = self._get(path)
+        return entry.sha256 if entry else ""
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _get(self, path: str | os.PathLike) -> Optional[_Entry]:
+        key = os.path.abspath(path)
+        try:
+            stat = os.stat(key)
+        except OSError:
+            return None
+        if not os.path.isfile(key):
+            return None
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry.mtime == stat.st_mtime_ns and entry.size == stat.st_size:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        # Read outside the lock, a concurrent read of the same file only costs a second read
+        data = Path(key).read_bytes()
+        entry = _Entry(stat.st_mtime_ns, stat.st_size, decode_source(data), hashlib.sha256(data).hexdigest())
+        with self._lock:
+            if old := self._entries.pop(key, None):
+                self._bytes -= old.size
+            if entry.size <= self.max_bytes:
+                self._entries[key] = entry
+                self._bytes += entry.size
+                while self._bytes > self.max_bytes:
+                    _, evicted = self._entries.popitem(last=False)
+                    self._bytes -= evicted.size
+        return entry
+
+
+source_cache = SourceCache()
+
+
+def read_source(path: str | os.PathLike) -> Optional[str]:
+    """
+    Read a source file through the process-wide cache
+
+    Args:
+        path: The path to the source file
+
+    Returns:
+        The text of the file, None if it is not a file
+    """
+    return source_cache.read(path)